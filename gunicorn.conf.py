@@ -1,3 +1,19 @@
 # Gunicorn configuration file
+import os
+
 bind = "0.0.0.0:8080"
 timeout = 180  # 3 minutes - plenty of time for the 40-second analysis
+
+# Analyses run as background jobs (services/analysis_jobs.py); an SSE request
+# only tails the job's event stream, so it holds a thread instead of a process
+worker_class = "gthread"
+workers = int(os.getenv('GUNICORN_WORKERS', '1'))
+threads = int(os.getenv('GUNICORN_THREADS', '16'))
+
+
+def worker_exit(server, worker):
+    """Flush buffered tracking counters before a worker goes away"""
+    app = getattr(worker, 'wsgi', None)
+    storage = app.config.get('TRACKING_STORAGE') if hasattr(app, 'config') else None
+    if storage is not None:
+        storage.close()
@@ -85,6 +85,51 @@ def init_redis(redis_instance):
     redis_client = redis_instance
 
 
+def _analyzed_description_key(workspace_id: str) -> str:
+    """Redis hash holding the description (and attribute record) a workspace's verdicts were computed for"""
+    return f"workspace_analysis:{workspace_id}"
+
+
+def remember_analyzed_description(workspace_id: str, description: str, attributes: Optional[Dict] = None,
+                                  only_if_missing: bool = False):
+    """
+    Record which description (and structured attributes) the workspace's verdicts
+    belong to, so re-analysis can diff against it after the description is edited.
+    """
+    if not redis_client or description is None:
+        return
+    try:
+        key = _analyzed_description_key(workspace_id)
+        if only_if_missing:
+            if redis_client.hsetnx(key, 'description', description) and attributes is not None:
+                redis_client.hset(key, 'attributes', json.dumps(attributes))
+        else:
+            redis_client.hset(key, mapping={
+                'description': description,
+                'attributes': json.dumps(attributes or {})
+            })
+    except Exception as e:
+        print(f"Warning: Failed to store analyzed description: {e}")
+
+
+def get_analyzed_description(workspace_id: str) -> tuple:
+    """
+    Description and attribute record the workspace's verdicts were computed for.
+
+    Returns:
+        Tuple of (description or None if unknown, attributes dict)
+    """
+    if not redis_client:
+        return None, {}
+    try:
+        description, attributes = redis_client.hmget(_analyzed_description_key(workspace_id),
+                                                     ['description', 'attributes'])
+        return description, json.loads(attributes) if attributes else {}
+    except Exception as e:
+        print(f"Warning: Failed to read analyzed description: {e}")
+        return None, {}
+
+
 # ============================================================================
 # DATABASE SCHEMA (Run this SQL in Supabase SQL Editor)
 # ============================================================================
@@ -622,7 +667,8 @@ def create_workspace():
         "name": "IoT Thermostat Analysis",
         "product_description": "...",
         "matched_norms": [...],
-        "all_results": {...}
+        "all_results": {...},
+        "product_attributes": {...}  (optional, kept in Redis for re-analysis)
     }
     """
     try:
@@ -662,6 +708,9 @@ def create_workspace():
         if not result.data:
             return jsonify({"error": "Failed to create workspace"}), 500
 
+        remember_analyzed_description(result.data[0]['id'], workspace['product_description'],
+                                      data.get('product_attributes') or {})
+
         # Increment products searched counter
         if redis_client:
             try:
@@ -819,6 +868,17 @@ def update_workspace(workspace_id: str):
         if not update_data:
             return jsonify({"error": "No valid fields to update"}), 400
 
+        if 'product_description' in update_data:
+            # Keep the description the stored verdicts belong to (first edit since the last analysis)
+            current = supabase.table('workspaces') \
+                .select('product_description') \
+                .eq('id', workspace_id) \
+                .eq('user_id', user_id) \
+                .execute()
+            if current.data:
+                remember_analyzed_description(workspace_id, current.data[0]['product_description'],
+                                              only_if_missing=True)
+
         # Update workspace
         result = supabase.table('workspaces') \
             .update(update_data) \
@@ -869,6 +929,12 @@ def delete_workspace(workspace_id: str):
         if not result.data:
             return jsonify({"error": "Workspace not found or not authorized"}), 404
 
+        if permanent and redis_client:
+            try:
+                redis_client.delete(_analyzed_description_key(workspace_id))
+            except Exception as e:
+                print(f"Warning: Failed to drop analyzed description: {e}")
+
         return jsonify({"success": True})
 
     except Exception as e:
@@ -990,6 +1056,105 @@ ANSWER:"""
         return jsonify({"error": f"Ask failed: {str(e)}"}), 500
 
 
+# ============================================================================
+# RE-ANALYSIS
+# ============================================================================
+
+@workspace_bp.route('/<workspace_id>/reanalyze', methods=['POST'])
+@require_auth
+def reanalyze_workspace(workspace_id: str):
+    """
+    Re-run the compliance analysis after the product description was edited.
+    Only norms whose verdict could change are re-checked; other verdicts are reused.
+
+    Returns:
+    {
+        "success": true,
+        "matched_norms": [...],
+        "analysis": {"mode": "incremental", "rechecked": 12, "reused": 58, ...}
+    }
+    """
+    try:
+        from services.package_manager import PackageManager
+        from services.product_attributes import extract_product_attributes
+        from services.reanalysis import reanalyze
+
+        user_id = get_current_user_id()
+
+        workspace = supabase.table('workspaces') \
+            .select('*') \
+            .eq('id', workspace_id) \
+            .eq('user_id', user_id) \
+            .single() \
+            .execute()
+
+        if not workspace.data:
+            return jsonify({"error": "Workspace not found"}), 404
+
+        workspace_data = workspace.data
+        new_description = workspace_data.get('product_description') or ''
+        # Without every previous verdict (older workspaces only stored matched_norms) each
+        # other norm would look unchecked - reanalyze() then runs a full analysis instead
+        previous_results = workspace_data.get('all_results')
+        if not isinstance(previous_results, list) or not previous_results:
+            print(f"Workspace {workspace_id} has no stored verdicts, re-analyzing in full")
+            previous_results = []
+
+        pkg_manager = PackageManager(supabase, redis_client)
+        allowed_databases, priority = pkg_manager.get_analysis_access(user_id)
+
+        old_description, old_attributes = get_analyzed_description(workspace_id)
+        if old_description == new_description:
+            new_attributes = old_attributes
+        else:
+            # One extraction pass for the edited description, shared by every norm check
+            new_attributes = extract_product_attributes(new_description)
+
+        matched_norms, all_results, analysis = reanalyze(
+            old_description,
+            new_description,
+            previous_results,
+            allowed_databases=allowed_databases,
+            old_attributes=old_attributes,
+            new_attributes=new_attributes,
+            priority=priority
+        )
+
+        result = supabase.table('workspaces') \
+            .update({
+                "matched_norms": matched_norms,
+                "all_results": all_results
+            }) \
+            .eq('id', workspace_id) \
+            .eq('user_id', user_id) \
+            .execute()
+
+        if not result.data:
+            return jsonify({"error": "Workspace not found or not authorized"}), 404
+
+        remember_analyzed_description(workspace_id, new_description, new_attributes)
+
+        for database in allowed_databases:
+            try:
+                pkg_manager.track_usage(
+                    user_id=user_id,
+                    database_name=database,
+                    workspace_id=workspace_id,
+                    operation='analysis'
+                )
+            except Exception as e:
+                print(f"Warning: Failed to track usage: {e}")
+
+        return jsonify({
+            "success": True,
+            "matched_norms": matched_norms,
+            "analysis": analysis
+        })
+
+    except Exception as e:
+        return jsonify({"error": f"Re-analysis failed: {str(e)}"}), 500
+
+
 # ============================================================================
 # PDF EXPORT
 # ============================================================================
@@ -6,22 +6,28 @@ from flask import Blueprint, render_template, request, jsonify, session, Respons
 import logging
 import uuid
 from datetime import datetime
+from contextlib import closing
 import json
 
 from services.product_conversation import (
     analyze_completeness,
     generate_next_question,
-    build_final_summary,
+    build_product_profile,
     answer_analysis_question
 )
-from services.norm_matcher import match_norms, match_norms_streaming
+from services.norm_matcher import match_norms
+from services.analysis_jobs import analysis_payloads, get_analysis_job_queue, save_analysis_result
+from services.session_store import get_session_store
 
 logger = logging.getLogger(__name__)
 
 develope_bp = Blueprint('develope', __name__)
 
-# In-memory storage for sessions (TODO: move to Redis)
-conversation_sessions = {}
+# Conversation sessions live in Redis (in-process fallback without REDIS_URL)
+conversation_sessions = get_session_store()
+
+# Reconnect delay the browser uses for analysis streams (ms)
+SSE_RETRY_MS = 3000
 
 
 @develope_bp.route('/develope')
@@ -81,11 +87,11 @@ def start_conversation():
             }
 
         # Store session
-        conversation_sessions[session_id] = {
+        conversation_sessions.create(session_id, {
             "history": conversation_history,
             "started": datetime.now().isoformat(),
             "complete": completeness["is_complete"]
-        }
+        })
 
         logger.info(f"Started conversation session {session_id}")
         return jsonify(response)
@@ -111,14 +117,13 @@ def respond_to_conversation():
         session_id = data.get('session_id')
         user_message = data.get('message', '').strip()
 
-        if not session_id or session_id not in conversation_sessions:
+        session_data = conversation_sessions.get(session_id, "history") if session_id else None
+        if session_data is None:
             return jsonify({"error": "Invalid session"}), 400
 
         if not user_message:
             return jsonify({"error": "No message provided"}), 400
 
-        # Get session
-        session_data = conversation_sessions[session_id]
         conversation_history = session_data["history"]
 
         # Add user response
@@ -150,6 +155,9 @@ def respond_to_conversation():
                 "missing": completeness["missing_info"]
             }
 
+        session_data["history"] = conversation_history
+        conversation_sessions.update(session_id, session_data)
+
         logger.info(f"Conversation {session_id} - complete: {completeness['is_complete']}")
         return jsonify(response)
 
@@ -187,33 +195,42 @@ def analyze_norms():
                 redis_client = None
 
             pkg_manager = PackageManager(supabase, redis_client)
-            allowed_databases = pkg_manager.get_allowed_databases(user_id)
+            allowed_databases, priority = pkg_manager.get_analysis_access(user_id)
             logger.info(f"User {user_id} has access to {len(allowed_databases)} databases: {allowed_databases}")
         except Exception as e:
             logger.warning(f"Could not get user packages (user may not be authenticated): {e}")
             allowed_databases = ['norms.json']  # Default to free tier
+            priority = 'free'
 
         data = request.get_json()
         session_id = data.get('session_id')
 
-        if not session_id or session_id not in conversation_sessions:
+        session_data = conversation_sessions.get(session_id, "history", "complete") if session_id else None
+        if session_data is None:
             return jsonify({"error": "Invalid session"}), 400
 
-        session_data = conversation_sessions[session_id]
-
         if not session_data.get("complete"):
             return jsonify({"error": "Conversation not complete"}), 400
 
         # Build final product description
-        product_description = build_final_summary(session_data["history"])
+        profile = build_product_profile(session_data["history"])
+        product_description = profile["description"]
 
         # Match norms with user's allowed databases
-        matched_norms = match_norms(product_description, max_workers=10, allowed_databases=allowed_databases)
+        analysis_stats = {}
+        matched_norms = match_norms(product_description, max_workers=10, allowed_databases=allowed_databases,
+                                    product_attributes=profile["attributes"], priority=priority,
+                                    stats_callback=analysis_stats.update)
 
         # Store results in session
-        session_data["product_description"] = product_description
-        session_data["matched_norms"] = matched_norms
-        session_data["analyzed"] = datetime.now().isoformat()
+        conversation_sessions.update(session_id, {
+            "product_description": product_description,
+            "product_attributes": profile["attributes"],
+            "matched_norms": matched_norms,
+            "analysis_stats": analysis_stats,
+            "databases": allowed_databases,
+            "analyzed": datetime.now().isoformat()
+        })
 
         # Track usage if user is authenticated
         if user_id and pkg_manager:
@@ -234,7 +251,8 @@ def analyze_norms():
             "product_description": product_description,
             "norms": matched_norms,
             "total_norms": len(matched_norms),
-            "databases_checked": allowed_databases
+            "databases_checked": allowed_databases,
+            "stats": analysis_stats
         })
 
     except Exception as e:
@@ -261,6 +279,7 @@ def analyze_norms_stream():
     user_id = None
     allowed_databases = None
     pkg_manager = None
+    priority = 'free'
 
     try:
         user_id = get_current_user_id()
@@ -271,7 +290,7 @@ def analyze_norms_stream():
             redis_client = None
 
         pkg_manager = PackageManager(supabase, redis_client)
-        allowed_databases = pkg_manager.get_allowed_databases(user_id)
+        allowed_databases, priority = pkg_manager.get_analysis_access(user_id)
         logger.info(f"User {user_id} has access to {len(allowed_databases)} databases for streaming analysis")
     except Exception as e:
         logger.warning(f"Could not get user packages (user may not be authenticated): {e}")
@@ -279,90 +298,68 @@ def analyze_norms_stream():
 
     session_id = request.args.get('session_id')
 
-    if not session_id or session_id not in conversation_sessions:
+    session_data = conversation_sessions.get(session_id, "history", "complete", "analysis_job_id") if session_id else None
+    if session_data is None:
         return jsonify({"error": "Invalid session"}), 400
 
-    session_data = conversation_sessions[session_id]
-
     if not session_data.get("complete"):
         return jsonify({"error": "Conversation not complete"}), 400
 
+    def relay(payload):
+        """Translate an analysis payload into the one sent to the client"""
+        if payload.get('phase') != 'result':
+            return payload
+
+        # Phase 3: Finalization
+        return {'phase': 'finalizing', 'status': 'Finalizing results...'}
+
     def generate():
+        """Run the analysis inside this request (no job queue available)"""
         try:
-            # Phase 1: Building summary
-            yield f"data: {json.dumps({'phase': 'summary', 'status': 'Building product summary...'})}\n\n"
-
-            product_description = build_final_summary(session_data["history"])
-
-            # Inform user which databases are being checked
-            db_count = len(allowed_databases)
-            db_list = ', '.join([db.replace('norms_', '').replace('.json', '').upper() for db in allowed_databases[:3]])
-            if db_count > 3:
-                db_list += f' and {db_count - 3} more'
-
-            yield f"data: {json.dumps({'phase': 'databases', 'status': f'Checking {db_count} database(s): {db_list}'})}\n\n"
-
-            # Phase 2: Stream norm matching with real-time progress
-            matched_norms = None
-            all_norm_results = None
-
-            for event_type, *event_data in match_norms_streaming(product_description, max_workers=10, allowed_databases=allowed_databases):
-                if event_type == 'progress':
-                    completed, total, norm_id = event_data
-
-                    # Create varied, descriptive status messages
-                    if completed <= total * 0.33:
-                        status = f"Analyzing safety requirements... ({completed}/{total})"
-                    elif completed <= total * 0.66:
-                        status = f"Checking compliance standards... ({completed}/{total})"
-                    else:
-                        status = f"Reviewing regulations... ({completed}/{total})"
-
-                    progress_data = {
-                        'phase': 'analyzing',
-                        'progress': completed,
-                        'total': total,
-                        'status': status
-                    }
-                    yield f"data: {json.dumps(progress_data)}\n\n"
-
-                elif event_type == 'complete':
-                    matched_norms = event_data[0]
-                    all_norm_results = event_data[1]  # Store ALL results for Q&A
-
-            # Phase 3: Finalization
-            yield f"data: {json.dumps({'phase': 'finalizing', 'status': 'Finalizing results...'})}\n\n"
-
-            # Store results in session - including ALL results for post-analysis Q&A
-            session_data["product_description"] = product_description
-            session_data["matched_norms"] = matched_norms
-            session_data["all_norm_results"] = all_norm_results  # NEW - for Q&A context
-            session_data["analyzed"] = datetime.now().isoformat()
-            session_data["qa_history"] = []  # Initialize Q&A history
-
-            # Track usage if user is authenticated
-            if user_id and pkg_manager:
-                for database in allowed_databases:
-                    try:
-                        pkg_manager.track_usage(
-                            user_id=user_id,
-                            database_name=database,
-                            workspace_id=None,
-                            operation='analysis'
-                        )
-                    except Exception as e:
-                        logger.warning(f"Failed to track usage: {e}")
-
-            logger.info(f"Analyzed norms for session {session_id}: {len(matched_norms)} norms matched from {len(allowed_databases)} databases")
-
-            # Phase 4: Complete with results
-            yield f"data: {json.dumps({'phase': 'complete', 'product_description': product_description, 'norms': matched_norms, 'total_norms': len(matched_norms)})}\n\n"
+            # Close the analysis as soon as the client disconnects (GeneratorExit),
+            # which cancels its pending LLM calls instead of draining them
+            with closing(analysis_payloads(session_data["history"], allowed_databases, priority)) as payloads:
+                for payload in payloads:
+                    if payload.get('phase') == 'result':
+                        save_analysis_result(session_id, user_id, allowed_databases, payload, pkg_manager)
+                    yield f"data: {json.dumps(relay(payload))}\n\n"
 
         except Exception as e:
             logger.exception(f"Error in streaming analysis: {e}")
             yield f"data: {json.dumps({'phase': 'error', 'error': str(e)})}\n\n"
 
-    response = Response(stream_with_context(generate()), mimetype='text/event-stream')
+    def tail_job(job_id, last_event_id):
+        """Tail a background analysis job; the client reconnects with Last-Event-ID"""
+        yield f"retry: {SSE_RETRY_MS}\n\n"
+        try:
+            for event_id, payload in job_queue.tail(job_id, last_event_id):
+                if payload is None:
+                    yield ": keepalive\n\n"
+                    continue
+                data = f"data: {json.dumps(relay(payload))}\n\n"
+                yield f"id: {event_id}\n{data}" if event_id else data
+
+        except Exception as e:
+            logger.exception(f"Error tailing analysis job {job_id}: {e}")
+            yield f"data: {json.dumps({'phase': 'error', 'error': str(e)})}\n\n"
+
+    job_queue = get_analysis_job_queue()
+    if job_queue is None:
+        stream = generate()
+    else:
+        # Reconnects and reloads resume (or replay) the existing job; a new job only
+        # starts when there is none, its events expired or it ended without a result
+        last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+        job_id = session_data.get("analysis_job_id")
+        phase = job_queue.last_phase(job_id) if job_id else None
+        if phase is None or (phase == 'error' and not last_event_id):
+            job_id = job_queue.submit(session_data["history"], allowed_databases, priority,
+                                      session_id=session_id, user_id=user_id)
+            conversation_sessions.update(session_id, {"analysis_job_id": job_id})
+            last_event_id = None
+        stream = tail_job(job_id, last_event_id)
+
+    response = Response(stream_with_context(stream), mimetype='text/event-stream')
     response.headers['Cache-Control'] = 'no-cache'
     response.headers['X-Accel-Buffering'] = 'no'
     return response
@@ -391,13 +388,14 @@ def ask_about_analysis():
         session_id = data.get('session_id')
         question = data.get('question', '').strip()
 
-        if not session_id or session_id not in conversation_sessions:
-            return jsonify({"error": "Invalid or expired session"}), 400
-
         if not question:
             return jsonify({"error": "Question is required"}), 400
 
-        session_data = conversation_sessions[session_id]
+        session_data = conversation_sessions.get(
+            session_id, "analyzed", "product_description", "matched_norms", "all_norm_results", "qa_history"
+        ) if session_id else None
+        if session_data is None:
+            return jsonify({"error": "Invalid or expired session"}), 400
 
         # Check if analysis has been completed
         if not session_data.get('analyzed'):
@@ -419,14 +417,12 @@ def ask_about_analysis():
         )
 
         # Store Q&A in history
-        if 'qa_history' not in session_data:
-            session_data['qa_history'] = []
-
-        session_data['qa_history'].append({
+        qa_history.append({
             "question": question,
             "answer": result["answer"],
             "timestamp": datetime.now().isoformat()
         })
+        conversation_sessions.update(session_id, {"qa_history": qa_history})
 
         logger.info(f"Q&A for session {session_id}: question_length={len(question)}")
 
@@ -440,7 +436,8 @@ def ask_about_analysis():
 @develope_bp.route('/api/develope/session/<session_id>', methods=['GET'])
 def get_session(session_id):
     """Get session data"""
-    if session_id not in conversation_sessions:
+    session_data = conversation_sessions.get(session_id)
+    if session_data is None:
         return jsonify({"error": "Session not found"}), 404
 
-    return jsonify(conversation_sessions[session_id])
+    return jsonify(session_data)
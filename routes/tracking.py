@@ -39,8 +39,18 @@ def init_tracking_routes(app, redis_client):
     """
     from services.tracking_storage import TrackingStorage
 
-    # Create storage instance
-    storage = TrackingStorage(redis_client, key_prefix="normscout_tracking")
+    # Create storage instance ("exact" keeps per-day session sets, "approximate" only HyperLogLogs)
+    storage = TrackingStorage(
+        redis_client,
+        key_prefix="normscout_tracking",
+        unique_visitors=os.getenv('TRACKING_UNIQUE_VISITORS', 'approximate'),
+        use_script=os.getenv('TRACKING_LUA_INGEST', 'true').lower() == 'true',
+        # Write-behind counters: at most one flush interval (or max events) of page
+        # metrics and hourly counts is lost if a worker is killed without shutdown
+        buffer_counters=os.getenv('TRACKING_BUFFER_COUNTERS', 'false').lower() == 'true',
+        flush_interval_ms=int(os.getenv('TRACKING_FLUSH_INTERVAL_MS', '1000')),
+        flush_max_events=int(os.getenv('TRACKING_FLUSH_MAX_EVENTS', '500'))
+    )
 
     # Store in app config for access in routes
     app.config['TRACKING_STORAGE'] = storage
@@ -110,23 +120,15 @@ def track_event():
         if not valid_events:
             return jsonify({"error": "No valid events"}), 400
 
-        # Store events
-        stored_count = storage.store_events(valid_events)
+        # Session metadata comes from the first event (user agent, language and
+        # screen size are taken from whichever events carry them by the storage)
+        first_event = valid_events[0]
+        session_data = {"event_count": len(valid_events)}
+        if first_event.get("viewport_width"):
+            session_data["viewport"] = f"{first_event['viewport_width']}x{first_event.get('viewport_height', 0)}"
 
-        # Update session metadata for first event
-        if valid_events:
-            first_event = valid_events[0]
-            session_id = first_event.get("session_id")
-
-            session_data = {
-                "user_agent": first_event.get("user_agent", ""),
-                "language": first_event.get("language", ""),
-                "viewport": f"{first_event.get('viewport_width', 0)}x{first_event.get('viewport_height', 0)}",
-                "event_count": len(valid_events)
-            }
-
-            storage.create_or_update_session(session_id, session_data)
-            storage.increment_session_counter(session_id, "total_events", len(valid_events))
+        # Store events, counters and session metadata in one round trip
+        stored_count = storage.ingest_events(valid_events, session_data)
 
         logger.info(f"Stored {stored_count} tracking events")
 
@@ -183,6 +185,8 @@ def get_page_metrics():
 
     Query parameters:
         page (optional): Specific page path
+        offset (optional): Number of pages to skip (default: 0)
+        limit (optional): Pages per response (default: 50, max: 500)
 
     Returns:
         JSON with page metrics
@@ -201,9 +205,17 @@ def get_page_metrics():
             metrics = storage.get_page_metrics(page)
             return jsonify(metrics), 200
         else:
-            # Get all page metrics
-            metrics = storage.get_all_page_metrics()
-            return jsonify({"pages": metrics}), 200
+            # Get one page of page metrics, most viewed first
+            offset = max(0, request.args.get('offset', default=0, type=int))
+            limit = max(1, min(request.args.get('limit', default=50, type=int), 500))
+
+            metrics = storage.get_all_page_metrics(offset=offset, limit=limit)
+            return jsonify({
+                "pages": metrics,
+                "offset": offset,
+                "limit": limit,
+                "total": storage.count_tracked_pages()
+            }), 200
 
     except Exception as e:
         logger.error(f"Error getting page metrics: {str(e)}", exc_info=True)
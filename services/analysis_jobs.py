@@ -0,0 +1,469 @@
+"""
+Background analysis jobs - norm analyses run on a worker pool instead of inside
+the SSE request. Jobs are queued on a Redis Stream read by a consumer group;
+each job writes its SSE payloads to its own Redis Stream, which the SSE
+endpoint only tails (resuming from Last-Event-ID after a reconnect)
+
+Data Structure (Redis):
+- analysis_jobs - Stream of queued jobs (consumer group 'analysis_workers')
+- analysis_job:{job_id}:events - Stream of SSE payloads of one job (with TTL)
+- analysis_job:{job_id}:watched - Heartbeat key refreshed while a client tails the job
+- analysis_job:{job_id}:saved - Set once the job's result is stored in the session (with TTL)
+
+Workers run as daemon threads in each web process (ANALYSIS_JOB_WORKERS per
+process), or standalone with: python -m services.analysis_jobs
+"""
+import os
+import json
+import time
+import uuid
+import socket
+import logging
+import threading
+from contextlib import closing
+from threading import Lock
+from datetime import datetime
+from typing import Optional
+
+from .norm_matcher import match_norms_streaming
+from .product_conversation import build_product_profile
+from .session_store import get_session_store
+
+logger = logging.getLogger(__name__)
+
+ANALYSIS_JOBS_ENABLED = os.getenv('ANALYSIS_JOBS_ENABLED', 'true').lower() == 'true'
+# Worker threads started in each process that uses the queue (0 = only submit/tail)
+ANALYSIS_JOB_WORKERS = int(os.getenv('ANALYSIS_JOB_WORKERS', '2'))
+# How long a job's events stay readable
+ANALYSIS_JOB_EVENTS_TTL = int(os.getenv('ANALYSIS_JOB_EVENTS_TTL', '3600'))
+# A running job is cancelled once no client has tailed it for this long (seconds)
+ANALYSIS_JOB_ABANDON_AFTER = int(os.getenv('ANALYSIS_JOB_ABANDON_AFTER', '30'))
+# Jobs left unacknowledged this long (worker died) are picked up by another worker
+ANALYSIS_JOB_CLAIM_IDLE_MS = int(os.getenv('ANALYSIS_JOB_CLAIM_IDLE_MS', str(5 * 60 * 1000)))
+
+JOBS_STREAM = "analysis_jobs"
+JOBS_GROUP = "analysis_workers"
+
+# Blocking read timeouts (ms)
+_WORKER_BLOCK_MS = 5000
+_TAIL_BLOCK_MS = 5000
+
+# Phases after which a job's event stream is finished
+FINAL_PHASES = ('complete', 'error')
+
+
+def analysis_payloads(history: list, allowed_databases: list, priority: str = None):
+    """
+    Run one analysis and yield its SSE payloads.
+
+    Besides the client-facing phases this yields one internal 'result' payload
+    (product_description, product_attributes, matched_norms, all_norm_results,
+    stats) right before 'complete', for the caller to store with save_analysis_result.
+
+    Args:
+        history: Conversation history to summarize
+        allowed_databases: Database filenames to check
+        priority: Package tier used by the fair rate limiter
+
+    Yields:
+        Payload dicts with a 'phase' key
+    """
+    # Phase 1: Building summary
+    yield {'phase': 'summary', 'status': 'Building product summary...'}
+
+    profile = build_product_profile(history)
+    product_description = profile["description"]
+    product_attributes = profile["attributes"]
+
+    # Inform user which databases are being checked
+    db_count = len(allowed_databases)
+    db_list = ', '.join([db.replace('norms_', '').replace('.json', '').upper() for db in allowed_databases[:3]])
+    if db_count > 3:
+        db_list += f' and {db_count - 3} more'
+
+    yield {'phase': 'databases', 'status': f'Checking {db_count} database(s): {db_list}'}
+
+    # Phase 2: Stream norm matching with real-time progress
+    matched_norms = None
+    all_norm_results = None
+    stats = None
+
+    # Close the matcher as soon as our consumer stops, which cancels its pending LLM calls
+    with closing(match_norms_streaming(product_description, max_workers=10,
+                                       allowed_databases=allowed_databases,
+                                       product_attributes=product_attributes,
+                                       priority=priority)) as matcher:
+        for event_type, *event_data in matcher:
+            if event_type == 'progress':
+                completed, total, norm_id = event_data
+
+                # Create varied, descriptive status messages
+                if completed <= total * 0.33:
+                    status = f"Analyzing safety requirements... ({completed}/{total})"
+                elif completed <= total * 0.66:
+                    status = f"Checking compliance standards... ({completed}/{total})"
+                else:
+                    status = f"Reviewing regulations... ({completed}/{total})"
+
+                yield {
+                    'phase': 'analyzing',
+                    'progress': completed,
+                    'total': total,
+                    'status': status
+                }
+
+            elif event_type == 'triage':
+                triaged, total_groups, group_label = event_data
+                yield {
+                    'phase': 'triage',
+                    'progress': triaged,
+                    'total': total_groups,
+                    'status': f"Screening norm categories... ({triaged}/{total_groups})"
+                }
+
+            elif event_type == 'verdict':
+                # Applicable norm resolved - lets the client show results before 'complete'
+                yield {'phase': 'verdict', 'norm': event_data[0]}
+
+            elif event_type == 'stats':
+                # Shortlist size, estimated recall, cache/rule/model decisions, LLM requests
+                stats = event_data[0]
+
+            elif event_type == 'complete':
+                matched_norms = event_data[0]
+                all_norm_results = event_data[1]  # Store ALL results for Q&A
+
+    yield {
+        'phase': 'result',
+        'product_description': product_description,
+        'product_attributes': product_attributes,
+        'matched_norms': matched_norms,
+        'all_norm_results': all_norm_results,
+        'stats': stats
+    }
+
+    # Phase 4: Complete with results
+    yield {
+        'phase': 'complete',
+        'product_description': product_description,
+        'norms': matched_norms,
+        'total_norms': len(matched_norms),
+        'stats': stats
+    }
+
+
+def save_analysis_result(session_id: str, user_id: Optional[str], allowed_databases: list, payload: dict,
+                         pkg_manager=None):
+    """
+    Store a finished analysis (the 'result' payload) in the conversation session
+    and track the user's database usage. Called once per analysis by whoever runs
+    it - the job worker or the inline SSE request - never by the streams tailing it.
+
+    Args:
+        session_id: Conversation session id
+        user_id: Authenticated user (None = anonymous, no usage tracked)
+        allowed_databases: Database filenames that were checked
+        payload: The 'result' payload from analysis_payloads
+        pkg_manager: Optional PackageManager to track usage with (created on demand)
+    """
+    matched_norms = payload['matched_norms']
+
+    # Store results in session - including ALL results for post-analysis Q&A
+    get_session_store().update(session_id, {
+        "product_description": payload['product_description'],
+        "product_attributes": payload['product_attributes'],
+        "matched_norms": matched_norms,
+        "all_norm_results": payload['all_norm_results'],
+        "analysis_stats": payload.get('stats'),
+        "databases": allowed_databases,
+        "analyzed": datetime.now().isoformat(),
+        "qa_history": []  # Initialize Q&A history
+    })
+
+    # Track usage if user is authenticated
+    if user_id:
+        try:
+            if pkg_manager is None:
+                from normscout_auth import supabase
+                from .package_manager import PackageManager
+                pkg_manager = PackageManager(supabase, None)
+            for database in allowed_databases:
+                pkg_manager.track_usage(
+                    user_id=user_id,
+                    database_name=database,
+                    workspace_id=None,
+                    operation='analysis'
+                )
+        except Exception as e:
+            logger.warning(f"Failed to track usage: {e}")
+
+    logger.info(f"Analyzed norms for session {session_id}: {len(matched_norms)} norms matched "
+                f"from {len(allowed_databases)} databases")
+
+
+class AnalysisJobQueue:
+    """
+    Redis Streams job queue for norm analyses.
+
+    submit() queues a job and returns its id, tail() follows a job's payloads
+    from any process, and worker threads (start_workers / run_forever) execute
+    queued jobs.
+    """
+
+    def __init__(self, redis_client, workers: int = ANALYSIS_JOB_WORKERS):
+        self.redis = redis_client
+        self.workers = workers
+        self._threads = []
+        self._stopping = threading.Event()
+        self._group_ready = False
+
+    def _events_key(self, job_id: str) -> str:
+        return f"analysis_job:{job_id}:events"
+
+    def _watched_key(self, job_id: str) -> str:
+        return f"analysis_job:{job_id}:watched"
+
+    def _saved_key(self, job_id: str) -> str:
+        return f"analysis_job:{job_id}:saved"
+
+    # ------------------------------------------------------------------------
+    # PRODUCER / TAILING
+    # ------------------------------------------------------------------------
+
+    def submit(self, history: list, allowed_databases: list, priority: str = None,
+               session_id: str = None, user_id: str = None) -> str:
+        """
+        Queue an analysis.
+
+        Args:
+            history: Conversation history to analyze
+            allowed_databases: Database filenames to check
+            priority: Package tier used by the fair rate limiter
+            session_id: Conversation session the worker stores the result in
+            user_id: Authenticated user whose usage the worker tracks
+
+        Returns:
+            Job id (tail it with tail())
+        """
+        job_id = uuid.uuid4().hex
+        job = {
+            'job_id': job_id,
+            'history': history,
+            'allowed_databases': allowed_databases,
+            'priority': priority,
+            'session_id': session_id,
+            'user_id': user_id,
+            'submitted': time.time()
+        }
+
+        self._append(job_id, {'phase': 'queued', 'status': 'Waiting for an analysis worker...'})
+        pipeline = self.redis.pipeline()
+        pipeline.setex(self._watched_key(job_id), ANALYSIS_JOB_ABANDON_AFTER, 1)
+        pipeline.xadd(JOBS_STREAM, {'job': json.dumps(job)})
+        pipeline.execute()
+
+        logger.info(f"Queued analysis job {job_id} ({len(allowed_databases)} databases)")
+        return job_id
+
+    def last_phase(self, job_id: str) -> Optional[str]:
+        """Phase of the job's latest payload, or None once its events have expired"""
+        last = self.redis.xrevrange(self._events_key(job_id), count=1)
+        if not last:
+            return None
+        return json.loads(last[0][1]['data']).get('phase')
+
+    def is_finished(self, job_id: str) -> bool:
+        """True if the job's last payload is final (or its events are gone)"""
+        return self.last_phase(job_id) in FINAL_PHASES + (None,)
+
+    def tail(self, job_id: str, last_event_id: str = '0'):
+        """
+        Follow a job's payloads, starting after last_event_id.
+
+        Keeps the job's heartbeat alive while iterating, so a job nobody tails
+        any more is cancelled by its worker.
+
+        Yields:
+            (event_id, payload) tuples, and (None, None) while nothing new arrived
+            (lets the caller send keep-alives). Stops after a final payload.
+        """
+        events_key = self._events_key(job_id)
+        last_event_id = last_event_id or '0'
+
+        while True:
+            self.redis.setex(self._watched_key(job_id), ANALYSIS_JOB_ABANDON_AFTER, 1)
+            entries = self.redis.xread({events_key: last_event_id}, count=100, block=_TAIL_BLOCK_MS)
+
+            if not entries:
+                if not self.redis.exists(events_key):
+                    yield None, {'phase': 'error', 'error': 'Analysis job expired'}
+                    return
+                yield None, None
+                continue
+
+            for _, messages in entries:
+                for event_id, fields in messages:
+                    last_event_id = event_id
+                    payload = json.loads(fields['data'])
+                    yield event_id, payload
+                    if payload.get('phase') in FINAL_PHASES:
+                        return
+
+    def _append(self, job_id: str, payload: dict):
+        events_key = self._events_key(job_id)
+        pipeline = self.redis.pipeline()
+        pipeline.xadd(events_key, {'data': json.dumps(payload)})
+        pipeline.expire(events_key, ANALYSIS_JOB_EVENTS_TTL)
+        pipeline.execute()
+
+    # ------------------------------------------------------------------------
+    # WORKERS
+    # ------------------------------------------------------------------------
+
+    def start_workers(self):
+        """Start the worker threads for this process (idempotent)"""
+        if self._threads or self.workers <= 0:
+            return
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, args=(self._consumer_name(i),),
+                                      name=f"analysis-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logger.info(f"Started {self.workers} analysis job workers")
+
+    def run_forever(self):
+        """Run workers in the foreground until interrupted"""
+        self.start_workers()
+        try:
+            while any(thread.is_alive() for thread in self._threads):
+                time.sleep(1)
+        except KeyboardInterrupt:
+            self._stopping.set()
+
+    def _consumer_name(self, index: int) -> str:
+        return f"{socket.gethostname()}-{os.getpid()}-{index}"
+
+    def _ensure_group(self):
+        if self._group_ready:
+            return
+        try:
+            self.redis.xgroup_create(JOBS_STREAM, JOBS_GROUP, id='0', mkstream=True)
+        except Exception as e:
+            if 'BUSYGROUP' not in str(e):
+                raise
+        self._group_ready = True
+
+    def _work(self, consumer: str):
+        while not self._stopping.is_set():
+            try:
+                self._ensure_group()
+                job = self._claim_stale(consumer) or self._next_job(consumer)
+                if job:
+                    self._run(*job)
+            except Exception as e:
+                logger.error(f"Analysis worker {consumer} error: {e}")
+                time.sleep(1)
+
+    def _next_job(self, consumer: str):
+        entries = self.redis.xreadgroup(JOBS_GROUP, consumer, {JOBS_STREAM: '>'}, count=1, block=_WORKER_BLOCK_MS)
+        for _, messages in entries or []:
+            for message_id, fields in messages:
+                return message_id, fields
+        return None
+
+    def _claim_stale(self, consumer: str):
+        """Take over a job whose worker died without acknowledging it"""
+        claimed = self.redis.xautoclaim(JOBS_STREAM, JOBS_GROUP, consumer,
+                                        min_idle_time=ANALYSIS_JOB_CLAIM_IDLE_MS, start_id='0-0', count=1)
+        messages = claimed[1] if claimed and len(claimed) > 1 else []
+        for message_id, fields in messages:
+            if fields:
+                logger.warning(f"Reclaimed stale analysis job {message_id}")
+                return message_id, fields
+            # Entry was deleted from the stream - just drop it from the pending list
+            self.redis.xack(JOBS_STREAM, JOBS_GROUP, message_id)
+        return None
+
+    def _save_result(self, job: dict, payload: dict):
+        """Store the job's result and track usage - once per job, even if the job is reclaimed"""
+        if not job.get('session_id'):
+            return
+        saved_key = self._saved_key(job['job_id'])
+        if not self.redis.set(saved_key, 1, nx=True, ex=ANALYSIS_JOB_EVENTS_TTL):
+            logger.info(f"Result of analysis job {job['job_id']} already stored")
+            return
+        try:
+            save_analysis_result(job['session_id'], job.get('user_id'), job['allowed_databases'], payload)
+        except Exception:
+            # Let a rerun of the job store it
+            self.redis.delete(saved_key)
+            raise
+
+    def _run(self, message_id: str, fields: dict):
+        job = json.loads(fields['job'])
+        job_id = job['job_id']
+        started = time.time()
+        last_watch_check = started
+        logger.info(f"Running analysis job {job_id} (queued {started - job['submitted']:.1f}s)")
+
+        try:
+            with closing(analysis_payloads(job['history'], job['allowed_databases'], job.get('priority'))) as payloads:
+                for payload in payloads:
+                    if payload.get('phase') == 'result':
+                        self._save_result(job, payload)
+                        # The full result stays in the session; tailing clients only see this
+                        payload = {'phase': 'finalizing', 'status': 'Finalizing results...'}
+                    self._append(job_id, payload)
+
+                    # Nobody has tailed the job for a while - stop paying for it
+                    if time.time() - last_watch_check >= 1:
+                        last_watch_check = time.time()
+                        if not self.redis.exists(self._watched_key(job_id)):
+                            logger.info(f"Analysis job {job_id} abandoned by its client, cancelling")
+                            self._append(job_id, {'phase': 'error', 'error': 'Analysis abandoned'})
+                            break
+        except Exception as e:
+            logger.exception(f"Analysis job {job_id} failed: {e}")
+            self._append(job_id, {'phase': 'error', 'error': str(e)})
+        finally:
+            pipeline = self.redis.pipeline()
+            pipeline.xack(JOBS_STREAM, JOBS_GROUP, message_id)
+            pipeline.xdel(JOBS_STREAM, message_id)
+            pipeline.execute()
+            logger.info(f"Analysis job {job_id} finished in {time.time() - started:.1f}s")
+
+
+_job_queue = None
+_job_queue_checked = False
+_job_queue_lock = Lock()
+
+
+def get_analysis_job_queue() -> Optional[AnalysisJobQueue]:
+    """
+    Get the shared job queue (starting this process' workers), or None when
+    jobs are disabled or Redis isn't configured - callers then run analyses inline.
+    """
+    global _job_queue, _job_queue_checked
+    if not _job_queue_checked:
+        with _job_queue_lock:
+            if not _job_queue_checked:
+                redis_url = os.getenv('REDIS_URL')
+                if ANALYSIS_JOBS_ENABLED and redis_url:
+                    try:
+                        import redis
+                        _job_queue = AnalysisJobQueue(redis.from_url(redis_url, decode_responses=True))
+                        _job_queue.start_workers()
+                    except Exception as e:
+                        logger.warning(f"Analysis job queue unavailable, running analyses inline: {e}")
+                        _job_queue = None
+                _job_queue_checked = True
+    return _job_queue
+
+
+if __name__ == '__main__':
+    import redis
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    queue = AnalysisJobQueue(redis.from_url(os.environ['REDIS_URL'], decode_responses=True),
+                             workers=max(1, ANALYSIS_JOB_WORKERS))
+    queue.run_forever()
@@ -0,0 +1,461 @@
+"""
+Async LLM engine - adaptive concurrency control on a shared event loop
+The number of OpenRouter calls in flight follows AIMD: it grows by about one
+per round of successful calls and is halved when the provider answers with
+429/5xx or times out, so an analysis pushes as hard as the provider allows
+"""
+import os
+import time
+import asyncio
+import logging
+import threading
+import uuid
+from collections import deque
+from threading import Lock
+from .openrouter import call_openrouter_async, get_openrouter_client
+from .rate_limiter import get_rate_limiter, priority_weight
+
+logger = logging.getLogger(__name__)
+
+# Concurrency bounds for the adaptive limiter
+LLM_MIN_CONCURRENCY = int(os.getenv('LLM_MIN_CONCURRENCY', '2'))
+LLM_MAX_CONCURRENCY = int(os.getenv('LLM_MAX_CONCURRENCY', '64'))
+# Multiplicative decrease applied on throttling (429), server errors (5xx) and timeouts
+LLM_DECREASE_FACTOR = float(os.getenv('LLM_DECREASE_FACTOR', '0.5'))
+# Latency (EWMA) above this multiple of the best observed latency counts as congestion
+LLM_LATENCY_TOLERANCE = float(os.getenv('LLM_LATENCY_TOLERANCE', '2.0'))
+
+# Request hedging - if a call is still running after the given latency percentile
+# of recent calls to the same model, a duplicate is sent and the first answer wins
+LLM_HEDGING_ENABLED = os.getenv('LLM_HEDGING', 'false').lower() == 'true'
+LLM_HEDGE_PERCENTILE = float(os.getenv('LLM_HEDGE_PERCENTILE', '90'))
+# Process-wide cap on duplicate calls, as a fraction of all calls
+LLM_HEDGE_BUDGET = float(os.getenv('LLM_HEDGE_BUDGET', '0.05'))
+# No hedging until this many latencies were observed for the model
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv('LLM_HEDGE_MIN_SAMPLES', '20'))
+# Never hedge earlier than this (seconds)
+LLM_HEDGE_MIN_DELAY = float(os.getenv('LLM_HEDGE_MIN_DELAY', '1.0'))
+
+# Cancellation message for the losing attempt of a hedged call
+_SUPERSEDED = "superseded"
+# Outcome of a call cancelled while it waited for a rate limiter token
+_UNSENT = "unsent"
+
+
+def classify_result(result: dict) -> str:
+    """
+    Classify an OpenRouter result for the limiter.
+
+    Returns:
+        'ok', 'overload' (429, 5xx or timeout) or 'error' (anything else, no signal about load)
+    """
+    if result.get("success"):
+        return "ok"
+    if "status_code" not in result:
+        return "error"
+    status_code = result["status_code"]
+    if status_code is None or status_code == 429 or status_code >= 500:
+        return "overload"
+    return "error"
+
+
+class AdaptiveConcurrencyLimiter:
+    """
+    AIMD concurrency limiter for a single event loop.
+
+    - Success: limit += 1 / limit (about +1 per window of successful calls)
+    - Latency EWMA above LLM_LATENCY_TOLERANCE x baseline: limit *= 0.9
+    - 429 / 5xx / timeout: limit *= LLM_DECREASE_FACTOR, at most once per latency window
+    """
+
+    def __init__(self, initial: int = 10, min_limit: int = LLM_MIN_CONCURRENCY,
+                 max_limit: int = LLM_MAX_CONCURRENCY, decrease_factor: float = LLM_DECREASE_FACTOR,
+                 latency_tolerance: float = LLM_LATENCY_TOLERANCE):
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.limit = float(min(self.max_limit, max(self.min_limit, initial)))
+        self.decrease_factor = decrease_factor
+        self.latency_tolerance = latency_tolerance
+
+        self.in_flight = 0
+        self._waiters = deque()
+        self._latency_ewma = None
+        self._baseline = None
+        self._last_decrease = 0.0
+
+        self.calls = 0
+        # Calls dropped by cancellation: before they were sent / while in flight
+        self.calls_saved = 0
+        self.calls_aborted = 0
+        self.overloads = 0
+        self.decreases = 0
+        self.peak_limit = self.limit
+        self.lowest_limit = self.limit
+        self.peak_in_flight = 0
+
+    @property
+    def current_limit(self) -> int:
+        return max(self.min_limit, int(self.limit))
+
+    async def acquire(self):
+        """Wait for a free slot"""
+        while self.in_flight >= self.current_limit:
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                self.calls_saved += 1
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+                else:
+                    # Woken but cancelled before taking the slot - pass it on
+                    self._wake()
+                raise
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+
+    def try_acquire(self) -> bool:
+        """Take a slot only if one is free right now"""
+        if self.in_flight >= self.current_limit or self._waiters:
+            return False
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        return True
+
+    def release(self, latency: float, outcome: str):
+        """
+        Free a slot and adapt the limit.
+
+        Args:
+            latency: Seconds the call took
+            outcome: 'ok', 'overload', 'error' (see classify_result), 'cancelled',
+                     'unsent' (cancelled before it was sent) or 'superseded'
+                     (losing attempt of a hedged call - not counted)
+        """
+        self.in_flight -= 1
+        if outcome == "cancelled":
+            self.calls_aborted += 1
+        elif outcome == "unsent":
+            self.calls_saved += 1
+        elif outcome != "superseded":
+            self.calls += 1
+            self._adjust(latency, outcome)
+        self._wake()
+
+    def _adjust(self, latency: float, outcome: str):
+        now = time.monotonic()
+
+        if outcome == "overload":
+            self.overloads += 1
+            # One burst of 429s should only halve the limit once
+            window = self._latency_ewma or 1.0
+            if now - self._last_decrease >= window:
+                self.limit = max(self.min_limit, self.limit * self.decrease_factor)
+                self._last_decrease = now
+                self.decreases += 1
+                logger.warning(f"LLM provider overloaded, concurrency limit lowered to {self.current_limit}")
+        elif outcome == "ok":
+            self._latency_ewma = latency if self._latency_ewma is None else 0.8 * self._latency_ewma + 0.2 * latency
+            if self._baseline is None or self._latency_ewma < self._baseline:
+                self._baseline = self._latency_ewma
+            else:
+                # Let the baseline drift up slowly so one lucky call doesn't pin it forever
+                self._baseline += 0.01 * (self._latency_ewma - self._baseline)
+
+            if self._latency_ewma > self.latency_tolerance * self._baseline:
+                self.limit = max(self.min_limit, self.limit * 0.9)
+            else:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+
+        self.peak_limit = max(self.peak_limit, self.limit)
+        self.lowest_limit = min(self.lowest_limit, self.limit)
+
+    def _wake(self):
+        free = self.current_limit - self.in_flight
+        while free > 0 and self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                free -= 1
+
+    def stats(self) -> dict:
+        return {
+            "limit": self.current_limit,
+            "peak_limit": int(self.peak_limit),
+            "lowest_limit": int(self.lowest_limit),
+            "peak_in_flight": self.peak_in_flight,
+            "calls": self.calls,
+            "calls_saved": self.calls_saved,
+            "calls_aborted": self.calls_aborted,
+            "overloads": self.overloads,
+            "decreases": self.decreases,
+            "latency_ewma_ms": round(1000 * self._latency_ewma) if self._latency_ewma is not None else None
+        }
+
+
+class HedgeBudget:
+    """
+    Process-wide budget for hedged (duplicate) calls: at most ratio x calls made so far.
+    """
+
+    def __init__(self, ratio: float = LLM_HEDGE_BUDGET):
+        self.ratio = ratio
+        self._lock = Lock()
+        self.calls = 0
+        self.hedges = 0
+        self.wins = 0
+
+    def record_call(self):
+        with self._lock:
+            self.calls += 1
+
+    def try_spend(self) -> bool:
+        """Reserve one hedge if the budget allows it"""
+        with self._lock:
+            if self.hedges + 1 > self.ratio * self.calls:
+                return False
+            self.hedges += 1
+            return True
+
+    def record_win(self):
+        with self._lock:
+            self.wins += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "hedges": self.hedges,
+                "hedge_wins": self.wins,
+                "hedge_rate": round(self.hedges / self.calls, 4) if self.calls else 0
+            }
+
+
+_hedge_budget = HedgeBudget()
+
+
+def get_hedge_stats() -> dict:
+    """Hedging statistics for this process"""
+    return _hedge_budget.stats()
+
+
+def hedge_delay(model: str):
+    """
+    Seconds to wait before hedging a call to this model, or None while there
+    are too few recent latencies to pick a threshold.
+    """
+    threshold = get_openrouter_client().stats.latency_percentile(
+        LLM_HEDGE_PERCENTILE, model=model, min_samples=LLM_HEDGE_MIN_SAMPLES
+    )
+    if threshold is None:
+        return None
+    return max(LLM_HEDGE_MIN_DELAY, threshold)
+
+
+class LLMEngine:
+    """
+    Async context manager bundling a concurrency limiter for one analysis.
+    Calls share the process-wide pooled OpenRouter client.
+
+    Usage:
+        async with LLMEngine(initial_concurrency=10) as engine:
+            result = await engine.call(messages, model=...)
+    """
+
+    def __init__(self, initial_concurrency: int = 10, min_concurrency: int = LLM_MIN_CONCURRENCY,
+                 max_concurrency: int = LLM_MAX_CONCURRENCY, hedging: bool = None,
+                 flow: str = None, priority: str = None):
+        """
+        Args:
+            initial_concurrency: Starting concurrency limit
+            min_concurrency / max_concurrency: Bounds for the adaptive limit
+            hedging: Duplicate straggling calls (None = LLM_HEDGING)
+            flow: Rate limiter flow for this engine's calls (default: a new flow per engine)
+            priority: Package tier deciding the flow's weight ('free', 'trial', 'paid', 'bundle')
+        """
+        self.flow = flow or f"analysis:{uuid.uuid4().hex[:12]}"
+        self.weight = priority_weight(priority)
+        self.limiter = AdaptiveConcurrencyLimiter(initial_concurrency, min_concurrency, max_concurrency)
+        self.hedging = LLM_HEDGING_ENABLED if hedging is None else hedging
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        return False
+
+    async def call(self, messages: list, model: str, temperature: float = 0.3, max_tokens: int = 512) -> dict:
+        """
+        Make one OpenRouter call once the limiter grants a slot.
+        With hedging on, a straggling call is duplicated and the first good answer is used.
+
+        Returns:
+            Same dict shape as call_openrouter
+        """
+        _hedge_budget.record_call()
+        if not self.hedging:
+            return await self._attempt(messages, model, temperature, max_tokens)
+
+        # The hedge timer starts once the call is sent, not while it is queued
+        await self._reserve()
+        primary = asyncio.ensure_future(self._send(messages, model, temperature, max_tokens))
+        hedge = None
+        superseded = True
+
+        try:
+            delay = hedge_delay(model)
+            if delay is None:
+                return await primary
+
+            done, _ = await asyncio.wait({primary}, timeout=delay)
+            if done:
+                return primary.result()
+
+            # Only hedge with budget left and a free slot - never queue a duplicate
+            if not self.limiter.try_acquire():
+                return await primary
+            if not _hedge_budget.try_spend():
+                self.limiter.release(0, _SUPERSEDED)
+                return await primary
+
+            self.hedges += 1
+            logger.info(f"Hedging {model} call still running after {delay:.1f}s")
+            hedge = asyncio.ensure_future(self._attempt(messages, model, temperature, max_tokens, acquired=True))
+
+            pending = {primary, hedge}
+            result = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    result = task.result()
+                    if result["success"]:
+                        if task is hedge:
+                            self.hedge_wins += 1
+                            _hedge_budget.record_win()
+                        return result
+            return result
+        except asyncio.CancelledError:
+            superseded = False
+            raise
+        finally:
+            for task in (primary, hedge):
+                if task is not None and not task.done():
+                    task.cancel(_SUPERSEDED if superseded else None)
+
+    async def _attempt(self, messages: list, model: str, temperature: float, max_tokens: int,
+                       acquired: bool = False) -> dict:
+        """One OpenRouter request holding a limiter slot"""
+        await self._reserve(acquired)
+        return await self._send(messages, model, temperature, max_tokens)
+
+    async def _reserve(self, acquired: bool = False):
+        """
+        Take a limiter slot (unless already acquired) and a rate limiter token.
+        Waiting for either isn't provider latency, so it happens before _send starts its clock.
+        """
+        if not acquired:
+            await self.limiter.acquire()
+        rate_limiter = get_rate_limiter()
+        if rate_limiter:
+            try:
+                await rate_limiter.acquire_async(self.flow, self.weight)
+            except asyncio.CancelledError:
+                self.limiter.release(0, _UNSENT)
+                raise
+
+    async def _send(self, messages: list, model: str, temperature: float, max_tokens: int) -> dict:
+        """Send one reserved request and release its slot with the measured latency"""
+        started = time.perf_counter()
+        outcome = "cancelled"
+        try:
+            result = await call_openrouter_async(messages, model=model, temperature=temperature,
+                                                 max_tokens=max_tokens, flow=self.flow, weight=self.weight,
+                                                 rate_limited=True)
+            outcome = classify_result(result)
+            return result
+        except asyncio.CancelledError as e:
+            if e.args and e.args[0] == _SUPERSEDED:
+                outcome = _SUPERSEDED
+            raise
+        finally:
+            self.limiter.release(time.perf_counter() - started, outcome)
+
+    def stats(self) -> dict:
+        stats = self.limiter.stats()
+        if self.hedging:
+            stats["hedges"] = self.hedges
+            stats["hedge_wins"] = self.hedge_wins
+        return stats
+
+
+_loop = None
+_loop_lock = Lock()
+
+
+def get_engine_loop() -> asyncio.AbstractEventLoop:
+    """
+    Get the process-wide event loop all LLM work runs on.
+
+    The loop lives in a daemon thread (started lazily, so each gunicorn worker
+    gets its own after the fork) and keeps the pooled async HTTP connections
+    alive between analyses.
+    """
+    global _loop
+    if _loop is None:
+        with _loop_lock:
+            if _loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="llm-engine-loop", daemon=True).start()
+                _loop = loop
+                logger.info("Started LLM engine event loop")
+    return _loop
+
+
+def run_with_engine(func, *args, initial_concurrency: int = 10, **kwargs):
+    """
+    Run func(engine, *args, **kwargs) to completion from synchronous code.
+
+    Returns:
+        Whatever the coroutine function returns
+    """
+    async def runner():
+        async with LLMEngine(initial_concurrency=initial_concurrency) as engine:
+            return await func(engine, *args, **kwargs)
+
+    return asyncio.run_coroutine_threadsafe(runner(), get_engine_loop()).result()
+
+
+_EXHAUSTED = object()
+
+
+def iterate_async(async_iterable):
+    """
+    Drive an async generator from synchronous code (e.g. a Flask streaming response).
+
+    The generator runs on the shared engine loop, so its tasks keep making
+    progress while the caller handles an item. Closing this generator closes
+    the async one, which cancels whatever it still has running.
+
+    Yields:
+        The items of async_iterable
+    """
+    loop = get_engine_loop()
+    iterator = async_iterable.__aiter__()
+
+    async def next_item():
+        try:
+            return await iterator.__anext__()
+        except StopAsyncIteration:
+            return _EXHAUSTED
+
+    try:
+        while True:
+            item = asyncio.run_coroutine_threadsafe(next_item(), loop).result()
+            if item is _EXHAUSTED:
+                break
+            yield item
+    finally:
+        asyncio.run_coroutine_threadsafe(iterator.aclose(), loop).result()
@@ -0,0 +1,211 @@
+"""
+Dense norm retrieval - hashed n-gram embeddings with NumPy cosine search
+Each norm database gets a float32 vector matrix stored next to its JSON file
+(memory-mapped on load), so ranking a product is a single matrix-vector product
+"""
+import os
+import re
+import zlib
+import tempfile
+import logging
+from threading import Lock
+from typing import Dict, List, Optional, Tuple
+
+# NumPy is optional - dense retrieval is disabled without it
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    np = None
+    NUMPY_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+# Vectorizer settings (changing these invalidates the stored matrices)
+EMBEDDING_DIM = 2048
+EMBEDDING_VERSION = 1
+CHAR_NGRAM_SIZES = (3, 4, 5)
+
+# Norm fields that are embedded
+EMBEDDED_FIELDS = ('name', 'applies_to', 'description', 'category')
+
+_WORD_RE = re.compile(r"[a-z0-9]+")
+
+
+def _features(text: str) -> List[str]:
+    """Word unigrams/bigrams plus character n-grams of each word."""
+    words = _WORD_RE.findall(text.lower())
+    features = list(words)
+    features.extend(f"{a} {b}" for a, b in zip(words, words[1:]))
+
+    for word in words:
+        padded = f"<{word}>"
+        for n in CHAR_NGRAM_SIZES:
+            features.extend(f"#{padded[i:i + n]}" for i in range(len(padded) - n + 1))
+
+    return features
+
+
+def embed_text(text: str):
+    """
+    Embed text with the signed hashing trick.
+
+    Uses crc32 rather than hash() so vectors are stable across processes.
+
+    Returns:
+        L2-normalized float32 vector of length EMBEDDING_DIM
+    """
+    vector = np.zeros(EMBEDDING_DIM, dtype=np.float32)
+    for feature in _features(text):
+        h = zlib.crc32(feature.encode('utf-8'))
+        sign = 1.0 if h & 0x80000000 else -1.0
+        vector[h % EMBEDDING_DIM] += sign
+
+    # Sublinear term frequency, then unit length for cosine similarity
+    vector = np.sign(vector) * np.log1p(np.abs(vector))
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+def norm_text(norm: dict) -> str:
+    """Text representation of a norm used for embedding"""
+    return " ".join(str(norm.get(field, '')) for field in EMBEDDED_FIELDS)
+
+
+def _matrix_path(db_path: str) -> str:
+    return f"{db_path}.v{EMBEDDING_VERSION}.d{EMBEDDING_DIM}.npy"
+
+
+def load_norm_matrix(db_path: str, norms: List[dict]):
+    """
+    Load the vector matrix for a database, building it if missing or stale.
+
+    The matrix is memory-mapped when it can be read from disk. If the data
+    directory is read-only the freshly built matrix is kept in memory instead.
+
+    Args:
+        db_path: Path to the norm database JSON file
+        norms: Norms loaded from that file (row order must match)
+
+    Returns:
+        float32 matrix of shape (len(norms), EMBEDDING_DIM)
+    """
+    matrix_path = _matrix_path(db_path)
+
+    if os.path.exists(matrix_path) and os.path.getmtime(matrix_path) >= os.path.getmtime(db_path):
+        try:
+            matrix = np.load(matrix_path, mmap_mode='r')
+            if matrix.shape == (len(norms), EMBEDDING_DIM):
+                return matrix
+        except Exception as e:
+            logger.warning(f"Could not load norm vectors {matrix_path}: {e}")
+
+    if norms:
+        matrix = np.vstack([embed_text(norm_text(norm)) for norm in norms]).astype(np.float32)
+    else:
+        matrix = np.zeros((0, EMBEDDING_DIM), dtype=np.float32)
+
+    # Write to a temporary file and rename it into place, so other workers
+    # building the same matrix never load a half-written one
+    tmp_path = None
+    try:
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(matrix_path) or '.', suffix='.npy.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            np.save(f, matrix)
+        os.replace(tmp_path, matrix_path)
+        tmp_path = None
+        logger.info(f"Stored {matrix.shape[0]} norm vectors at {matrix_path}")
+        return np.load(matrix_path, mmap_mode='r')
+    except OSError as e:
+        logger.warning(f"Could not store norm vectors ({e}), keeping them in memory")
+        return matrix
+    finally:
+        if tmp_path is not None:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+
+
+class DenseNormIndex:
+    """
+    Cosine-similarity index over the norms of several databases.
+    Same rank() interface as the lexical NormIndex.
+    """
+
+    def __init__(self, norms: List[dict], matrices: list):
+        self.norms = norms
+        self.matrices = matrices
+
+    def score(self, query: str):
+        """Cosine similarity of the query against every norm (aligned with self.norms)"""
+        if not self.norms:
+            return np.zeros(0, dtype=np.float32)
+        query_vector = embed_text(query)
+        return np.concatenate([matrix @ query_vector for matrix in self.matrices])
+
+    def rank(self, query: str) -> List[Tuple[dict, float]]:
+        """Return (norm, score) pairs sorted by descending similarity."""
+        scores = self.score(query)
+        order = np.argsort(-scores, kind='stable')
+        return [(self.norms[i], float(scores[i])) for i in order]
+
+
+class DenseNormIndexCache:
+    """Process-wide cache of dense indexes, keyed by the set of databases."""
+
+    def __init__(self):
+        self._cache: Dict[Tuple[str, ...], DenseNormIndex] = {}
+        self._lock = Lock()
+
+    def get(self, database_names: List[str], data_dir: str, loader) -> DenseNormIndex:
+        """
+        Get (or build) the dense index for a set of databases.
+
+        Args:
+            database_names: List of database filenames
+            data_dir: Directory holding the database files
+            loader: Callable(database_names) -> list of norms, used on a cache miss
+        """
+        key = tuple(sorted(database_names))
+        if key not in self._cache:
+            with self._lock:
+                # Double-check locking pattern
+                if key not in self._cache:
+                    all_norms = []
+                    matrices = []
+                    for db_name in key:
+                        db_path = os.path.join(data_dir, db_name)
+                        if not os.path.exists(db_path):
+                            continue
+                        norms = loader([db_name])
+                        matrices.append(load_norm_matrix(db_path, norms))
+                        all_norms.extend(norms)
+                    self._cache[key] = DenseNormIndex(all_norms, matrices)
+                    logger.info(f"Built dense norm index over {len(all_norms)} norms from {len(key)} databases")
+        return self._cache[key]
+
+    def invalidate(self, database_name: Optional[str] = None):
+        """Drop cached indexes (all, or those containing a given database)"""
+        with self._lock:
+            if database_name:
+                for key in [k for k in self._cache if database_name in k]:
+                    del self._cache[key]
+            else:
+                self._cache.clear()
+
+
+# Global cache instance
+_dense_cache = DenseNormIndexCache()
+
+
+def get_dense_index(database_names: List[str], data_dir: str, loader) -> DenseNormIndex:
+    """Get the shared dense index for the given databases"""
+    if not NUMPY_AVAILABLE:
+        raise RuntimeError("Dense retrieval requires numpy")
+    return _dense_cache.get(database_names, data_dir, loader)
+
+
+def invalidate_dense_index(database_name: Optional[str] = None):
+    """Invalidate the shared dense index cache"""
+    _dense_cache.invalidate(database_name)
@@ -0,0 +1,153 @@
+"""
+Norm dependency graph
+Norms can name the norms they only matter under: a harmonized standard under
+its directive, a part-2 standard under its general part. When a parent is
+confidently rejected, its whole subtree can be rejected without LLM calls
+
+Schema (both optional, in any database file):
+- "parent": "DIR-2014/53/EU"              - id of the norm this one belongs to
+- "requires": ["IEC 60601-1", ...]        - ids of norms that must all apply
+
+References resolve within the same database first, then across the loaded
+databases; "norms.json:DIR-2014/53/EU" pins a database. References to norms
+that aren't loaded are ignored, so a standard is simply checked on its own
+when its directive's database isn't selected.
+"""
+import logging
+from threading import Lock
+from typing import Dict, List, Optional, Tuple
+
+from .verdict_model import norm_key
+
+logger = logging.getLogger(__name__)
+
+
+def prerequisite_refs(norm: dict) -> List[str]:
+    """Ids (or 'database:id' references) a norm depends on"""
+    refs = []
+    if norm.get('parent'):
+        refs.append(norm['parent'])
+    requires = norm.get('requires') or []
+    refs.extend([requires] if isinstance(requires, str) else requires)
+    return list(dict.fromkeys(refs))
+
+
+class NormGraph:
+    """
+    Prerequisite edges between loaded norms (cycles are broken on load).
+    Norms are identified by norm_key ('database:id'), so norm dicts from another
+    index over the same databases (e.g. the dense index) resolve to the same nodes.
+    """
+
+    def __init__(self, norms: List[dict]):
+        self._by_database = {}
+        self._by_id = {}
+        for norm in norms:
+            database = norm.get('source_database', 'norms.json')
+            self._by_database.setdefault((database, norm['id']), norm)
+            self._by_id.setdefault(norm['id'], norm)
+
+        self._parents: Dict[str, List[dict]] = {}
+        unresolved = 0
+        for norm in norms:
+            parents = []
+            for ref in prerequisite_refs(norm):
+                parent = self._resolve(ref, norm)
+                if parent is None:
+                    unresolved += 1
+                elif norm_key(parent) != norm_key(norm) and parent not in parents:
+                    parents.append(parent)
+            if parents:
+                self._parents.setdefault(norm_key(norm), parents)
+
+        self._break_cycles(norms)
+        self.edges = sum(len(parents) for parents in self._parents.values())
+        if unresolved:
+            logger.debug(f"Norm graph: {unresolved} references to norms that aren't loaded")
+
+    def _resolve(self, ref: str, norm: dict) -> Optional[dict]:
+        database, _, norm_id = ref.rpartition(':')
+        if database.endswith('.json'):
+            return self._by_database.get((database, norm_id))
+        own_database = norm.get('source_database', 'norms.json')
+        return self._by_database.get((own_database, ref), self._by_id.get(ref))
+
+    def _break_cycles(self, norms: List[dict]):
+        """Drop edges closing a cycle (a norm can't wait on itself)"""
+        done, visiting = set(), set()
+
+        def visit(norm):
+            key = norm_key(norm)
+            visiting.add(key)
+            parents = self._parents.get(key, [])
+            for parent in list(parents):
+                if norm_key(parent) in visiting:
+                    logger.warning(f"Norm graph: cycle {norm['id']} -> {parent['id']}, ignoring that edge")
+                    parents.remove(parent)
+                elif norm_key(parent) not in done:
+                    visit(parent)
+            visiting.discard(key)
+            done.add(key)
+
+        for norm in norms:
+            if norm_key(norm) not in done:
+                visit(norm)
+
+    def parents(self, norm: dict) -> List[dict]:
+        return self._parents.get(norm_key(norm), [])
+
+    def partition(self, norms: List[dict], decided: Dict[str, dict], unresolved: set,
+                  min_confidence: int) -> tuple:
+        """
+        Split norms by the state of their prerequisites.
+
+        Args:
+            norms: Norms not yet scheduled
+            decided: norm_key(norm) -> result for every norm decided so far
+            unresolved: norm_key(norm) of norms still waiting for a verdict in this analysis
+            min_confidence: Confidence at which a rejected parent prunes its children
+
+        Returns:
+            Tuple of (ready norms, [(pruned norm, rejected parent)], norms still waiting)
+        """
+        ready, pruned, waiting = [], [], []
+        for norm in norms:
+            parents = self.parents(norm)
+            rejected = next((
+                parent for parent in parents
+                if norm_key(parent) in decided and not decided[norm_key(parent)]['applies']
+                and decided[norm_key(parent)].get('confidence', 0) >= min_confidence
+            ), None)
+            if rejected is not None:
+                pruned.append((norm, rejected))
+            elif any(norm_key(parent) in unresolved for parent in parents):
+                waiting.append(norm)
+            else:
+                ready.append(norm)
+        return ready, pruned, waiting
+
+
+# Database set -> (norm list the graph was built from, graph)
+_graph_cache: Dict[Tuple[str, ...], tuple] = {}
+_graph_lock = Lock()
+
+
+def get_norm_graph(database_names: List[str], norms: List[dict]) -> NormGraph:
+    """
+    Get the shared graph for a set of databases.
+
+    Args:
+        database_names: List of database filenames
+        norms: Norms of the shared index for those databases (see get_norm_index); the
+               graph is rebuilt when the index is rebuilt and hands out a new list
+    """
+    key = tuple(sorted(database_names))
+    cached = _graph_cache.get(key)
+    if cached is None or cached[0] is not norms:
+        with _graph_lock:
+            cached = _graph_cache.get(key)
+            if cached is None or cached[0] is not norms:
+                graph = NormGraph(norms)
+                cached = _graph_cache[key] = (norms, graph)
+                logger.info(f"Built norm graph with {graph.edges} edges over {len(norms)} norms")
+    return cached[1]
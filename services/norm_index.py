@@ -0,0 +1,171 @@
+"""
+Lexical norm index - BM25 shortlisting in front of the LLM norm checks
+Ranks every loaded norm against a product description so only the most
+relevant candidates have to be sent to OpenRouter
+"""
+import math
+import re
+import logging
+from collections import Counter, defaultdict
+from threading import Lock
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Norm fields that go into the index (name/applies_to carry the most signal)
+INDEXED_FIELDS = {
+    'name': 2.0,
+    'applies_to': 3.0,
+    'description': 1.0,
+    'category': 1.5,
+}
+
+# BM25 parameters (standard defaults)
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+STOPWORDS = {
+    'a', 'an', 'and', 'are', 'as', 'at', 'be', 'by', 'for', 'from', 'has', 'have',
+    'in', 'into', 'is', 'it', 'its', 'of', 'on', 'or', 'that', 'the', 'their',
+    'this', 'to', 'with', 'which', 'will', 'can', 'may', 'such', 'all', 'any',
+    'other', 'than', 'also', 'using', 'used', 'use', 'etc', 'e', 'g', 'i'
+}
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+(?:\.[0-9]+)?")
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Split text into lowercase index terms.
+
+    Drops stopwords and strips a trailing plural "s" so that
+    "batteries"/"battery" and "devices"/"device" end up close together.
+    """
+    if not text:
+        return []
+
+    tokens = []
+    for token in _TOKEN_RE.findall(text.lower()):
+        if token in STOPWORDS or len(token) < 2:
+            continue
+        if token.endswith('ies') and len(token) > 4:
+            token = token[:-3] + 'y'
+        elif token.endswith('s') and not token.endswith('ss') and len(token) > 3:
+            token = token[:-1]
+        tokens.append(token)
+    return tokens
+
+
+class NormIndex:
+    """
+    Inverted BM25 index over a list of norms.
+
+    Each norm is indexed over its name, applies_to, description and category,
+    with per-field weights applied to the term frequencies.
+    """
+
+    def __init__(self, norms: List[dict]):
+        self.norms = norms
+        self._postings: Dict[str, List[Tuple[int, float]]] = defaultdict(list)
+        self._doc_lengths: List[float] = []
+        self._idf: Dict[str, float] = {}
+        self._build()
+
+    def _build(self):
+        doc_freq = Counter()
+
+        for doc_id, norm in enumerate(self.norms):
+            term_weights = Counter()
+            for field, weight in INDEXED_FIELDS.items():
+                for token in tokenize(str(norm.get(field, ''))):
+                    term_weights[token] += weight
+
+            self._doc_lengths.append(sum(term_weights.values()))
+            for term, tf in term_weights.items():
+                self._postings[term].append((doc_id, tf))
+                doc_freq[term] += 1
+
+        n_docs = len(self.norms)
+        self._avg_length = (sum(self._doc_lengths) / n_docs) if n_docs else 0.0
+        for term, df in doc_freq.items():
+            self._idf[term] = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+
+    def score(self, query: str) -> List[float]:
+        """
+        Score every norm against the query.
+
+        Returns:
+            List of BM25 scores aligned with self.norms
+        """
+        scores = [0.0] * len(self.norms)
+        if not self.norms:
+            return scores
+
+        for term in set(tokenize(query)):
+            postings = self._postings.get(term)
+            if not postings:
+                continue
+            idf = self._idf[term]
+            for doc_id, tf in postings:
+                length_norm = 1 - BM25_B + BM25_B * (self._doc_lengths[doc_id] / self._avg_length)
+                scores[doc_id] += idf * (tf * (BM25_K1 + 1)) / (tf + BM25_K1 * length_norm)
+
+        return scores
+
+    def rank(self, query: str) -> List[Tuple[dict, float]]:
+        """Return (norm, score) pairs sorted by descending relevance."""
+        scores = self.score(query)
+        order = sorted(range(len(self.norms)), key=lambda i: scores[i], reverse=True)
+        return [(self.norms[i], scores[i]) for i in order]
+
+
+class NormIndexCache:
+    """
+    Process-wide cache of prebuilt indexes, keyed by the set of databases.
+    Indexes are built once per database combination and reused across analyses.
+    """
+
+    def __init__(self):
+        self._cache: Dict[Tuple[str, ...], NormIndex] = {}
+        self._lock = Lock()
+
+    def get(self, database_names: List[str], loader) -> NormIndex:
+        """
+        Get (or build) the index for a set of databases.
+
+        Args:
+            database_names: List of database filenames
+            loader: Callable(database_names) -> list of norms, used on a cache miss
+        """
+        key = tuple(sorted(database_names))
+        if key not in self._cache:
+            with self._lock:
+                # Double-check locking pattern
+                if key not in self._cache:
+                    norms = loader(list(key))
+                    self._cache[key] = NormIndex(norms)
+                    logger.info(f"Built norm index over {len(norms)} norms from {len(key)} databases")
+        return self._cache[key]
+
+    def invalidate(self, database_name: Optional[str] = None):
+        """Drop cached indexes (all, or those containing a given database)"""
+        with self._lock:
+            if database_name:
+                for key in [k for k in self._cache if database_name in k]:
+                    del self._cache[key]
+            else:
+                self._cache.clear()
+
+
+# Global cache instance
+_index_cache = NormIndexCache()
+
+
+def get_norm_index(database_names: List[str], loader) -> NormIndex:
+    """Get the shared prebuilt index for the given databases"""
+    return _index_cache.get(database_names, loader)
+
+
+def invalidate_norm_index(database_name: Optional[str] = None):
+    """Invalidate the shared norm index cache"""
+    _index_cache.invalidate(database_name)
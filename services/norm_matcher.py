@@ -4,12 +4,77 @@ Migrated from NormScout_Test/AICore
 """
 import json
 import os
+import re
+import time
+import random
+import asyncio
 import logging
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from .openrouter import call_openrouter
+from threading import Lock
+from .llm_engine import LLMEngine, run_with_engine, iterate_async
+from .norm_index import get_norm_index
+from .norm_graph import get_norm_graph
+from .norm_embeddings import get_dense_index
+from .verdict_cache import get_verdict_cache, VERDICT_CACHE_ENABLED
+from .norm_thresholds import evaluate_norm
+from .product_attributes import product_context, product_quantities, retrieval_query, describe_attributes
+from .singleflight import get_singleflight, analysis_key, SINGLEFLIGHT_ENABLED
+from .verdict_model import get_verdict_model, get_verdict_dataset, product_features, norm_key
 
 logger = logging.getLogger(__name__)
 
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data")
+
+# Model used for norm checks, and the version of the check prompts.
+# Bump PROMPT_VERSION whenever the prompts change so cached verdicts are not reused.
+MATCH_MODEL = "anthropic/claude-3.5-sonnet"
+PROMPT_VERSION = 1
+
+# Two-tier cascade - a cheap model screens every norm and only relevant or
+# uncertain verdicts are re-checked with MATCH_MODEL
+CASCADE_ENABLED = os.getenv('NORM_CASCADE', 'false').lower() == 'true'
+SCREEN_MODEL = os.getenv('NORM_SCREEN_MODEL', 'mistralai/mistral-7b-instruct')
+# Screening rejections below this confidence are escalated (the "uncertain" band)
+CASCADE_REJECT_CONFIDENCE = int(os.getenv('NORM_CASCADE_REJECT_CONFIDENCE', '80'))
+# Screening acceptances at or above this confidence are escalated (0 = all acceptances)
+CASCADE_ACCEPT_CONFIDENCE = int(os.getenv('NORM_CASCADE_ACCEPT_CONFIDENCE', '0'))
+
+# Category triage - one question per (database, category) group before fanning
+# out to individual norms. Groups smaller than the minimum are never triaged.
+CATEGORY_TRIAGE_ENABLED = os.getenv('NORM_CATEGORY_TRIAGE', 'false').lower() == 'true'
+CATEGORY_TRIAGE_MIN_GROUP = int(os.getenv('NORM_CATEGORY_TRIAGE_MIN_GROUP', '3'))
+TRIAGE_MODEL = os.getenv('NORM_TRIAGE_MODEL', MATCH_MODEL)
+
+# Norm dependency graph - norms declaring a parent/requires wait for those verdicts,
+# and a parent rejected with at least this confidence rejects its whole subtree
+NORM_GRAPH_ENABLED = os.getenv('NORM_GRAPH', 'true').lower() == 'true'
+NORM_GRAPH_PRUNE_CONFIDENCE = int(os.getenv('NORM_GRAPH_PRUNE_CONFIDENCE', '85'))
+
+# Shortlisting settings - only the top-K BM25 candidates (plus the always-check
+# set) are sent to the LLM. Set NORM_SHORTLIST_TOP_K=0 to check every norm.
+SHORTLIST_TOP_K = int(os.getenv('NORM_SHORTLIST_TOP_K', '120'))
+ALWAYS_CHECK_CATEGORIES = [
+    c.strip() for c in os.getenv('NORM_ALWAYS_CHECK_CATEGORIES', 'Horizontal Standards').split(',') if c.strip()
+]
+ALWAYS_CHECK_IDS = [
+    i.strip() for i in os.getenv('NORM_ALWAYS_CHECK_IDS', '').split(',') if i.strip()
+]
+# Number of skipped norms to check anyway so shortlist recall can be estimated
+# (a few extra LLM checks per analysis; 0 disables the estimate)
+SHORTLIST_RECALL_SAMPLE = int(os.getenv('NORM_SHORTLIST_RECALL_SAMPLE', '5'))
+
+# Retrieval mode used to build the shortlist: 'lexical' (BM25), 'dense' (embeddings) or 'none'
+DEFAULT_RETRIEVAL = os.getenv('NORM_RETRIEVAL', 'lexical')
+# Minimum cosine similarity for a norm to pass the dense filter
+DENSE_SIMILARITY_CUTOFF = float(os.getenv('NORM_DENSE_SIMILARITY_CUTOFF', '0.08'))
+
+# Options that don't change the result of an analysis - ignored when coalescing identical analyses
+COALESCE_IGNORED_OPTIONS = ('hedging', 'priority')
+
+# Batched checks - norms are packed into one prompt until this many (estimated)
+# input tokens are used. Set NORM_BATCH_TOKEN_BUDGET=0 for one call per norm.
+BATCH_TOKEN_BUDGET = int(os.getenv('NORM_BATCH_TOKEN_BUDGET', '1200'))
+MAX_BATCH_SIZE = int(os.getenv('NORM_MAX_BATCH_SIZE', '15'))
+
 
 def load_norms(database_names=None):
     """
@@ -26,10 +91,9 @@ def load_norms(database_names=None):
         database_names = ['norms.json']  # Default EU base
 
     all_norms = []
-    data_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data")
 
     for db_name in database_names:
-        db_path = os.path.join(data_dir, db_name)
+        db_path = os.path.join(DATA_DIR, db_name)
         if not os.path.exists(db_path):
             logger.warning(f"Database {db_name} not found, skipping")
             continue
@@ -54,11 +118,17 @@ def load_norms(database_names=None):
     return all_norms
 
 
-def check_norm_applies(product_description: str, norm: dict) -> dict:
+def check_norm_applies(product_description: str, norm: dict, model: str = MATCH_MODEL) -> dict:
     """
     Ask LLM if a norm applies to the product.
     Returns dict with: applies (bool), confidence (0-100), reasoning (str)
     """
+    return run_with_engine(check_norm_applies_async, product_description, norm, model=model)
+
+
+async def check_norm_applies_async(engine: LLMEngine, product_description: str, norm: dict,
+                                   model: str = MATCH_MODEL) -> dict:
+    """Async version of check_norm_applies, making the call through the engine"""
     prompt = f"""You are an EU compliance expert. Analyze if this norm applies to the product.
 
 PRODUCT: {product_description}
@@ -82,9 +152,9 @@ Be critical, accurate, and precise with numbers."""
 
     messages = [{"role": "user", "content": prompt}]
 
-    result = call_openrouter(
+    result = await engine.call(
         messages,
-        model="anthropic/claude-3.5-sonnet",
+        model=model,
         temperature=0.3,
         max_tokens=200
     )
@@ -99,8 +169,16 @@ Be critical, accurate, and precise with numbers."""
             "reasoning": f"Error: {result.get('error')}"
         }
 
-    # Parse response
-    response = result["content"]
+    return _parse_verdict(norm, result["content"])
+
+
+def _is_error_result(result: dict) -> bool:
+    """True for placeholder results produced when the LLM call failed"""
+    return result.get("confidence") == 0 and result.get("reasoning", "").startswith("Error:")
+
+
+def _parse_verdict(norm: dict, response: str) -> dict:
+    """Parse an APPLIES/CONFIDENCE/REASONING answer into a result dict"""
     lines = response.strip().split("\n")
     applies = "yes" in lines[0].lower() if lines else False
     confidence = 50  # default
@@ -139,9 +217,405 @@ Be critical, accurate, and precise with numbers."""
     }
 
 
-def match_norms(product_description: str, max_workers: int = 10, progress_callback=None, allowed_databases=None) -> list:
+def _norm_block(position: int, norm: dict) -> str:
+    """Prompt section describing one norm of a batch"""
+    return f"""[{position}] NORM: {norm['name']} ({norm['id']})
+APPLIES TO: {norm['applies_to']}
+DESCRIPTION: {norm['description']}"""
+
+
+def _estimate_tokens(text: str) -> int:
+    """Rough token estimate (~4 characters per token)"""
+    return len(text) // 4 + 1
+
+
+def plan_batches(norms: list, token_budget: int = None, max_batch_size: int = None) -> list:
+    """
+    Split norms into batches that fit the prompt token budget.
+
+    Args:
+        norms: Norms to check
+        token_budget: Estimated input tokens available for norm sections (0 = one norm per batch)
+        max_batch_size: Upper bound on norms per batch
+
+    Returns:
+        List of norm lists
+    """
+    token_budget = BATCH_TOKEN_BUDGET if token_budget is None else token_budget
+    max_batch_size = MAX_BATCH_SIZE if max_batch_size is None else max_batch_size
+
+    if not token_budget or max_batch_size <= 1:
+        return [[norm] for norm in norms]
+
+    batches = []
+    current = []
+    used = 0
+
+    for norm in norms:
+        cost = _estimate_tokens(_norm_block(len(current) + 1, norm))
+        if current and (used + cost > token_budget or len(current) >= max_batch_size):
+            batches.append(current)
+            current = []
+            used = 0
+        current.append(norm)
+        used += cost
+
+    if current:
+        batches.append(current)
+
+    return batches
+
+
+def check_norms_batch(product_description: str, norms: list, model: str = MATCH_MODEL) -> list:
+    """
+    Ask LLM about several norms in a single request.
+    Norms whose verdict can't be parsed are re-checked one by one with check_norm_applies.
+
+    Returns:
+        List of result dicts aligned with norms
+    """
+    return run_with_engine(check_norms_batch_async, product_description, norms, model=model)
+
+
+async def check_norms_batch_async(engine: LLMEngine, product_description: str, norms: list,
+                                  model: str = MATCH_MODEL) -> list:
+    """Async version of check_norms_batch; single-check fallbacks run concurrently"""
+    if len(norms) == 1:
+        return [await check_norm_applies_async(engine, product_description, norms[0], model=model)]
+
+    norm_sections = "\n\n".join(_norm_block(i, norm) for i, norm in enumerate(norms, 1))
+
+    prompt = f"""You are an EU compliance expert. Analyze if each of these {len(norms)} norms applies to the product.
+
+PRODUCT: {product_description}
+
+NORMS:
+{norm_sections}
+
+INSTRUCTIONS:
+- Read each "APPLIES TO" field carefully and check if the product matches those criteria
+- Judge every norm independently
+- Pay close attention to voltage ranges, thresholds, and numeric values
+- If the norm specifies a minimum voltage (e.g., ">75V DC"), the product voltage must be GREATER than that value
+- Be precise with technical specifications
+- Answer for EVERY norm, in order, in this EXACT format:
+
+[1]
+APPLIES: yes/no
+CONFIDENCE: 0-100
+REASONING: brief explanation
+
+[2]
+...
+
+Be critical, accurate, and precise with numbers."""
+
+    messages = [{"role": "user", "content": prompt}]
+
+    result = await engine.call(
+        messages,
+        model=model,
+        temperature=0.3,
+        max_tokens=120 * len(norms) + 50
+    )
+
+    verdicts = _parse_batch_verdicts(norms, result["content"]) if result["success"] else {}
+    if not result["success"]:
+        logger.error(f"Batched LLM call failed for {len(norms)} norms: {result.get('error')}")
+
+    missing = [position for position in range(1, len(norms) + 1) if position not in verdicts]
+    if missing:
+        logger.warning(f"Batch verdict missing for {len(missing)}/{len(norms)} norms, fell back to single checks")
+        fallback_results = await asyncio.gather(*(
+            check_norm_applies_async(engine, product_description, norms[position - 1], model=model)
+            for position in missing
+        ))
+        verdicts.update(zip(missing, fallback_results))
+
+    return [verdicts[position] for position in range(1, len(norms) + 1)]
+
+
+_BATCH_MARKER_RE = re.compile(r"^\s*\[(\d+)\]\s*$|^\s*\[(\d+)\]\s*(?=APPLIES:)", re.IGNORECASE | re.MULTILINE)
+
+
+def _parse_batch_verdicts(norms: list, response: str) -> dict:
+    """
+    Parse a batched answer into {position: result}.
+    Only blocks with a well-formed APPLIES line are returned.
+    """
+    markers = list(_BATCH_MARKER_RE.finditer(response))
+    verdicts = {}
+
+    for i, marker in enumerate(markers):
+        position = int(marker.group(1) or marker.group(2))
+        if not 1 <= position <= len(norms) or position in verdicts:
+            continue
+
+        end = markers[i + 1].start() if i + 1 < len(markers) else len(response)
+        block = response[marker.end():end].strip()
+        first_line = block.split("\n", 1)[0].lower()
+        if not first_line.startswith("applies:") or not ("yes" in first_line or "no" in first_line):
+            continue
+
+        verdicts[position] = _parse_verdict(norms[position - 1], block)
+
+    return verdicts
+
+
+def group_norms_by_category(norms: list) -> dict:
+    """
+    Group norms by (source database, category), preserving order.
+
+    Returns:
+        Dict of (database, category) -> list of norms
+    """
+    groups = {}
+    for norm in norms:
+        key = (norm.get('source_database', ''), norm.get('category', 'Uncategorized'))
+        groups.setdefault(key, []).append(norm)
+    return groups
+
+
+def triage_category(product_description: str, category: str, norms: list) -> dict:
+    """
+    Ask LLM whether anything in a category group could apply to the product.
+    Fails open: if the call or parsing fails the group is treated as relevant.
+
+    Returns:
+        {"relevant": bool, "reasoning": str}
+    """
+    return run_with_engine(triage_category_async, product_description, category, norms)
+
+
+async def triage_category_async(engine: LLMEngine, product_description: str, category: str, norms: list) -> dict:
+    """Async version of triage_category, making the call through the engine"""
+    norm_lines = "\n".join(f"- {norm['name']} ({norm['id']}): {norm['applies_to']}" for norm in norms[:40])
+
+    prompt = f"""You are an EU compliance expert. Decide if ANY norm in this category could apply to the product.
+
+PRODUCT: {product_description}
+
+CATEGORY: {category}
+NORMS IN THIS CATEGORY:
+{norm_lines}
+
+INSTRUCTIONS:
+- Answer "yes" if even one of these norms might plausibly apply
+- Answer "no" only if the whole category is clearly unrelated to the product
+- Answer in this EXACT format:
+
+RELEVANT: yes/no
+REASONING: brief explanation"""
+
+    messages = [{"role": "user", "content": prompt}]
+
+    result = await engine.call(
+        messages,
+        model=TRIAGE_MODEL,
+        temperature=0.1,
+        max_tokens=100
+    )
+
+    if not result["success"]:
+        logger.error(f"Triage call failed for category {category}: {result.get('error')}")
+        return {"relevant": True, "reasoning": f"Error: {result.get('error')}"}
+
+    relevant = True
+    reasoning = ""
+    for line in result["content"].strip().split("\n"):
+        if "RELEVANT:" in line.upper():
+            relevant = "no" not in line.split(":", 1)[1].lower()
+        elif "REASONING:" in line.upper():
+            reasoning = line.split(":", 1)[1].strip()
+
+    return {"relevant": relevant, "reasoning": reasoning}
+
+
+def _triage_rejection(norm: dict, category: str, reasoning: str) -> dict:
+    """Result for a norm whose whole category was ruled out during triage"""
+    return {
+        "norm_id": norm["id"],
+        "norm_name": norm["name"],
+        "applies": False,
+        "confidence": 75,
+        "reasoning": f"Category '{category}' ruled out during triage: {reasoning}",
+        "url": norm.get("url", "")
+    }
+
+
+def _graph_rejection(norm: dict, parent: dict, parent_result: dict) -> dict:
+    """Result for a norm pruned because a norm it depends on was rejected"""
+    return {
+        "norm_id": norm["id"],
+        "norm_name": norm["name"],
+        "applies": False,
+        "confidence": parent_result.get("confidence", 0),
+        "reasoning": f"Only relevant under {parent['id']} ({parent['name']}), which does not apply: "
+                     f"{parent_result.get('reasoning', '')}",
+        "url": norm.get("url", "")
+    }
+
+
+class TierStats:
+    """
+    Per-tier timing for the matcher (screen / main model calls).
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._tiers = {}
+
+    def record(self, tier: str, seconds: float, norm_count: int):
+        with self._lock:
+            entry = self._tiers.setdefault(tier, {"latencies": [], "norms": 0})
+            entry["latencies"].append(seconds)
+            entry["norms"] += norm_count
+
+    def summary(self) -> dict:
+        with self._lock:
+            summary = {}
+            for tier, entry in self._tiers.items():
+                latencies = sorted(entry["latencies"])
+                summary[tier] = {
+                    "requests": len(latencies),
+                    "norms": entry["norms"],
+                    "total_s": round(sum(latencies), 2),
+                    "avg_ms": round(1000 * sum(latencies) / len(latencies)),
+                    "p95_ms": round(1000 * latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))])
+                }
+            return summary
+
+
+def _needs_escalation(result: dict) -> bool:
+    """Decide whether a screening verdict must be re-checked by the main model"""
+    if _is_error_result(result):
+        return True
+    if result["applies"]:
+        return result["confidence"] >= CASCADE_ACCEPT_CONFIDENCE
+    return result["confidence"] < CASCADE_REJECT_CONFIDENCE
+
+
+async def _check_batch(engine: LLMEngine, product_description: str, batch: list, cascade: bool,
+                       tier_stats: TierStats, product_attributes: dict = None) -> list:
+    """
+    Check one batch of norms, screening with SCREEN_MODEL first when cascading.
+    With an attribute record, prompts add the attributes relevant to the batch to the summary.
+    """
+    context = product_context(product_description, product_attributes, batch)
+
+    if not cascade:
+        started = time.perf_counter()
+        results = await check_norms_batch_async(engine, context, batch)
+        tier_stats.record("main", time.perf_counter() - started, len(batch))
+        return results
+
+    started = time.perf_counter()
+    results = await check_norms_batch_async(engine, context, batch, model=SCREEN_MODEL)
+    tier_stats.record("screen", time.perf_counter() - started, len(batch))
+
+    escalate = [i for i, result in enumerate(results) if _needs_escalation(result)]
+    if escalate:
+        started = time.perf_counter()
+        escalated = [batch[i] for i in escalate]
+        verified = await check_norms_batch_async(
+            engine, product_context(product_description, product_attributes, escalated), escalated
+        )
+        tier_stats.record("main", time.perf_counter() - started, len(escalate))
+        for i, result in zip(escalate, verified):
+            results[i] = result
+
+    return results
+
+
+def shortlist_norms(product_description: str, allowed_databases=None, top_k: int = None,
+                    always_check=None, recall_sample: int = None, retrieval: str = None,
+                    similarity_cutoff: float = None) -> tuple:
+    """
+    Pick the norms worth sending to the LLM using a prebuilt retrieval index.
+
+    Args:
+        product_description: Description of the product (used as the query)
+        allowed_databases: Optional list of database filenames (defaults to 'norms.json')
+        top_k: Number of best-ranked norms to keep (0 = keep everything)
+        always_check: Optional extra norm ids that are always checked
+        recall_sample: Number of skipped norms to audit for recall estimation
+        retrieval: 'lexical' (BM25), 'dense' (cosine over norm embeddings) or 'none'
+        similarity_cutoff: Minimum cosine similarity in dense mode
+
+    Returns:
+        Tuple of (candidates, audit_sample, stats)
+    """
+    database_names = allowed_databases or ['norms.json']
+    top_k = SHORTLIST_TOP_K if top_k is None else top_k
+    recall_sample = SHORTLIST_RECALL_SAMPLE if recall_sample is None else recall_sample
+    retrieval = retrieval or DEFAULT_RETRIEVAL
+    always_ids = set(ALWAYS_CHECK_IDS) | set(always_check or [])
+
+    if retrieval == 'dense':
+        index = get_dense_index(database_names, DATA_DIR, load_norms)
+        cutoff = DENSE_SIMILARITY_CUTOFF if similarity_cutoff is None else similarity_cutoff
+    else:
+        index = get_norm_index(database_names, load_norms)
+        cutoff = 0
+    ranked = index.rank(product_description)
+
+    if retrieval == 'none' or ((not top_k or top_k >= len(ranked)) and retrieval != 'dense'):
+        stats = {
+            "retrieval": retrieval,
+            "total_norms": len(ranked),
+            "shortlisted": len(ranked),
+            "always_checked": 0,
+            "skipped": 0,
+            "audited": 0
+        }
+        return [norm for norm, _ in ranked], [], stats
+
+    candidates = []
+    skipped = []
+    always_checked = 0
+    top_k = top_k or len(ranked)
+
+    for position, (norm, score) in enumerate(ranked):
+        if position < top_k and score > cutoff:
+            candidates.append(norm)
+        elif norm['id'] in always_ids or norm.get('category') in ALWAYS_CHECK_CATEGORIES:
+            candidates.append(norm)
+            always_checked += 1
+        else:
+            skipped.append(norm)
+
+    audit_sample = random.sample(skipped, min(recall_sample, len(skipped))) if recall_sample else []
+
+    stats = {
+        "retrieval": retrieval,
+        "total_norms": len(ranked),
+        "shortlisted": len(candidates) - always_checked,
+        "always_checked": always_checked,
+        "skipped": len(skipped),
+        "audited": len(audit_sample)
+    }
+
+    logger.info(f"Shortlisted {len(candidates)}/{len(ranked)} norms via {retrieval} retrieval "
+                f"(top {top_k} + {always_checked} always-check, {len(audit_sample)} audited)")
+    return candidates, audit_sample, stats
+
+
+def _estimate_recall(stats: dict, shortlist_matches: int, audit_matches: int) -> float:
     """
-    Match all norms against a product description in parallel.
+    Estimate shortlist recall from the audit sample.
+    Matches found in the sample are extrapolated to all skipped norms.
+    """
+    if not stats.get("audited"):
+        return None
+    missed = audit_matches * stats["skipped"] / stats["audited"]
+    found = shortlist_matches + missed
+    return round(shortlist_matches / found, 3) if found else 1.0
+
+
+def match_norms(product_description: str, max_workers: int = 10, progress_callback=None, allowed_databases=None,
+                stats_callback=None, **options) -> list:
+    """
+    Match norms against a product description in parallel.
     Returns list of matching norms with confidence scores.
 
     Args:
@@ -150,107 +624,479 @@ def match_norms(product_description: str, max_workers: int = 10, progress_callba
         progress_callback: Optional callback function(completed, total, norm_id) for progress updates
         allowed_databases: Optional list of database filenames to check (e.g., ['norms.json', 'norms_us.json'])
                           If None, defaults to 'norms.json' only
+        stats_callback: Optional callback function(stats) receiving the pipeline statistics
+                        (shortlist size, estimated recall, cache hits, ...)
+        **options: Pipeline options passed through to match_norms_streaming
+                   (shortlist_top_k, retrieval, batch_token_budget, use_cache, ...)
 
     Returns:
         List of matching norms sorted by confidence
     """
-    norms = load_norms(allowed_databases)
     results = []
-    completed = 0
 
-    logger.info(f"Checking {len(norms)} norms from {len(allowed_databases or ['norms.json'])} databases in parallel (max {max_workers} at a time)")
+    for event_type, *event_data in match_norms_streaming(
+        product_description,
+        max_workers=max_workers,
+        allowed_databases=allowed_databases,
+        **options
+    ):
+        if event_type == 'progress' and progress_callback:
+            progress_callback(*event_data)
+        elif event_type == 'stats' and stats_callback:
+            stats_callback(event_data[0])
+        elif event_type == 'complete':
+            results = event_data[0]
 
-    # Use ThreadPoolExecutor for parallel API calls
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        # Submit all tasks
-        future_to_norm = {
-            executor.submit(check_norm_applies, product_description, norm): norm
-            for norm in norms
-        }
+    return results
 
-        # Process as they complete
-        for future in as_completed(future_to_norm):
-            completed += 1
-            norm = future_to_norm[future]
 
-            try:
-                result = future.result()
-                if result["applies"]:
-                    results.append(result)
-                logger.info(f"[{completed}/{len(norms)}] OK {norm['id']}")
+def match_norms_streaming(product_description: str, max_workers: int = 10, allowed_databases=None,
+                          coalesce: bool = None, **options):
+    """
+    Match norms against a product description in parallel, yielding progress events immediately.
+    This is a generator that streams progress updates in real-time - a synchronous
+    bridge over match_norms_async for Flask streaming responses.
 
-                # Call progress callback if provided
-                if progress_callback:
-                    progress_callback(completed, len(norms), norm['id'])
+    Args:
+        product_description: Description of the product
+        max_workers: Initial number of concurrent API calls (adapted at runtime)
+        allowed_databases: Optional list of database filenames to check (e.g., ['norms.json', 'norms_us.json'])
+                          If None, defaults to 'norms.json' only
+        coalesce: Attach to an identical analysis that is already running (same normalized
+                  summary, databases and options) instead of starting another one
+                  (None = SINGLEFLIGHT_ENABLED)
+        **options: Pipeline options passed through to match_norms_async
 
-            except Exception as e:
-                logger.error(f"[{completed}/{len(norms)}] ERROR {norm['id']} - {e}")
-                if progress_callback:
-                    progress_callback(completed, len(norms), norm['id'])
+    Yields:
+        Same events as match_norms_async
+    """
+    def start():
+        return match_norms_async(
+            product_description,
+            max_workers=max_workers,
+            allowed_databases=allowed_databases,
+            **options
+        )
 
-    # Sort by confidence
-    results.sort(key=lambda x: x["confidence"], reverse=True)
+    coalesce = SINGLEFLIGHT_ENABLED if coalesce is None else coalesce
+    if not coalesce:
+        yield from iterate_async(start())
+        return
+
+    key_options = {name: value for name, value in options.items() if name not in COALESCE_IGNORED_OPTIONS}
+    key = analysis_key(product_description, allowed_databases, key_options)
+    yield from iterate_async(get_singleflight().subscribe(key, start))
+
+
+def _evaluate_rules(product_description: str, product_attributes: dict, norms: list) -> list:
+    """Numeric threshold verdicts for norms (None where the rules can't decide)"""
+    quantities = product_quantities(product_description, product_attributes)
+    return [evaluate_norm(quantities, norm) for norm in norms]
+
+
+def _predict_verdicts(verdict_predictor, product_description: str, product_attributes: dict, norms: list) -> list:
+    """Verdict model predictions for norms (None where the model isn't confident)"""
+    features = product_features(product_description, product_attributes)
+    return [verdict_predictor.predict(norm, features) for norm in norms]
 
-    logger.info(f"Found {len(results)} applicable norms")
-    return results
 
+async def _labelled(label, coroutine):
+    """Await a coroutine and return (label, result, error) so completions can be told apart"""
+    try:
+        return label, await coroutine, None
+    except Exception as e:
+        return label, None, e
 
-def match_norms_streaming(product_description: str, max_workers: int = 10, allowed_databases=None):
+
+async def match_norms_async(product_description: str, max_workers: int = 10, allowed_databases=None,
+                            shortlist_top_k: int = None, always_check=None, recall_sample: int = None,
+                            retrieval: str = None, similarity_cutoff: float = None,
+                            batch_token_budget: int = None, use_cache: bool = True, use_rules: bool = True,
+                            cascade: bool = None, category_triage: bool = None, hedging: bool = None,
+                            priority: str = None, norm_keys=None, product_attributes: dict = None,
+                            use_model: bool = None, use_graph: bool = None):
     """
-    Match all norms against a product description in parallel, yielding progress events immediately.
-    This is a generator that streams progress updates in real-time.
+    Match norms against a product description on an asyncio event loop.
+    This is an async generator; LLM calls go through an LLMEngine whose concurrency
+    adapts (AIMD) to the latency and 429/5xx rate seen from OpenRouter.
 
     Args:
         product_description: Description of the product
-        max_workers: Maximum concurrent API calls
+        max_workers: Initial number of concurrent API calls (adapted between
+                     LLM_MIN_CONCURRENCY and LLM_MAX_CONCURRENCY)
         allowed_databases: Optional list of database filenames to check (e.g., ['norms.json', 'norms_us.json'])
                           If None, defaults to 'norms.json' only
+        shortlist_top_k: Number of BM25 candidates sent to the LLM (None = NORM_SHORTLIST_TOP_K, 0 = all)
+        always_check: Optional norm ids that bypass the shortlist
+        recall_sample: Number of skipped norms audited to estimate shortlist recall
+        retrieval: Candidate filter - 'lexical' (BM25), 'dense' (embedding cosine search) or 'none'
+                   (None = NORM_RETRIEVAL)
+        similarity_cutoff: Minimum cosine similarity for dense retrieval (None = NORM_DENSE_SIMILARITY_CUTOFF)
+        batch_token_budget: Estimated prompt tokens of norms per LLM request
+                            (None = NORM_BATCH_TOKEN_BUDGET, 0 = one request per norm)
+        use_cache: Reuse verdicts from the verdict cache and store new ones
+        use_rules: Decide clear-cut numeric thresholds (voltage, power, ...) locally without the LLM
+        cascade: Screen norms with SCREEN_MODEL and only re-check relevant/uncertain ones with
+                 MATCH_MODEL (None = NORM_CASCADE)
+        category_triage: Ask once per (database, category) group whether it can apply and skip
+                         ruled-out groups (None = NORM_CATEGORY_TRIAGE)
+        hedging: Duplicate calls still running after the recent p90 latency, within the
+                 process-wide hedge budget (None = LLM_HEDGING)
+        priority: Package tier of the user ('free', 'trial', 'paid', 'bundle') - sets this
+                  analysis' weight in the cluster-wide fair rate limiter
+        norm_keys: Only check these norms ('database:id', see verdict_model.norm_key), bypassing the
+                   shortlist (used by incremental re-analysis)
+        product_attributes: Structured attribute record of the product (see product_attributes) -
+                            used by the numeric rules, the retrieval query and per-norm prompts
+        use_model: Let the learned verdict model (see verdict_model) answer norms it is confident
+                   about, and log LLM verdicts to its training dataset (None = VERDICT_MODEL_ENABLED)
+        use_graph: Check parent norms (see norm_graph) before the norms that depend on them and
+                   skip the subtrees of confidently rejected parents (None = NORM_GRAPH)
 
     Yields:
         Tuples of:
-        - ('progress', completed, total, norm_id) for each completed norm
+        - ('triage', completed_groups, total_groups, group_label) for each triaged category group
+        - ('progress', completed, total, norm_id) for each completed norm (including norms
+          pruned by the dependency graph, so the last event always reaches the total)
+        - ('verdict', result) for each applicable norm, as soon as it is known
+          (emitted just before that norm's progress event)
+        - ('stats', stats) with shortlist statistics once all norms are checked
         - ('complete', matched_results, all_results) when all norms are checked
     """
-    norms = load_norms(allowed_databases)
+    # Index builds, embeddings, regexes and model loads are CPU/disk work - keep them
+    # off the event loop, which is shared with every other analysis in this process
+    if norm_keys is not None:
+        wanted = set(norm_keys)
+        catalog = (await asyncio.to_thread(get_norm_index, allowed_databases or ['norms.json'], load_norms)).norms
+        candidates = [norm for norm in catalog if norm_key(norm) in wanted]
+        audit_sample = []
+        stats = {
+            "retrieval": "explicit",
+            "total_norms": len(catalog),
+            "shortlisted": len(candidates),
+            "always_checked": 0,
+            "skipped": len(catalog) - len(candidates),
+            "audited": 0
+        }
+    else:
+        candidates, audit_sample, stats = await asyncio.to_thread(
+            shortlist_norms,
+            retrieval_query(product_description, product_attributes),
+            allowed_databases=allowed_databases,
+            top_k=shortlist_top_k,
+            always_check=always_check,
+            recall_sample=recall_sample,
+            retrieval=retrieval,
+            similarity_cutoff=similarity_cutoff
+        )
+    norms = candidates + audit_sample
+    audit_ids = {id(norm) for norm in audit_sample}
+
     matched_results = []  # Norms that apply
     all_results = []      # ALL checks (for Q&A context)
+    shortlist_matches = 0
+    audit_matches = 0
     completed = 0
     total = len(norms)
 
-    logger.info(f"Checking {total} norms from {len(allowed_databases or ['norms.json'])} databases in parallel (max {max_workers} at a time)")
+    decided = {}  # norm_key(norm) -> result that may prune dependent norms (see norm_graph)
 
-    # Use ThreadPoolExecutor for parallel API calls
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        # Submit all tasks
-        future_to_norm = {
-            executor.submit(check_norm_applies, product_description, norm): norm
-            for norm in norms
-        }
+    def record(norm, result, prunes=True):
+        nonlocal shortlist_matches, audit_matches
+        all_results.append(result)  # Store ALL results
+        if prunes:
+            decided[norm_key(norm)] = result
+        if result["applies"]:
+            matched_results.append(result)
+            if id(norm) in audit_ids:
+                audit_matches += 1
+            else:
+                shortlist_matches += 1
+
+    pending = norms
+
+    # Decide clear-cut numeric cases locally
+    if use_rules:
+        rule_results = await asyncio.to_thread(_evaluate_rules, product_description, product_attributes, pending)
+        undecided = []
 
-        # Process as they complete and yield immediately
-        for future in as_completed(future_to_norm):
+        for norm, result in zip(pending, rule_results):
+            if result is None:
+                undecided.append(norm)
+                continue
             completed += 1
-            norm = future_to_norm[future]
+            # A misparsed threshold shouldn't take a whole subtree of norms with it
+            record(norm, result, prunes=False)
+            if result["applies"]:
+                yield ('verdict', result)
+            yield ('progress', completed, total, norm['id'])
 
-            try:
-                result = future.result()
-                all_results.append(result)  # Store ALL results
-                if result["applies"]:
-                    matched_results.append(result)
-                logger.info(f"[{completed}/{total}] OK {norm['id']}")
+        stats["rule_decisions"] = len(pending) - len(undecided)
+        if stats["rule_decisions"]:
+            logger.info(f"Decided {stats['rule_decisions']} norms from numeric thresholds without LLM calls")
+        pending = undecided
 
-                # Yield progress immediately
-                yield ('progress', completed, total, norm['id'])
+    cascade = CASCADE_ENABLED if cascade is None else cascade
+    verdict_model = f"{SCREEN_MODEL}>{MATCH_MODEL}" if cascade else MATCH_MODEL
+    tier_stats = TierStats()
+
+    # Serve whatever we can from the verdict cache
+    cache = get_verdict_cache() if use_cache and VERDICT_CACHE_ENABLED else None
+    cache_keys = {}
+
+    if cache and pending:
+        # Verdicts depend on the attribute record too when prompts are built from it
+        cache_product = product_description
+        if product_attributes:
+            cache_product = f"{product_description}\n{describe_attributes(product_attributes)}"
+        keys = [cache.make_key(cache_product, norm, verdict_model, PROMPT_VERSION) for norm in pending]
+        cache_keys = {id(norm): key for norm, key in zip(pending, keys)}
+        uncached = []
+
+        for norm, cached in zip(pending, await asyncio.to_thread(cache.get_many, keys)):
+            if cached is None:
+                uncached.append(norm)
+                continue
+            completed += 1
+            record(norm, cached)
+            if cached["applies"]:
+                yield ('verdict', cached)
+            yield ('progress', completed, total, norm['id'])
+
+        stats["cache_hits"] = len(pending) - len(uncached)
+        stats["cache_misses"] = len(uncached)
+        logger.info(f"Verdict cache: {stats['cache_hits']} hits, {stats['cache_misses']} misses")
+        pending = uncached
+
+    # Let the learned model answer the clear-cut norms it has seen often enough
+    verdict_predictor = await asyncio.to_thread(get_verdict_model) if use_model is not False else None
+    if verdict_predictor and pending:
+        predictions = await asyncio.to_thread(
+            _predict_verdicts, verdict_predictor, product_description, product_attributes, pending
+        )
+        unpredicted = []
+
+        for norm, result in zip(pending, predictions):
+            if result is None:
+                unpredicted.append(norm)
+                continue
+            completed += 1
+            record(norm, result)
+            if result["applies"]:
+                yield ('verdict', result)
+            yield ('progress', completed, total, norm['id'])
+
+        stats["model_decisions"] = len(pending) - len(unpredicted)
+        if stats["model_decisions"]:
+            logger.info(f"Verdict model answered {stats['model_decisions']} norms without LLM calls")
+        pending = unpredicted
+
+    dataset = get_verdict_dataset() if use_model is not False else None
+    category_triage = CATEGORY_TRIAGE_ENABLED if category_triage is None else category_triage
+    tasks = []
+
+    async with LLMEngine(initial_concurrency=max_workers, hedging=hedging, priority=priority) as engine:
+        try:
+            # Category triage: rule out whole (database, category) groups with one call each
+            if category_triage and pending:
+                groups = group_norms_by_category(pending)
+                triaged = {key: group for key, group in groups.items() if len(group) >= CATEGORY_TRIAGE_MIN_GROUP}
+                passed_ids = {id(norm) for key, group in groups.items() if key not in triaged for norm in group}
 
-            except Exception as e:
-                logger.error(f"[{completed}/{total}] ERROR {norm['id']} - {e}")
-                # Still yield progress even on error
+                tasks = [
+                    asyncio.ensure_future(_labelled(
+                        key, triage_category_async(engine, product_description, key[1], group)
+                    ))
+                    for key, group in triaged.items()
+                ]
+                triage_done = 0
+                rejected_groups = 0
+
+                for next_done in asyncio.as_completed(tasks):
+                    (database, category), verdict, error = await next_done
+                    group = triaged[(database, category)]
+                    triage_done += 1
+
+                    if error is not None:
+                        logger.error(f"ERROR triaging category {category} ({database}) - {error}")
+                        verdict = {"relevant": True, "reasoning": ""}
+
+                    yield ('triage', triage_done, len(triaged), f"{category} ({database})")
+
+                    if verdict["relevant"]:
+                        passed_ids.update(id(norm) for norm in group)
+                        continue
+
+                    rejected_groups += 1
+                    for norm in group:
+                        completed += 1
+                        record(norm, _triage_rejection(norm, category, verdict["reasoning"]))
+                        yield ('progress', completed, total, norm['id'])
+
+                stats["triage_groups"] = len(triaged)
+                stats["triage_rejected_groups"] = rejected_groups
+                stats["triage_skipped_norms"] = len(pending) - len(passed_ids)
+                logger.info(f"Category triage ruled out {rejected_groups}/{len(triaged)} groups "
+                            f"({stats['triage_skipped_norms']} norms)")
+                pending = [norm for norm in pending if id(norm) in passed_ids]
+
+            # Norms whose parents are still pending wait for those verdicts (see norm_graph)
+            use_graph = NORM_GRAPH_ENABLED if use_graph is None else use_graph
+            graph = None
+            if use_graph and pending:
+                database_names = allowed_databases or ['norms.json']
+                index = await asyncio.to_thread(get_norm_index, database_names, load_norms)
+                graph = await asyncio.to_thread(get_norm_graph, database_names, index.norms)
+                if not graph.edges:
+                    graph = None
+            unresolved = {norm_key(norm) for norm in pending}
+            blocked = pending
+            batches = []
+            running = set()
+            stats["graph_pruned"] = 0
+
+            def release() -> list:
+                """
+                Start batches for norms whose prerequisites are settled and prune rejected
+                subtrees. Returns the pruned norms, for the caller to report as completed.
+                """
+                nonlocal blocked
+                released_pruned = []
+                while True:
+                    if graph is None:
+                        ready, pruned, blocked = blocked, [], []
+                    else:
+                        ready, pruned, blocked = graph.partition(blocked, decided, unresolved,
+                                                                 NORM_GRAPH_PRUNE_CONFIDENCE)
+                    for batch in plan_batches(ready, batch_token_budget):
+                        task = asyncio.ensure_future(_labelled(
+                            len(batches),
+                            _check_batch(engine, product_description, batch, cascade, tier_stats, product_attributes)
+                        ))
+                        batches.append(batch)
+                        tasks.append(task)
+                        running.add(task)
+
+                    # Pruned norms are decided; their children are settled on the next pass
+                    for norm, parent in pruned:
+                        unresolved.discard(norm_key(norm))
+                        record(norm, _graph_rejection(norm, parent, decided[norm_key(parent)]))
+                        released_pruned.append(norm)
+                    stats["graph_pruned"] += len(pruned)
+                    if not pruned:
+                        return released_pruned
+
+            # Start every check that can start; the engine's limiter decides how many run at once
+            for norm in release():
+                completed += 1
                 yield ('progress', completed, total, norm['id'])
 
+            logger.info(f"Checking {len(pending)} norms, {len(batches)} requests ready, {len(blocked)} norms "
+                        f"waiting on parent norms, from {len(allowed_databases or ['norms.json'])} databases "
+                        f"(adaptive concurrency, starting at {max_workers})")
+
+            # Process as they complete and yield immediately
+            while running:
+                done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                for finished in done:
+                    running.discard(finished)
+                    index, batch_results, error = finished.result()
+                    batch = batches[index]
+
+                    if error is not None:
+                        logger.error(f"ERROR checking batch of {len(batch)} norms - {error}")
+                        batch_results = [None] * len(batch)
+
+                    if cache:
+                        await asyncio.to_thread(cache.set_many, {
+                            cache_keys[id(norm)]: result
+                            for norm, result in zip(batch, batch_results)
+                            if result is not None and not _is_error_result(result)
+                        })
+                    if dataset:
+                        await asyncio.to_thread(dataset.log_many, product_description, product_attributes, [
+                            (norm, result)
+                            for norm, result in zip(batch, batch_results)
+                            if result is not None and not _is_error_result(result)
+                        ], verdict_model)
+
+                    for norm, result in zip(batch, batch_results):
+                        unresolved.discard(norm_key(norm))
+                        if result is not None:
+                            record(norm, result)
+
+                    # Children of this batch can start (or are pruned) before its events go out
+                    newly_pruned = release()
+
+                    for norm, result in zip(batch, batch_results):
+                        completed += 1
+
+                        if result is None:
+                            logger.error(f"[{completed}/{total}] ERROR {norm['id']}")
+                            # Still yield progress even on error
+                            yield ('progress', completed, total, norm['id'])
+                            continue
+
+                        logger.info(f"[{completed}/{total}] OK {norm['id']}")
+
+                        # Stream applicable norms as soon as they are known
+                        if result["applies"]:
+                            yield ('verdict', result)
+
+                        # Yield progress immediately
+                        yield ('progress', completed, total, norm['id'])
+
+                    for norm in newly_pruned:
+                        completed += 1
+                        yield ('progress', completed, total, norm['id'])
+
+            stats["llm_requests_planned"] = len(batches)
+            if stats["graph_pruned"]:
+                logger.info(f"Norm graph pruned {stats['graph_pruned']} norms under rejected parents")
+        finally:
+            # If the consumer stopped early (e.g. the SSE client went away) cancel
+            # everything still queued or in flight instead of draining it
+            unfinished = [task for task in tasks if not task.done()]
+            for task in unfinished:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+            if unfinished:
+                limiter = engine.limiter
+                logger.info(f"Analysis stopped early after {completed}/{total} norms: cancelled {len(unfinished)} "
+                            f"pending tasks, {limiter.calls_saved} LLM calls saved "
+                            f"({limiter.calls_aborted} more aborted in flight)")
+
+        stats["concurrency"] = engine.stats()
+        logger.info(f"Concurrency: final limit {stats['concurrency']['limit']}, "
+                    f"peak {stats['concurrency']['peak_limit']}, "
+                    f"{stats['concurrency']['overloads']} overloaded responses")
+        if "hedges" in stats["concurrency"]:
+            logger.info(f"Hedging: {stats['concurrency']['hedges']} duplicate calls, "
+                        f"{stats['concurrency']['hedge_wins']} answered first")
+
     # Sort matched results by confidence
     matched_results.sort(key=lambda x: x["confidence"], reverse=True)
 
+    stats["tiers"] = tier_stats.summary()
+    if cascade and "screen" in stats["tiers"]:
+        screened = stats["tiers"]["screen"]["norms"]
+        escalated = stats["tiers"].get("main", {}).get("norms", 0)
+        stats["escalation_rate"] = round(escalated / screened, 3) if screened else 0
+        logger.info(f"Cascade: {escalated}/{screened} screened norms escalated to {MATCH_MODEL}")
+    for tier, tier_summary in stats["tiers"].items():
+        logger.info(f"Tier {tier}: {tier_summary['requests']} requests, {tier_summary['norms']} norms, "
+                    f"avg {tier_summary['avg_ms']}ms, p95 {tier_summary['p95_ms']}ms")
+
+    stats["audit_matches"] = audit_matches
+    stats["estimated_recall"] = _estimate_recall(stats, shortlist_matches, audit_matches)
+    if stats["estimated_recall"] is not None:
+        logger.info(f"Shortlist recall estimate: {stats['estimated_recall']} "
+                    f"({audit_matches} matches in {stats['audited']} audited norms)")
+
     logger.info(f"Found {len(matched_results)} applicable norms out of {len(all_results)} total")
 
+    yield ('stats', stats)
+
     # Yield final results - both matched AND all results
     yield ('complete', matched_results, all_results)
@@ -0,0 +1,299 @@
+"""
+Deterministic numeric pre-evaluation of norm applicability
+Parses voltage, current, power, frequency, weight and age thresholds out of a
+norm's "applies_to" text and compares them with the quantities mentioned in the
+product description. Clear-cut cases are decided without an LLM call.
+
+Quantities are represented as intervals: (dimension, low, high, qualifier)
+where qualifier is 'AC', 'DC' or None.
+"""
+import re
+import logging
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+INF = float('inf')
+EPSILON = 1e-9
+
+# Unit -> (dimension, multiplier to base unit). Units are case sensitive so that
+# "5G" (cellular) is not read as 5 grams.
+UNITS = {
+    'mV': ('voltage', 1e-3), 'V': ('voltage', 1.0), 'kV': ('voltage', 1e3),
+    'mA': ('current', 1e-3), 'A': ('current', 1.0),
+    'mW': ('power', 1e-3), 'W': ('power', 1.0), 'kW': ('power', 1e3),
+    'Hz': ('frequency', 1.0), 'kHz': ('frequency', 1e3), 'MHz': ('frequency', 1e6), 'GHz': ('frequency', 1e9),
+    'g': ('weight', 1e-3), 'kg': ('weight', 1.0),
+}
+
+# Radio bands named by a single frequency ("2.4GHz band") are treated as a band
+# around that value. Low frequencies (mains, refresh rates) are only compared
+# against low frequencies and vice versa.
+RADIO_FREQUENCY_MIN = 1e6
+BAND_TOLERANCE = (0.95, 1.25)
+
+# Product radio frequencies only count next to a radio keyword, so a "1.2GHz CPU"
+# is not mistaken for the product's radio band
+_RADIO_CONTEXT_RE = re.compile(
+    r"wi-?fi|wlan|bluetooth|\bble\b|radio|wireless|\bband\b|zigbee|z-wave|lora|nfc|rfid|\brf\b|lte|cellular|ism",
+    re.IGNORECASE
+)
+RADIO_CONTEXT_WINDOW = 40
+
+# Words that carry no applicability condition beyond the numeric clause
+GENERIC_SCOPE_WORDS = {
+    'all', 'any', 'electrical', 'electronic', 'electric', 'equipment', 'product', 'products',
+    'device', 'devices', 'apparatus', 'or', 'and', 'ac', 'dc'
+}
+
+_NUMBER = r"(\d+(?:[.,]\d+)?)"
+_UNIT = r"(mV|kV|V|mA|A|mW|kW|W|kHz|MHz|GHz|Hz|kg|g)"
+_UNIT_END = r"(?:\b|(?=AC\b|DC\b))"
+_QUALIFIER = r"(?:\s*(AC|DC|~))?"
+
+_RANGE_RE = re.compile(_NUMBER + r"\s*(?:-|–|to|/)\s*" + _NUMBER + r"\s*" + _UNIT + _UNIT_END + _QUALIFIER)
+_COMPARISON_RE = re.compile(
+    r"(<=|>=|≤|≥|<|>|\bunder\b|\bbelow\b|\bover\b|\babove\b|\bup to\b|\bless than\b|\bmore than\b|"
+    r"\bat least\b|\bmax(?:imum)?\b|\bmin(?:imum)?\b)\s*" + _NUMBER + r"\s*" + _UNIT + _UNIT_END + _QUALIFIER,
+    re.IGNORECASE
+)
+_VALUE_RE = re.compile(_NUMBER + r"\s*" + _UNIT + _UNIT_END + _QUALIFIER)
+# Quantities per unit of time (e.g. REACH "10 tonnes/year") are not product properties.
+# Only a time unit makes "/" a rate - "5V/3A" lists two quantities
+_RATE_RE = re.compile(
+    r"^\s*(?:/\s*(?:year|yr|a|month|day|d|hour|h)\b|per\s+(?:year|annum|month|day|hour))", re.IGNORECASE
+)
+
+_NORM_AGE_RE = re.compile(
+    r"(?:children|child|kids|infants|ages?)\s+(?:aged\s+)?(?:under|below|younger than|up to(?: and including)?)\s+"
+    r"(\d+)\s*(months?|years?)?", re.IGNORECASE
+)
+_NORM_AGE_SUFFIX_RE = re.compile(r"(\d+)\s*(months?|years?)\s+(?:and|or)\s+(?:under|younger)", re.IGNORECASE)
+
+_PRODUCT_AGE_PLUS_RE = re.compile(
+    r"(?:ages?|aged)\s*(\d+)\s*\+|(\d+)\s*\+\s*(?:years?|yrs?)\b|(\d+)\s*(?:years?|yrs?)\s*(?:\+|and\s+(?:up|older|over))",
+    re.IGNORECASE
+)
+_PRODUCT_AGE_RANGE_RE = re.compile(r"(?:ages?|aged)\s*(\d+)\s*(?:-|–|to)\s*(\d+)\s*(months?|years?)?", re.IGNORECASE)
+_PRODUCT_ADULT_RE = re.compile(r"\b(?:adults? only|for adults|adult use)\b", re.IGNORECASE)
+
+
+def _to_float(text: str) -> float:
+    return float(text.replace(',', '.'))
+
+
+def _qualifier(raw: Optional[str], dimension: str) -> Optional[str]:
+    if dimension != 'voltage' or not raw:
+        return None
+    raw = raw.upper()
+    if raw in ('AC', '~'):
+        return 'AC'
+    if raw == 'DC':
+        return 'DC'
+    return None
+
+
+def _is_rate(text: str, end: int) -> bool:
+    return bool(_RATE_RE.match(text[end:end + 12]))
+
+
+def _comparison_interval(operator: str, value: float) -> Tuple[float, float]:
+    operator = operator.lower()
+    if operator in ('<', 'under', 'below', 'less than'):
+        return 0.0, value - EPSILON
+    if operator in ('<=', '≤', 'up to', 'max', 'maximum'):
+        return 0.0, value
+    if operator in ('>', 'over', 'above', 'more than'):
+        return value + EPSILON, INF
+    return value, INF  # >=, ≥, at least, min, minimum
+
+
+def _band(value: float) -> Tuple[float, float]:
+    return value * BAND_TOLERANCE[0], value * BAND_TOLERANCE[1]
+
+
+def _extract_unit_quantities(text: str, point_values: bool) -> Tuple[List[tuple], str]:
+    """
+    Extract unit-bearing quantities from text.
+
+    Args:
+        text: Text to scan
+        point_values: Whether single values count as quantities (always for products,
+                      only radio bands for norms)
+
+    Returns:
+        Tuple of (intervals, text with the matched clauses removed)
+    """
+    intervals = []
+    consumed = []
+
+    for match in _RANGE_RE.finditer(text):
+        if _is_rate(text, match.end()):
+            continue
+        dimension, factor = UNITS[match.group(3)]
+        low, high = sorted((_to_float(match.group(1)) * factor, _to_float(match.group(2)) * factor))
+        intervals.append((dimension, low, high, _qualifier(match.group(4), dimension)))
+        consumed.append(match.span())
+
+    for match in _COMPARISON_RE.finditer(text):
+        if _is_rate(text, match.end()) or any(s <= match.start() < e for s, e in consumed):
+            continue
+        dimension, factor = UNITS[match.group(3)]
+        low, high = _comparison_interval(match.group(1), _to_float(match.group(2)) * factor)
+        intervals.append((dimension, low, high, _qualifier(match.group(4), dimension)))
+        consumed.append(match.span())
+
+    for match in _VALUE_RE.finditer(text):
+        if _is_rate(text, match.end()) or any(s <= match.start() < e for s, e in consumed):
+            continue
+        dimension, factor = UNITS[match.group(2)]
+        value = _to_float(match.group(1)) * factor
+        if dimension == 'frequency' and value >= RADIO_FREQUENCY_MIN:
+            if point_values:
+                context = text[max(0, match.start() - RADIO_CONTEXT_WINDOW):match.end() + RADIO_CONTEXT_WINDOW]
+                if not _RADIO_CONTEXT_RE.search(context):
+                    continue
+                low, high = value, value
+            else:
+                low, high = _band(value)
+        elif point_values:
+            low, high = value, value
+        else:
+            continue
+        intervals.append((dimension, low, high, _qualifier(match.group(3), dimension)))
+        consumed.append(match.span())
+
+    remainder = text
+    for start, end in sorted(consumed, reverse=True):
+        remainder = remainder[:start] + " " + remainder[end:]
+
+    return intervals, remainder
+
+
+def _age_years(value: str, unit: Optional[str]) -> float:
+    years = float(value)
+    if unit and unit.lower().startswith('month'):
+        years /= 12
+    return years
+
+
+@lru_cache(maxsize=4096)
+def parse_norm_thresholds(applies_to: str) -> Tuple[tuple, bool]:
+    """
+    Parse numeric thresholds from an applies_to string.
+
+    Returns:
+        Tuple of (intervals, generic) - generic is True when nothing but the numeric
+        clause restricts the scope (e.g. "All electrical equipment 50-1000V AC")
+    """
+    intervals, remainder = _extract_unit_quantities(applies_to or "", point_values=False)
+
+    for pattern in (_NORM_AGE_RE, _NORM_AGE_SUFFIX_RE):
+        for match in pattern.finditer(remainder):
+            intervals.append(('age', 0.0, _age_years(match.group(1), match.group(2)), None))
+
+    words = re.findall(r"[a-z]+", remainder.lower())
+    generic = bool(intervals) and all(word in GENERIC_SCOPE_WORDS for word in words)
+    return tuple(intervals), generic
+
+
+def extract_product_quantities(product_description: str) -> Dict[str, List[tuple]]:
+    """
+    Extract the quantities mentioned in a product description, grouped by dimension.
+    """
+    text = product_description or ""
+    intervals, _ = _extract_unit_quantities(text, point_values=True)
+
+    for match in _PRODUCT_AGE_RANGE_RE.finditer(text):
+        unit = match.group(3)
+        intervals.append(('age', _age_years(match.group(1), unit), _age_years(match.group(2), unit), None))
+    for match in _PRODUCT_AGE_PLUS_RE.finditer(text):
+        intervals.append(('age', float(match.group(1) or match.group(2) or match.group(3)), INF, None))
+    if _PRODUCT_ADULT_RE.search(text):
+        intervals.append(('age', 18.0, INF, None))
+
+    quantities: Dict[str, List[tuple]] = {}
+    for interval in intervals:
+        quantities.setdefault(interval[0], []).append(interval)
+    return quantities
+
+
+def _overlaps(product: tuple, norm: tuple) -> bool:
+    _, p_low, p_high, p_qualifier = product
+    _, n_low, n_high, n_qualifier = norm
+    if p_qualifier and n_qualifier and p_qualifier != n_qualifier:
+        return False
+    return p_low <= n_high and n_low <= p_high
+
+
+def _comparable(product: tuple, norm: tuple) -> bool:
+    """Radio frequencies are only compared with radio frequencies (and low with low)"""
+    if product[0] != 'frequency':
+        return True
+    return (product[2] >= RADIO_FREQUENCY_MIN) == (norm[2] >= RADIO_FREQUENCY_MIN)
+
+
+def _describe(interval: tuple) -> str:
+    dimension, low, high, qualifier = interval
+    suffix = f" {qualifier}" if qualifier else ""
+    if high == INF:
+        return f"{dimension} >= {low:g}{suffix}"
+    if low == 0:
+        return f"{dimension} <= {high:g}{suffix}"
+    return f"{dimension} {low:g}-{high:g}{suffix}"
+
+
+def evaluate_norm(product_quantities: Dict[str, List[tuple]], norm: dict) -> Optional[dict]:
+    """
+    Decide a norm locally when its numeric thresholds settle the question.
+
+    A norm is rejected when, for some dimension it constrains, every comparable
+    product quantity lies outside all of the norm's intervals. It is accepted only
+    when the applies_to text is generic apart from its thresholds and every
+    constrained dimension has a product quantity inside the range.
+
+    Returns:
+        Result dict (same shape as check_norm_applies) or None if the LLM must decide
+    """
+    norm_intervals, generic = parse_norm_thresholds(norm.get('applies_to', ''))
+    if not norm_intervals or not product_quantities:
+        return None
+
+    by_dimension: Dict[str, List[tuple]] = {}
+    for interval in norm_intervals:
+        by_dimension.setdefault(interval[0], []).append(interval)
+
+    matched_dimensions = 0
+    for dimension, intervals in by_dimension.items():
+        products = [
+            p for p in product_quantities.get(dimension, [])
+            if any(_comparable(p, n) for n in intervals)
+        ]
+        if not products:
+            continue
+
+        if not any(_overlaps(p, n) for p in products for n in intervals if _comparable(p, n)):
+            reasoning = (f"Rule-based check: product {', '.join(_describe(p) for p in products)} is outside "
+                         f"the norm scope ({' or '.join(_describe(n) for n in intervals)}).")
+            return _rule_result(norm, False, 95, reasoning)
+
+        matched_dimensions += 1
+
+    if generic and matched_dimensions == len(by_dimension):
+        reasoning = (f"Rule-based check: product is within the norm scope "
+                     f"({' or '.join(_describe(n) for n in norm_intervals)}).")
+        return _rule_result(norm, True, 90, reasoning)
+
+    return None
+
+
+def _rule_result(norm: dict, applies: bool, confidence: int, reasoning: str) -> dict:
+    return {
+        "norm_id": norm["id"],
+        "norm_name": norm["name"],
+        "applies": applies,
+        "confidence": confidence,
+        "reasoning": reasoning,
+        "url": norm.get("url", "")
+    }
@@ -5,14 +5,29 @@ Generic API client for making OpenRouter calls
 
 import requests
 import json
+import time
+import asyncio
 import logging
 import os
+import weakref
+from collections import deque
+from threading import Lock
+from requests.adapters import HTTPAdapter
+from .rate_limiter import get_rate_limiter, INTERACTIVE_FLOW
 
 logger = logging.getLogger(__name__)
 
 # OpenRouter API settings
 OPENROUTER_API_KEY = os.environ.get("openrouter")
 OPENROUTER_API_URL = 'https://openrouter.ai/api/v1/chat/completions'
+OPENROUTER_TIMEOUT = 30
+
+# Connection pool - sized to the norm matcher's maximum concurrency
+OPENROUTER_POOL_SIZE = int(os.getenv('OPENROUTER_POOL_SIZE', os.getenv('LLM_MAX_CONCURRENCY', '64')))
+# Retries after connection errors (e.g. a stale keep-alive connection); HTTP errors are never retried
+OPENROUTER_MAX_RETRIES = int(os.getenv('OPENROUTER_MAX_RETRIES', '1'))
+# Number of recent calls kept for latency percentiles
+OPENROUTER_STATS_WINDOW = int(os.getenv('OPENROUTER_STATS_WINDOW', '2000'))
 
 # Log API key status on module load
 if OPENROUTER_API_KEY:
@@ -21,93 +36,349 @@ else:
     logger.error("✗ OpenRouter API key NOT FOUND! Set 'openrouter' environment variable.")
 
 
-def call_openrouter(messages: list, model: str = "openai/gpt-4o-mini",
-                    temperature: float = 0.3, max_tokens: int = 512) -> dict:
-    """
-    Generic OpenRouter API call
+def _request_headers() -> dict:
+    """HTTP headers for OpenRouter requests"""
+    return {
+        "Authorization": f"Bearer {OPENROUTER_API_KEY}",
+        "HTTP-Referer": "https://normscout.fly.dev",
+        "X-Title": "NormScout",
+        "Content-Type": "application/json"
+    }
 
-    Args:
-        messages: List of message dicts with 'role' and 'content'
-        model: Model to use (default: gpt-4o-mini)
-        temperature: Response randomness (0-1)
-        max_tokens: Max response length
 
-    Returns:
-        Dict with either:
-        - {"success": True, "content": "response text"}
-        - {"success": False, "error": "error message"}
+def _parse_api_response(response) -> dict:
     """
-    if not OPENROUTER_API_KEY:
+    Turn an OpenRouter HTTP response (requests or httpx) into the result dict
+    returned by call_openrouter / call_openrouter_async.
+    """
+    if response.status_code == 200:
+        result = response.json()
+        if 'choices' in result and len(result['choices']) > 0:
+            content = result['choices'][0]['message']['content']
+            logger.info(f"API call successful, response length: {len(content)} chars")
+            return {
+                "success": True,
+                "content": content,
+                "usage": result.get('usage') or {}
+            }
+        else:
+            return {
+                "success": False,
+                "error": "Unexpected API response structure",
+                "status_code": response.status_code
+            }
+    else:
+        error_msg = f"API returned status {response.status_code}"
+        try:
+            error_json = response.json()
+            if 'error' in error_json:
+                error_msg = error_json.get('error', {}).get('message', error_msg)
+        except:
+            pass
+
+        logger.error(f"OpenRouter API error: {error_msg}")
         return {
             "success": False,
-            "error": "OpenRouter API key not configured"
+            "error": error_msg,
+            "status_code": response.status_code
         }
 
-    try:
-        headers = {
-            "Authorization": f"Bearer {OPENROUTER_API_KEY}",
-            "HTTP-Referer": "https://normscout.fly.dev",
-            "X-Title": "NormScout",
-            "Content-Type": "application/json"
-        }
 
-        payload = {
+class CallStats:
+    """
+    Thread-safe per-call instrumentation for the OpenRouter client.
+    Keeps running totals plus a window of recent latencies for percentiles.
+    """
+
+    def __init__(self, window: int = OPENROUTER_STATS_WINDOW):
+        self._lock = Lock()
+        self._window = window
+        self._latencies = deque(maxlen=window)
+        self._model_latencies = {}
+        self._models = {}
+        self.calls = 0
+        self.errors = 0
+        self.retries = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.status_codes = {}
+
+    def record(self, model: str, latency: float, result: dict, retries: int):
+        status = "ok" if result["success"] else str(result.get("status_code") or "failed")
+        usage = result.get("usage") or {}
+        prompt_tokens = usage.get("prompt_tokens") or 0
+        completion_tokens = usage.get("completion_tokens") or 0
+
+        with self._lock:
+            self.calls += 1
+            self.errors += 0 if result["success"] else 1
+            self.retries += retries
+            self.prompt_tokens += prompt_tokens
+            self.completion_tokens += completion_tokens
+            self.status_codes[status] = self.status_codes.get(status, 0) + 1
+            self._latencies.append(latency)
+            self._model_latencies.setdefault(model, deque(maxlen=self._window)).append(latency)
+
+            entry = self._models.setdefault(model, {"calls": 0, "errors": 0, "latency_s": 0.0,
+                                                    "prompt_tokens": 0, "completion_tokens": 0})
+            entry["calls"] += 1
+            entry["errors"] += 0 if result["success"] else 1
+            entry["latency_s"] += latency
+            entry["prompt_tokens"] += prompt_tokens
+            entry["completion_tokens"] += completion_tokens
+
+    def latency_percentile(self, percentile: float, model: str = None, min_samples: int = 1):
+        """
+        Latency (seconds) at the given percentile of the recent window.
+
+        Args:
+            percentile: 0-100
+            model: Only consider calls to this model (default: all calls)
+            min_samples: Return None unless at least this many calls were recorded
+        """
+        with self._lock:
+            window = self._latencies if model is None else self._model_latencies.get(model, ())
+            latencies = sorted(window)
+        if not latencies or len(latencies) < min_samples:
+            return None
+        return latencies[min(len(latencies) - 1, int(percentile / 100 * len(latencies)))]
+
+    def summary(self) -> dict:
+        p50, p95, p99 = (self.latency_percentile(p) for p in (50, 95, 99))
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "errors": self.errors,
+                "retries": self.retries,
+                "status_codes": dict(self.status_codes),
+                "prompt_tokens": self.prompt_tokens,
+                "completion_tokens": self.completion_tokens,
+                "latency_ms": {
+                    "p50": round(1000 * p50) if p50 is not None else None,
+                    "p95": round(1000 * p95) if p95 is not None else None,
+                    "p99": round(1000 * p99) if p99 is not None else None,
+                },
+                "models": {
+                    model: {
+                        "calls": entry["calls"],
+                        "errors": entry["errors"],
+                        "avg_ms": round(1000 * entry["latency_s"] / entry["calls"]),
+                        "prompt_tokens": entry["prompt_tokens"],
+                        "completion_tokens": entry["completion_tokens"],
+                    }
+                    for model, entry in self._models.items()
+                }
+            }
+
+
+class OpenRouterClient:
+    """
+    Reusable OpenRouter client with keep-alive connection pools.
+
+    Blocking calls go through a requests.Session, async calls through one
+    httpx.AsyncClient per event loop. Every call first takes a token from the
+    cluster-wide rate limiter (when Redis is configured), queued under its flow. Both pools are bounded to pool_size
+    connections (sized to the matcher's maximum concurrency). Failed connection
+    attempts - typically a pooled keep-alive socket closed by the server - are
+    retried up to max_retries times; HTTP errors are returned as they are.
+    """
+
+    def __init__(self, pool_size: int = OPENROUTER_POOL_SIZE, timeout: int = OPENROUTER_TIMEOUT,
+                 max_retries: int = OPENROUTER_MAX_RETRIES):
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.stats = CallStats()
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=True)
+        self.session.mount("https://", adapter)
+        self.session.headers.update(_request_headers())
+
+        self._async_clients = weakref.WeakKeyDictionary()
+
+    def _payload(self, messages: list, model: str, temperature: float, max_tokens: int) -> dict:
+        return {
             "model": model,
             "messages": messages,
             "temperature": temperature,
             "max_tokens": max_tokens
         }
 
-        logger.info(f"Calling OpenRouter API with model: {model}")
+    def call(self, messages: list, model: str, temperature: float = 0.3, max_tokens: int = 512,
+             flow: str = None, weight: float = None) -> dict:
+        """Blocking chat completion call (see call_openrouter)"""
+        payload = self._payload(messages, model, temperature, max_tokens)
 
-        response = requests.post(
-            OPENROUTER_API_URL,
-            headers=headers,
-            json=payload,
-            timeout=30
-        )
+        limiter = get_rate_limiter()
+        if limiter:
+            limiter.acquire(flow or INTERACTIVE_FLOW, weight)
 
-        if response.status_code == 200:
-            result = response.json()
-            if 'choices' in result and len(result['choices']) > 0:
-                content = result['choices'][0]['message']['content']
-                logger.info(f"API call successful, response length: {len(content)} chars")
-                return {
-                    "success": True,
-                    "content": content
-                }
-            else:
-                return {
+        started = time.perf_counter()
+        retries = 0
+
+        while True:
+            try:
+                response = self.session.post(OPENROUTER_API_URL, json=payload, timeout=self.timeout)
+                result = _parse_api_response(response)
+                break
+            except requests.exceptions.Timeout:
+                result = {
                     "success": False,
-                    "error": "Unexpected API response structure"
+                    "error": f"Request timed out after {self.timeout} seconds",
+                    "status_code": None
                 }
-        else:
-            error_msg = f"API returned status {response.status_code}"
+                break
+            except requests.exceptions.ConnectionError as e:
+                if retries < self.max_retries:
+                    retries += 1
+                    logger.warning(f"OpenRouter connection error ({e}), retrying ({retries}/{self.max_retries})")
+                    continue
+                result = {"success": False, "error": f"API call failed: {str(e)}", "status_code": None}
+                break
+            except Exception as e:
+                logger.exception(f"Exception calling OpenRouter API: {str(e)}")
+                result = {"success": False, "error": f"API call failed: {str(e)}"}
+                break
+
+        self.stats.record(model, time.perf_counter() - started, result, retries)
+        return result
+
+    def _async_client(self):
+        import httpx
+        loop = asyncio.get_running_loop()
+        client = self._async_clients.get(loop)
+        if client is None:
+            client = httpx.AsyncClient(
+                headers=_request_headers(),
+                timeout=self.timeout,
+                limits=httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size)
+            )
+            self._async_clients[loop] = client
+        return client
+
+    async def acall(self, messages: list, model: str, temperature: float = 0.3, max_tokens: int = 512,
+                    flow: str = None, weight: float = None, rate_limited: bool = False) -> dict:
+        """Async chat completion call (see call_openrouter_async)"""
+        import httpx
+        client = self._async_client()
+        payload = self._payload(messages, model, temperature, max_tokens)
+
+        limiter = None if rate_limited else get_rate_limiter()
+        if limiter:
+            await limiter.acquire_async(flow or INTERACTIVE_FLOW, weight)
+
+        started = time.perf_counter()
+        retries = 0
+
+        while True:
             try:
-                error_json = response.json()
-                if 'error' in error_json:
-                    error_msg = error_json.get('error', {}).get('message', error_msg)
-            except:
-                pass
+                response = await client.post(OPENROUTER_API_URL, json=payload)
+                result = _parse_api_response(response)
+                break
+            except httpx.TimeoutException:
+                result = {
+                    "success": False,
+                    "error": f"Request timed out after {self.timeout} seconds",
+                    "status_code": None
+                }
+                break
+            except (httpx.ConnectError, httpx.RemoteProtocolError) as e:
+                if retries < self.max_retries:
+                    retries += 1
+                    logger.warning(f"OpenRouter connection error ({e}), retrying ({retries}/{self.max_retries})")
+                    continue
+                result = {"success": False, "error": f"API call failed: {str(e)}", "status_code": None}
+                break
+            except Exception as e:
+                logger.exception(f"Exception calling OpenRouter API: {str(e)}")
+                result = {"success": False, "error": f"API call failed: {str(e)}"}
+                break
 
-            logger.error(f"OpenRouter API error: {error_msg}")
-            return {
-                "success": False,
-                "error": error_msg
-            }
+        self.stats.record(model, time.perf_counter() - started, result, retries)
+        return result
+
+    async def aclose(self):
+        """Close the async client of the running event loop"""
+        client = self._async_clients.pop(asyncio.get_running_loop(), None)
+        if client is not None:
+            await client.aclose()
+
+
+_client = None
+_client_lock = Lock()
+
+
+def get_openrouter_client() -> OpenRouterClient:
+    """Get the shared OpenRouter client for this process"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = OpenRouterClient()
+    return _client
+
+
+def get_openrouter_stats() -> dict:
+    """Get call statistics (latency, status codes, retries, tokens) for this process"""
+    return get_openrouter_client().stats.summary()
+
+
+def call_openrouter(messages: list, model: str = "openai/gpt-4o-mini",
+                    temperature: float = 0.3, max_tokens: int = 512) -> dict:
+    """
+    Generic OpenRouter API call
+
+    Args:
+        messages: List of message dicts with 'role' and 'content'
+        model: Model to use (default: gpt-4o-mini)
+        temperature: Response randomness (0-1)
+        max_tokens: Max response length
 
-    except requests.exceptions.Timeout:
+    Returns:
+        Dict with either:
+        - {"success": True, "content": "response text", "usage": {...}}
+        - {"success": False, "error": "error message", "status_code": int or None}
+    """
+    if not OPENROUTER_API_KEY:
         return {
             "success": False,
-            "error": "Request timed out after 30 seconds"
+            "error": "OpenRouter API key not configured"
         }
-    except Exception as e:
-        logger.exception(f"Exception calling OpenRouter API: {str(e)}")
+
+    logger.info(f"Calling OpenRouter API with model: {model}")
+    return get_openrouter_client().call(messages, model=model, temperature=temperature, max_tokens=max_tokens)
+
+
+async def call_openrouter_async(messages: list, model: str = "openai/gpt-4o-mini",
+                                temperature: float = 0.3, max_tokens: int = 512,
+                                flow: str = None, weight: float = None, rate_limited: bool = False) -> dict:
+    """
+    Async variant of call_openrouter for asyncio callers (e.g. the norm matching engine).
+
+    Args:
+        messages: List of message dicts with 'role' and 'content'
+        model: Model to use (default: gpt-4o-mini)
+        temperature: Response randomness (0-1)
+        max_tokens: Max response length
+        flow: Rate limiter flow the call is queued under (default: interactive)
+        weight: Weighted-fair-queuing weight of the flow
+        rate_limited: The caller already took a rate limiter token for this call
+
+    Returns:
+        Same dict shape as call_openrouter
+    """
+    if not OPENROUTER_API_KEY:
         return {
             "success": False,
-            "error": f"API call failed: {str(e)}"
+            "error": "OpenRouter API key not configured"
         }
 
+    logger.info(f"Calling OpenRouter API (async) with model: {model}")
+    return await get_openrouter_client().acall(messages, model=model, temperature=temperature,
+                                               max_tokens=max_tokens, flow=flow, weight=weight,
+                                               rate_limited=rate_limited)
+
 
 def validate_product_input(product: str) -> bool:
     """
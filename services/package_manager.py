@@ -364,19 +364,45 @@ class PackageManager:
         Returns:
             List of database filenames (e.g., ['norms.json', 'norms_us.json'])
         """
-        # Always include free tier
-        databases = set(FREE_DATABASES)
+        return self._allowed_databases(self._accessible_packages(user_id))
+
+    def get_priority_tier(self, user_id: str) -> str:
+        """
+        Get the scheduling priority tier for a user's LLM calls.
+
+        Args:
+            user_id: User's UUID
 
-        # Get active and trial packages
+        Returns:
+            'bundle' (active mega bundle), 'paid' (any active package),
+            'trial' (trial packages only) or 'free'
+        """
+        return self._priority_tier(self._accessible_packages(user_id))
+
+    def get_analysis_access(self, user_id: str) -> Tuple[List[str], str]:
+        """
+        Get the allowed databases and the priority tier from one package lookup.
+
+        Args:
+            user_id: User's UUID
+
+        Returns:
+            (database filenames, priority tier) - see get_allowed_databases and get_priority_tier
+        """
+        packages = self._accessible_packages(user_id)
+        return self._allowed_databases(packages), self._priority_tier(packages)
+
+    def _accessible_packages(self, user_id: str) -> List[Dict]:
+        """Active and trial packages that haven't expired"""
         active_packages = self.get_user_packages(user_id, status='active')
         trial_packages = self.get_user_packages(user_id, status='trial')
-        all_packages = active_packages + trial_packages
+        return [pkg for pkg in active_packages + trial_packages if self._is_package_accessible(pkg)]
 
-        for pkg in all_packages:
-            # Check if package is actually accessible (not expired)
-            if not self._is_package_accessible(pkg):
-                continue
+    def _allowed_databases(self, packages: List[Dict]) -> List[str]:
+        # Always include free tier
+        databases = set(FREE_DATABASES)
 
+        for pkg in packages:
             package_type = pkg.get('package_type')
             pkg_config = PACKAGES.get(package_type)
 
@@ -393,6 +419,19 @@ class PackageManager:
 
         return sorted(list(databases))
 
+    def _priority_tier(self, packages: List[Dict]) -> str:
+        tier = 'free'
+
+        for pkg in packages:
+            if pkg.get('status') == 'trial':
+                tier = 'trial' if tier == 'free' else tier
+                continue
+            if PACKAGES.get(pkg.get('package_type'), {}).get('is_bundle'):
+                return 'bundle'
+            tier = 'paid'
+
+        return tier
+
     def _is_package_accessible(self, package: Dict) -> bool:
         """
         Check if a package record is currently accessible.
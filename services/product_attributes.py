@@ -0,0 +1,254 @@
+"""
+Structured product attributes
+A typed attribute record (voltages, power, radio, battery chemistry, markets,
+users, materials, ...) extracted once per analysis together with the product
+summary. Numeric rules and retrieval read the structured fields, and per-norm
+prompts add the attributes relevant to the norms being checked to the summary
+"""
+import os
+import re
+import json
+import logging
+from typing import Dict, List, Optional
+
+from .openrouter import call_openrouter
+from .norm_index import tokenize
+from .norm_thresholds import extract_product_quantities, parse_norm_thresholds
+
+logger = logging.getLogger(__name__)
+
+# Append the relevant attributes to the summary in per-norm prompts
+STRUCTURED_PROMPTS = os.getenv('NORM_STRUCTURED_PROMPTS', 'true').lower() == 'true'
+
+ATTRIBUTES_MODEL = "anthropic/claude-3.5-sonnet"
+
+# Attribute record: field -> (kind, hint for the extraction prompt). kind is 'text', 'list' or 'bool'
+ATTRIBUTE_SCHEMA = {
+    'product_type': ('text', 'short product type, e.g. "smart thermostat"'),
+    'category': ('text', 'product category, e.g. "consumer electronics", "toy", "machinery"'),
+    'electrical': ('bool', 'true if the product uses electricity'),
+    'power_sources': ('list', 'e.g. "mains", "battery", "USB", "PoE", "solar"'),
+    'voltages': ('list', 'with unit and AC/DC, e.g. "230V AC", "5V DC"'),
+    'currents': ('list', 'e.g. "2A"'),
+    'power': ('list', 'e.g. "5W"'),
+    'radio': ('list', 'radio technologies with bands, e.g. "WiFi 2.4GHz", "Bluetooth LE 2.4GHz"'),
+    'battery_chemistry': ('list', 'e.g. "lithium-ion", "NiMH"'),
+    'battery_capacity': ('text', 'e.g. "3000mAh"'),
+    'target_markets': ('list', 'e.g. "EU", "US", "China"'),
+    'intended_users': ('list', 'e.g. "consumers", "children aged 3+ years", "professionals"'),
+    'environment': ('list', 'e.g. "indoor", "outdoor", "industrial", "household"'),
+    'materials': ('list', 'e.g. "ABS plastic", "stainless steel"'),
+    'food_contact': ('bool', 'true if it touches food or drink'),
+    'medical_use': ('bool', 'true if it has a medical purpose'),
+}
+
+# Always part of a prompt's attribute list
+CORE_ATTRIBUTES = ('product_type', 'category', 'electrical', 'target_markets')
+
+# Fields holding quantities the numeric rules understand
+QUANTITY_ATTRIBUTES = ('voltages', 'currents', 'power', 'radio', 'intended_users')
+
+# Norm terms (after tokenize) that make an attribute relevant to a norm
+ATTRIBUTE_KEYWORDS = {
+    'power_sources': 'power supply mains battery charger usb solar electrical electric',
+    'voltages': 'voltage mains electrical electric ac dc supply lvd',
+    'currents': 'current ampere electrical supply',
+    'power': 'power watt energy consumption standby ecodesign efficiency',
+    'radio': 'radio wireless wifi bluetooth rf spectrum emc electromagnetic telecommunication antenna nfc zigbee lte cellular',
+    'battery_chemistry': 'battery lithium cell accumulator portable',
+    'battery_capacity': 'battery lithium cell accumulator portable transport',
+    'intended_users': 'child children toy consumer professional age elderly user',
+    'environment': 'outdoor indoor industrial explosive atex marine household environment ingress',
+    'materials': 'material substance rohs reach chemical plastic packaging contact lead recycling waste weee',
+    'food_contact': 'food contact drink kitchen',
+    'medical_use': 'medical health patient clinical diagnostic',
+}
+_ATTRIBUTE_TERMS = {field: set(tokenize(words)) for field, words in ATTRIBUTE_KEYWORDS.items()}
+
+# Dimensions parsed from norm thresholds -> attribute fields holding them
+_DIMENSION_ATTRIBUTES = {
+    'voltage': ('voltages', 'power_sources'),
+    'current': ('currents',),
+    'power': ('power',),
+    'frequency': ('radio',),
+    'weight': (),
+    'age': ('intended_users',),
+}
+
+_ATTRIBUTES_BLOCK_RE = re.compile(r'---ATTRIBUTES---(.*?)---END_ATTRIBUTES---', re.DOTALL)
+
+
+def attributes_prompt_section() -> str:
+    """Prompt instructions asking for the attribute record as a JSON block"""
+    fields = "\n".join(
+        f'  "{field}": {"[...]" if kind == "list" else "true/false" if kind == "bool" else "..."}  // {hint}'
+        for field, (kind, hint) in ATTRIBUTE_SCHEMA.items()
+    )
+    return f"""After the description, output the product attributes as JSON between these markers
+(use [] / "" / false when unknown, never guess numbers):
+---ATTRIBUTES---
+{{
+{fields}
+}}
+---END_ATTRIBUTES---"""
+
+
+def normalize_attributes(raw: Optional[dict]) -> Dict:
+    """Coerce a (possibly sloppy) attribute dict to ATTRIBUTE_SCHEMA types, dropping empty fields"""
+    if not isinstance(raw, dict):
+        return {}
+
+    attributes = {}
+    for field, (kind, _) in ATTRIBUTE_SCHEMA.items():
+        value = raw.get(field)
+        if value is None:
+            continue
+        if kind == 'bool':
+            if isinstance(value, str):
+                value = value.strip().lower() in ('true', 'yes', '1')
+            attributes[field] = bool(value)
+        elif kind == 'list':
+            if isinstance(value, str):
+                value = [part for part in value.split(',')]
+            if not isinstance(value, list):
+                continue
+            items = [str(item).strip() for item in value if str(item).strip()]
+            if items:
+                attributes[field] = items
+        else:
+            text = str(value).strip()
+            if text:
+                attributes[field] = text
+    return attributes
+
+
+def split_attributes_block(text: str) -> tuple:
+    """
+    Split an LLM answer into (text without the attributes block, attributes).
+
+    Returns:
+        Tuple of (clean text, normalized attributes - {} when missing or malformed)
+    """
+    match = _ATTRIBUTES_BLOCK_RE.search(text or "")
+    if not match:
+        return (text or "").strip(), {}
+
+    clean_text = _ATTRIBUTES_BLOCK_RE.sub('', text).strip()
+    block = match.group(1)
+    # Tolerate code fences and // comments copied from the prompt
+    block = re.sub(r'```(?:json)?', '', block)
+    block = re.sub(r'//[^\n]*', '', block)
+    try:
+        return clean_text, normalize_attributes(json.loads(block))
+    except ValueError as e:
+        logger.warning(f"Could not parse product attributes: {e}")
+        return clean_text, {}
+
+
+def extract_product_attributes(product_description: str) -> Dict:
+    """
+    Extract the attribute record from an existing product description (one LLM call).
+    Used when a description was edited without going through the conversation.
+    """
+    prompt = f"""You are an EU compliance expert. Extract the technical attributes of this product.
+
+PRODUCT DESCRIPTION:
+{product_description}
+
+{attributes_prompt_section()}"""
+
+    result = call_openrouter(
+        [{"role": "user", "content": prompt}],
+        model=ATTRIBUTES_MODEL,
+        temperature=0.1,
+        max_tokens=500
+    )
+
+    if not result["success"]:
+        logger.error(f"Attribute extraction failed: {result.get('error')}")
+        return {}
+
+    _, attributes = split_attributes_block(result["content"])
+    return attributes
+
+
+def describe_attributes(attributes: Dict, fields=None) -> str:
+    """Render attributes as '- field: value' lines (in schema order)"""
+    lines = []
+    for field in ATTRIBUTE_SCHEMA:
+        if field not in attributes or (fields is not None and field not in fields):
+            continue
+        value = attributes[field]
+        if isinstance(value, bool):
+            value = 'yes' if value else 'no'
+        elif isinstance(value, list):
+            value = ', '.join(value)
+        lines.append(f"- {field.replace('_', ' ')}: {value}")
+    return "\n".join(lines)
+
+
+def relevant_attributes(norm: dict) -> set:
+    """Attribute fields a norm's decision can depend on"""
+    terms = set(tokenize(f"{norm.get('name', '')} {norm.get('applies_to', '')} "
+                         f"{norm.get('description', '')} {norm.get('category', '')}"))
+    fields = {field for field, keywords in _ATTRIBUTE_TERMS.items() if terms & keywords}
+
+    intervals, _ = parse_norm_thresholds(norm.get('applies_to', ''))
+    for interval in intervals:
+        fields.update(_DIMENSION_ATTRIBUTES.get(interval[0], ()))
+    return fields
+
+
+def product_context(product_description: str, attributes: Optional[Dict], norms: List[dict]) -> str:
+    """
+    Product text for a norm-check prompt: the full summary, followed by the
+    relevant attributes when a record is available (and NORM_STRUCTURED_PROMPTS
+    is on). The summary always stays in - the extractor can miss details.
+    """
+    if not attributes or not STRUCTURED_PROMPTS:
+        return product_description
+
+    fields = set(CORE_ATTRIBUTES)
+    for norm in norms:
+        fields |= relevant_attributes(norm)
+
+    described = describe_attributes(attributes, fields)
+    return f"{product_description}\n\nKey attributes:\n{described}" if described else product_description
+
+
+def attribute_quantities(attributes: Optional[Dict]) -> Dict[str, List[tuple]]:
+    """Numeric quantities (same shape as extract_product_quantities) from the structured fields"""
+    if not attributes:
+        return {}
+    text = ". ".join(
+        ", ".join(attributes[field]) for field in QUANTITY_ATTRIBUTES if attributes.get(field)
+    )
+    return extract_product_quantities(text) if text else {}
+
+
+def product_quantities(product_description: str, attributes: Optional[Dict] = None) -> Dict[str, List[tuple]]:
+    """
+    Product quantities for the numeric rules: structured fields win for every
+    dimension they cover, the free-text summary fills in the rest.
+    """
+    quantities = dict(extract_product_quantities(product_description))
+    quantities.update(attribute_quantities(attributes))
+    return quantities
+
+
+def retrieval_query(product_description: str, attributes: Optional[Dict] = None) -> str:
+    """Retrieval query text - the summary plus the categorical attribute values"""
+    if not attributes:
+        return product_description
+
+    terms = []
+    for field in ('product_type', 'category', 'power_sources', 'radio', 'battery_chemistry',
+                  'intended_users', 'environment', 'materials'):
+        value = attributes.get(field)
+        if value:
+            terms.extend(value if isinstance(value, list) else [value])
+    if attributes.get('food_contact'):
+        terms.append('food contact')
+    if attributes.get('medical_use'):
+        terms.append('medical device')
+    return f"{product_description}\n{' '.join(terms)}" if terms else product_description
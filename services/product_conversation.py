@@ -5,6 +5,7 @@ Migrated from NormScout_Test/AICore - adapted for web use
 """
 import logging
 from .openrouter import call_openrouter
+from .product_attributes import attributes_prompt_section, split_attributes_block
 
 logger = logging.getLogger(__name__)
 
@@ -161,6 +162,22 @@ def build_final_summary(conversation_history: list) -> str:
     Returns:
         Comprehensive product description string
     """
+    return build_product_profile(conversation_history)["description"]
+
+
+def build_product_profile(conversation_history: list) -> dict:
+    """
+    Build the product description and its structured attribute record in one LLM call.
+
+    Args:
+        conversation_history: List of conversation messages
+
+    Returns:
+        {
+            "description": str,
+            "attributes": dict (see product_attributes.ATTRIBUTE_SCHEMA, {} if unavailable)
+        }
+    """
     conversation_text = "\n".join([
         f"{'User' if msg['role'] == 'user' else 'Assistant'}: {msg['content']}"
         for msg in conversation_history
@@ -181,6 +198,8 @@ Create a detailed product summary that includes:
 
 Write it as a clear, structured technical description suitable for compliance assessment.
 
+{attributes_prompt_section()}
+
 PRODUCT DESCRIPTION:"""
 
     messages = [{"role": "user", "content": prompt}]
@@ -189,21 +208,22 @@ PRODUCT DESCRIPTION:"""
         messages,
         model="anthropic/claude-3.5-sonnet",
         temperature=0.5,
-        max_tokens=500
+        max_tokens=1000
     )
 
     if not result["success"]:
         logger.error(f"Summary generation failed: {result.get('error')}")
         # Fall back to basic concatenation
         user_messages = [msg["content"] for msg in conversation_history if msg["role"] == "user"]
-        return " ".join(user_messages)
+        return {"description": " ".join(user_messages), "attributes": {}}
 
     # Clean up
-    description = result["content"].strip()
+    description, attributes = split_attributes_block(result["content"])
     if description.startswith("PRODUCT DESCRIPTION:"):
         description = description.replace("PRODUCT DESCRIPTION:", "").strip()
 
-    return description
+    logger.info(f"Built product profile: {len(description)} chars, {len(attributes)} attributes")
+    return {"description": description, "attributes": attributes}
 
 
 def answer_analysis_question(
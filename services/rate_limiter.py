@@ -0,0 +1,300 @@
+"""
+Cluster-wide OpenRouter rate limiter with weighted fair queuing
+One Redis token bucket is shared by every gunicorn worker and Fly machine.
+Callers waiting for a token are served in weighted-fair order, so a large
+analysis cannot starve interactive calls or smaller analyses
+
+Data Structure (Redis):
+- llm_rate:bucket - Hash {tokens, ts} of the token bucket
+- llm_rate:queue - Sorted set of waiting tickets scored by WFQ finish tag
+- llm_rate:seen - Sorted set of waiting tickets scored by last poll time (stale ticket cleanup)
+- llm_rate:flow:{flow} - Finish tag of the flow's last queued ticket (expires with the flow)
+- llm_rate:vtime - Virtual time (finish tag of the last served ticket)
+"""
+import os
+import time
+import uuid
+import asyncio
+import logging
+from threading import Lock
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Opt-in: without it every worker calls OpenRouter directly, as before
+LLM_RATE_LIMIT_ENABLED = os.getenv('LLM_RATE_LIMIT_ENABLED', 'false').lower() == 'true'
+# Cluster-wide OpenRouter requests per second and bucket size (burst)
+LLM_RATE_LIMIT_RPS = float(os.getenv('LLM_RATE_LIMIT_RPS', '20'))
+LLM_RATE_LIMIT_BURST = float(os.getenv('LLM_RATE_LIMIT_BURST', '40'))
+# Give up waiting after this many seconds and send the call anyway
+LLM_RATE_LIMIT_MAX_WAIT = float(os.getenv('LLM_RATE_LIMIT_MAX_WAIT', '60'))
+# Tickets not polled for this long belong to dead callers and are dropped
+LLM_RATE_LIMIT_STALE_AFTER = float(os.getenv('LLM_RATE_LIMIT_STALE_AFTER', '10'))
+
+# Flow for calls outside an analysis (conversation, Q&A, survey) - always first in line
+INTERACTIVE_FLOW = "interactive"
+
+# WFQ weights: a flow with weight w gets w times the share of a weight-1 flow
+PRIORITY_WEIGHTS = {
+    'interactive': 50.0,
+    'bundle': 8.0,
+    'paid': 4.0,
+    'trial': 2.0,
+    'free': 1.0,
+}
+
+# Sleep bounds between polls while waiting for a token
+_MIN_POLL = 0.02
+_MAX_POLL = 1.0
+
+# Atomically: drop stale tickets, enqueue the ticket with its WFQ finish tag,
+# refill the bucket and grant a token if the ticket is among the first
+# floor(tokens) waiters. Uses Redis TIME so machines don't need synced clocks.
+#
+# KEYS: bucket, queue, seen, vtime, flow
+# ARGV: ticket, flow, weight, rate, burst, stale_after, ttl
+# Returns: {granted (0/1), wait estimate in seconds (string), rank}
+_ACQUIRE_SCRIPT = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local ticket, flow = ARGV[1], ARGV[2]
+local weight, rate, burst = tonumber(ARGV[3]), tonumber(ARGV[4]), tonumber(ARGV[5])
+local stale_after, ttl = tonumber(ARGV[6]), tonumber(ARGV[7])
+
+local stale = redis.call('ZRANGEBYSCORE', KEYS[3], '-inf', now - stale_after)
+for _, member in ipairs(stale) do
+    redis.call('ZREM', KEYS[2], member)
+    redis.call('ZREM', KEYS[3], member)
+end
+
+local tag = redis.call('ZSCORE', KEYS[2], ticket)
+if tag then
+    tag = tonumber(tag)
+else
+    local vtime = tonumber(redis.call('GET', KEYS[4]) or '0')
+    local last = tonumber(redis.call('GET', KEYS[5]) or '0')
+    tag = math.max(vtime, last) + 1 / weight
+    redis.call('SET', KEYS[5], tag)
+    redis.call('ZADD', KEYS[2], tag, ticket)
+end
+redis.call('ZADD', KEYS[3], now, ticket)
+
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(bucket[1]) or burst
+local ts = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+
+local rank = redis.call('ZRANK', KEYS[2], ticket)
+local granted = 0
+local wait = 0
+if rank < math.floor(tokens) then
+    granted = 1
+    tokens = tokens - 1
+    redis.call('ZREM', KEYS[2], ticket)
+    redis.call('ZREM', KEYS[3], ticket)
+    local vtime = tonumber(redis.call('GET', KEYS[4]) or '0')
+    if tag > vtime then
+        redis.call('SET', KEYS[4], tag)
+    end
+else
+    wait = (rank + 1 - tokens) / rate
+end
+
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+-- The flow key only outlives the flow's last poll by ttl; once vtime has passed
+-- its tag it has no effect anyway, so analyses don't accumulate state
+for i = 1, 5 do
+    redis.call('EXPIRE', KEYS[i], ttl)
+end
+return {granted, tostring(wait), rank}
+"""
+
+
+class FairRateLimiter:
+    """
+    Redis token bucket with weighted fair queuing between flows.
+
+    A flow is one analysis (or the shared interactive flow). Each waiting call
+    holds a ticket in a sorted set ordered by its WFQ finish tag; tokens go to
+    the lowest tags first. Fails open: if Redis errors, calls go through.
+    """
+
+    def __init__(self, redis_client, rate: float = LLM_RATE_LIMIT_RPS, burst: float = LLM_RATE_LIMIT_BURST,
+                 max_wait: float = LLM_RATE_LIMIT_MAX_WAIT, key_prefix: str = "llm_rate"):
+        self.redis = redis_client
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self.max_wait = max_wait
+        self.prefix = key_prefix
+        self._keys = [f"{key_prefix}:{name}" for name in ('bucket', 'queue', 'seen', 'vtime')]
+        self._script = redis_client.register_script(_ACQUIRE_SCRIPT)
+
+        # Local metrics for this process
+        self._lock = Lock()
+        self.granted = 0
+        self.waited = 0
+        self.timeouts = 0
+        self.errors = 0
+        self.total_wait = 0.0
+        self.max_observed_wait = 0.0
+
+    def _poll(self, ticket: str, flow: str, weight: float):
+        """One atomic acquire attempt. Returns (granted, wait_seconds)."""
+        ttl = int(max(60, LLM_RATE_LIMIT_STALE_AFTER * 6))
+        granted, wait, _rank = self._script(
+            keys=self._keys + [f"{self.prefix}:flow:{flow}"],
+            args=[ticket, flow, weight, self.rate, self.burst, LLM_RATE_LIMIT_STALE_AFTER, ttl]
+        )
+        return bool(int(granted)), float(wait)
+
+    def _new_ticket(self, flow: str) -> str:
+        return f"{flow}|{uuid.uuid4().hex}"
+
+    def _forget(self, ticket: str):
+        try:
+            pipeline = self.redis.pipeline()
+            pipeline.zrem(self._keys[1], ticket)
+            pipeline.zrem(self._keys[2], ticket)
+            pipeline.execute()
+        except Exception as e:
+            logger.warning(f"Failed to drop rate limiter ticket: {e}")
+
+    def _record(self, waited: float, granted: bool):
+        with self._lock:
+            if granted:
+                self.granted += 1
+            else:
+                self.timeouts += 1
+            if waited > _MIN_POLL:
+                self.waited += 1
+                self.total_wait += waited
+                self.max_observed_wait = max(self.max_observed_wait, waited)
+
+    def acquire(self, flow: str = INTERACTIVE_FLOW, weight: float = None) -> bool:
+        """
+        Block until a token is granted (or max_wait passes).
+
+        Returns:
+            True if a token was granted, False on timeout or Redis failure (call proceeds anyway)
+        """
+        weight = weight or PRIORITY_WEIGHTS['interactive']
+        ticket = self._new_ticket(flow)
+        started = time.monotonic()
+
+        try:
+            while True:
+                granted, wait = self._poll(ticket, flow, weight)
+                waited = time.monotonic() - started
+                if granted:
+                    self._record(waited, True)
+                    return True
+                if waited >= self.max_wait:
+                    logger.warning(f"Rate limiter wait for flow {flow} exceeded {self.max_wait}s, proceeding")
+                    self._forget(ticket)
+                    self._record(waited, False)
+                    return False
+                time.sleep(min(_MAX_POLL, max(_MIN_POLL, wait)))
+        except Exception as e:
+            logger.warning(f"Rate limiter unavailable ({e}), proceeding without it")
+            with self._lock:
+                self.errors += 1
+            return False
+
+    async def acquire_async(self, flow: str = INTERACTIVE_FLOW, weight: float = None) -> bool:
+        """Async version of acquire; Redis round trips run in a worker thread"""
+        weight = weight or PRIORITY_WEIGHTS['interactive']
+        ticket = self._new_ticket(flow)
+        started = time.monotonic()
+        granted = False
+
+        try:
+            while True:
+                granted, wait = await asyncio.to_thread(self._poll, ticket, flow, weight)
+                waited = time.monotonic() - started
+                if granted:
+                    self._record(waited, True)
+                    return True
+                if waited >= self.max_wait:
+                    logger.warning(f"Rate limiter wait for flow {flow} exceeded {self.max_wait}s, proceeding")
+                    self._record(waited, False)
+                    return False
+                await asyncio.sleep(min(_MAX_POLL, max(_MIN_POLL, wait)))
+        except Exception as e:
+            logger.warning(f"Rate limiter unavailable ({e}), proceeding without it")
+            with self._lock:
+                self.errors += 1
+            return False
+        finally:
+            # Cancelled or timed out - don't leave the ticket blocking the queue
+            if not granted:
+                await asyncio.to_thread(self._forget, ticket)
+
+    def get_stats(self) -> Dict:
+        """Queue depth (cluster-wide, per flow) plus local wait metrics"""
+        with self._lock:
+            stats = {
+                'rate': self.rate,
+                'burst': self.burst,
+                'granted': self.granted,
+                'waited': self.waited,
+                'timeouts': self.timeouts,
+                'errors': self.errors,
+                'avg_wait_ms': round(1000 * self.total_wait / self.waited) if self.waited else 0,
+                'max_wait_ms': round(1000 * self.max_observed_wait),
+            }
+
+        try:
+            pipeline = self.redis.pipeline()
+            pipeline.zrange(self._keys[1], 0, -1)
+            pipeline.hget(self._keys[0], 'tokens')
+            tickets, tokens = pipeline.execute()
+
+            depth_by_flow = {}
+            for ticket in tickets:
+                flow = ticket.split('|', 1)[0]
+                depth_by_flow[flow] = depth_by_flow.get(flow, 0) + 1
+
+            stats['queue_depth'] = len(tickets)
+            stats['queue_depth_by_flow'] = depth_by_flow
+            stats['tokens'] = round(float(tokens), 2) if tokens is not None else self.burst
+        except Exception as e:
+            logger.warning(f"Failed to read rate limiter queue: {e}")
+
+        return stats
+
+
+def priority_weight(priority: Optional[str]) -> float:
+    """WFQ weight for a priority tier (see PackageManager.get_priority_tier)"""
+    return PRIORITY_WEIGHTS.get(priority or 'free', PRIORITY_WEIGHTS['free'])
+
+
+_rate_limiter = None
+_rate_limiter_checked = False
+_rate_limiter_lock = Lock()
+
+
+def get_rate_limiter() -> Optional[FairRateLimiter]:
+    """Get the shared rate limiter, or None when disabled or Redis isn't configured"""
+    global _rate_limiter, _rate_limiter_checked
+    if not _rate_limiter_checked:
+        with _rate_limiter_lock:
+            if not _rate_limiter_checked:
+                redis_url = os.getenv('REDIS_URL')
+                if LLM_RATE_LIMIT_ENABLED and redis_url and LLM_RATE_LIMIT_RPS > 0:
+                    try:
+                        import redis
+                        _rate_limiter = FairRateLimiter(redis.from_url(redis_url, decode_responses=True))
+                        logger.info(f"OpenRouter rate limiter: {LLM_RATE_LIMIT_RPS} req/s, "
+                                    f"burst {LLM_RATE_LIMIT_BURST}")
+                    except Exception as e:
+                        logger.warning(f"Rate limiter disabled: {e}")
+                _rate_limiter_checked = True
+    return _rate_limiter
+
+
+def get_rate_limiter_stats() -> Dict:
+    """Get rate limiter and queue-depth statistics"""
+    limiter = get_rate_limiter()
+    if limiter is None:
+        return {'enabled': False}
+    return {'enabled': True, **limiter.get_stats()}
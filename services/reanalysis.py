@@ -0,0 +1,190 @@
+"""
+Incremental re-analysis after product description edits
+Diffs the old and new product (numeric quantities, structured attributes and
+retrieval scores) and re-checks only the norms whose verdict could plausibly change;
+every other stored verdict is reused
+"""
+import os
+import logging
+from collections import Counter
+from typing import Dict, List, Optional
+
+from .norm_index import get_norm_index
+from .norm_matcher import load_norms, match_norms_streaming, shortlist_norms, _is_error_result
+from .norm_thresholds import parse_norm_thresholds
+from .product_attributes import (
+    product_quantities, retrieval_query, relevant_attributes, CORE_ATTRIBUTES, QUANTITY_ATTRIBUTES
+)
+from .verdict_cache import normalize_description
+from .verdict_model import norm_key
+
+logger = logging.getLogger(__name__)
+
+# Re-check a norm when its BM25 score relative to the best-ranked norm moves by this much
+REANALYSIS_SCORE_SHIFT = float(os.getenv('REANALYSIS_SCORE_SHIFT', '0.15'))
+# Above this fraction of re-checked norms, just run a full analysis
+REANALYSIS_MAX_FRACTION = float(os.getenv('REANALYSIS_MAX_FRACTION', '0.6'))
+
+
+def _verdict_key(result: dict) -> tuple:
+    # Norm ids repeat across databases - the name tells them apart
+    return result['norm_id'], result.get('norm_name')
+
+
+def changed_dimensions(old_quantities: Dict[str, List[tuple]], new_quantities: Dict[str, List[tuple]]) -> set:
+    """Dimensions (voltage, power, ...) whose product quantities differ between two descriptions"""
+    dimensions = set(old_quantities) | set(new_quantities)
+    return {
+        dimension for dimension in dimensions
+        if sorted(old_quantities.get(dimension, [])) != sorted(new_quantities.get(dimension, []))
+    }
+
+
+def changed_attributes(old_attributes: Optional[Dict], new_attributes: Optional[Dict]) -> set:
+    """Non-numeric attribute fields that differ between two attribute records"""
+    if not old_attributes or not new_attributes:
+        return set()
+    fields = (set(old_attributes) | set(new_attributes)) - set(QUANTITY_ATTRIBUTES)
+    return {field for field in fields if old_attributes.get(field) != new_attributes.get(field)}
+
+
+def _relative_scores(index, product_description: str) -> Dict[int, float]:
+    """BM25 score of every norm divided by the best score (comparable across descriptions)"""
+    ranked = index.rank(product_description)
+    best = ranked[0][1] if ranked and ranked[0][1] > 0 else 1.0
+    return {id(norm): score / best for norm, score in ranked}
+
+
+def plan_reanalysis(old_description: str, new_description: str, previous_results: list,
+                    allowed_databases=None, old_attributes: Optional[Dict] = None,
+                    new_attributes: Optional[Dict] = None) -> tuple:
+    """
+    Decide which norms need a fresh verdict after a description edit.
+
+    A norm is re-checked when it has no usable previous verdict but the new
+    description shortlists it, when one of its numeric thresholds constrains a
+    dimension whose product quantities changed, when an attribute relevant to
+    it changed, or when its retrieval score shifted by REANALYSIS_SCORE_SHIFT or more.
+
+    Args:
+        old_description: Description the previous verdicts were computed for
+        new_description: Edited description
+        previous_results: Previous verdicts (all_norm_results)
+        allowed_databases: Database filenames to check
+        old_attributes: Attribute record of the old description (optional)
+        new_attributes: Attribute record of the new description (optional)
+
+    Returns:
+        Tuple of (norm keys to re-check ('database:id', see norm_key), reasons Counter, changed dimensions)
+    """
+    reasons = Counter()
+    if (normalize_description(old_description) == normalize_description(new_description)
+            and (old_attributes or {}) == (new_attributes or {})):
+        return [], reasons, set()
+
+    database_names = allowed_databases or ['norms.json']
+    index = get_norm_index(database_names, load_norms)
+    previous = {_verdict_key(result): result for result in previous_results or []}
+
+    dimensions = changed_dimensions(product_quantities(old_description, old_attributes),
+                                    product_quantities(new_description, new_attributes))
+    attributes = changed_attributes(old_attributes, new_attributes)
+    old_query = retrieval_query(old_description, old_attributes)
+    new_query = retrieval_query(new_description, new_attributes)
+    old_scores = _relative_scores(index, old_query)
+    new_scores = _relative_scores(index, new_query)
+    candidates, _, _ = shortlist_norms(new_query, allowed_databases=database_names, recall_sample=0)
+    shortlisted = {id(norm) for norm in candidates}
+
+    recheck = []
+    for norm in index.norms:
+        prior = previous.get((norm['id'], norm['name']))
+
+        if prior is None or _is_error_result(prior):
+            # Never checked before - only interesting if the new description shortlists it
+            if id(norm) not in shortlisted:
+                continue
+            reason = 'unchecked' if prior is None else 'error'
+        elif dimensions & {interval[0] for interval in parse_norm_thresholds(norm.get('applies_to', ''))[0]}:
+            reason = 'quantity'
+        elif attributes & (relevant_attributes(norm) | set(CORE_ATTRIBUTES)):
+            reason = 'attribute'
+        elif abs(new_scores.get(id(norm), 0) - old_scores.get(id(norm), 0)) >= REANALYSIS_SCORE_SHIFT:
+            reason = 'retrieval'
+        else:
+            continue
+
+        reasons[reason] += 1
+        recheck.append(norm_key(norm))
+
+    # Ids can repeat within a database too; such norms are re-checked together
+    return list(dict.fromkeys(recheck)), reasons, dimensions
+
+
+def _run(product_description: str, allowed_databases, **options) -> tuple:
+    matched, all_results = [], []
+    for event_type, *event_data in match_norms_streaming(product_description, allowed_databases=allowed_databases,
+                                                         **options):
+        if event_type == 'complete':
+            matched, all_results = event_data
+    return matched, all_results
+
+
+def reanalyze(old_description: Optional[str], new_description: str, previous_results: list,
+              allowed_databases=None, old_attributes: Optional[Dict] = None,
+              new_attributes: Optional[Dict] = None, **options) -> tuple:
+    """
+    Re-analyze an edited product, reusing previous verdicts where possible.
+
+    Args:
+        old_description: Description the previous verdicts belong to (None = unknown, full analysis)
+        new_description: Edited description
+        previous_results: Previous verdicts (all_norm_results)
+        allowed_databases: Database filenames to check
+        old_attributes: Attribute record the previous verdicts were computed with (optional)
+        new_attributes: Attribute record of the edited description (optional)
+        **options: Pipeline options passed through to match_norms_streaming
+
+    Returns:
+        Tuple of (matched_norms, all_norm_results, stats)
+    """
+    database_names = allowed_databases or ['norms.json']
+
+    if old_description is None or not previous_results:
+        reason = "analyzed description unknown" if old_description is None else "no previous verdicts"
+        logger.info(f"Re-analysis: {reason}, running a full analysis")
+        matched, all_results = _run(new_description, database_names, product_attributes=new_attributes, **options)
+        return matched, all_results, {'mode': 'full', 'rechecked': len(all_results), 'reused': 0}
+
+    recheck, reasons, dimensions = plan_reanalysis(old_description, new_description, previous_results,
+                                                   database_names, old_attributes, new_attributes)
+    catalog_size = len(get_norm_index(database_names, load_norms).norms)
+
+    if len(recheck) > REANALYSIS_MAX_FRACTION * max(len(previous_results), 1) or len(recheck) >= catalog_size:
+        logger.info(f"Re-analysis would re-check {len(recheck)} norms, running a full analysis instead")
+        matched, all_results = _run(new_description, database_names, product_attributes=new_attributes, **options)
+        return matched, all_results, {'mode': 'full', 'rechecked': len(all_results), 'reused': 0}
+
+    fresh = []
+    if recheck:
+        _, fresh = _run(new_description, database_names, norm_keys=recheck, product_attributes=new_attributes,
+                        **options)
+
+    # Fresh verdicts replace the old ones in place; verdicts for newly shortlisted norms go last
+    replacements = {_verdict_key(result): result for result in fresh}
+    all_results = [replacements.pop(_verdict_key(result), result) for result in previous_results]
+    all_results.extend(replacements.values())
+
+    matched = [result for result in all_results if result['applies']]
+    matched.sort(key=lambda x: x["confidence"], reverse=True)
+
+    stats = {
+        'mode': 'incremental',
+        'rechecked': len(fresh),
+        'reused': len(all_results) - len(fresh),
+        'reasons': dict(reasons),
+        'changed_dimensions': sorted(dimensions),
+    }
+    logger.info(f"Incremental re-analysis: re-checked {len(fresh)} norms, reused {stats['reused']} verdicts "
+                f"({dict(reasons)})")
+    return matched, all_results, stats
@@ -0,0 +1,270 @@
+"""
+Session store for /develope conversations
+Keeps conversation and analysis state in Redis so every gunicorn worker and
+Fly machine sees the same sessions, with TTL expiry and a compact encoding
+
+Data Structure (Redis):
+- develope_session:{session_id} - Hash of session fields, each value compact JSON (TTL refreshed on access)
+
+Verdicts are stored as [catalog position, norm id, applies, confidence, reasoning],
+where the position indexes the norm catalog of the session's databases
+(the loaded norm list, see get_norm_index), so norm names and URLs aren't
+copied into every session. Matched norms are stored as positions in the
+verdict list.
+"""
+import os
+import json
+import time
+import logging
+from collections import OrderedDict
+from threading import Lock
+from typing import Dict, List, Optional
+
+from .norm_index import get_norm_index
+from .norm_matcher import load_norms
+
+logger = logging.getLogger(__name__)
+
+DEVELOPE_SESSION_TTL = int(os.getenv('DEVELOPE_SESSION_TTL', str(24 * 60 * 60)))  # 24 hours
+# Bound for the in-process fallback store (used when Redis isn't configured)
+DEVELOPE_SESSION_LOCAL_MAX = int(os.getenv('DEVELOPE_SESSION_LOCAL_MAX', '1000'))
+
+# Session fields as seen by callers -> hash field they are stored in
+SESSION_FIELDS = {
+    'history': 'history',
+    'started': 'started',
+    'complete': 'complete',
+    'product_description': 'product',
+    'product_attributes': 'attrs',
+    'analyzed': 'analyzed',
+    'analysis_job_id': 'job',
+    'qa_history': 'qa',
+    'databases': 'dbs',
+    'all_norm_results': 'results',
+    'matched_norms': 'matched',
+    'analysis_stats': 'stats',
+}
+
+# Fields whose encoding refers to the norm catalog of the session's databases
+VERDICT_FIELDS = ('all_norm_results', 'matched_norms')
+
+
+def _dumps(value) -> str:
+    return json.dumps(value, separators=(',', ':'), ensure_ascii=False)
+
+
+class NormCatalog:
+    """Position <-> norm lookups over the norms of a set of databases"""
+
+    def __init__(self, database_names: List[str]):
+        self.norms = get_norm_index(database_names or ['norms.json'], load_norms).norms
+        self._positions = {}
+        for position, norm in enumerate(self.norms):
+            # Ids repeat across databases - (id, name) is unique, id alone is the fallback
+            self._positions.setdefault((norm['id'], norm['name']), position)
+            self._positions.setdefault(norm['id'], position)
+
+    def encode_verdict(self, result: dict) -> list:
+        position = self._positions.get((result['norm_id'], result.get('norm_name')),
+                                       self._positions.get(result['norm_id'], -1))
+        return [position, result['norm_id'], int(bool(result['applies'])),
+                result.get('confidence', 0), result.get('reasoning', '')]
+
+    def decode_verdict(self, encoded: list) -> dict:
+        position, norm_id, applies, confidence, reasoning = encoded
+
+        norm = self.norms[position] if 0 <= position < len(self.norms) else None
+        if norm is None or norm['id'] != norm_id:
+            # Catalog changed since the session was stored - look the norm up by id
+            fallback = self._positions.get(norm_id)
+            norm = self.norms[fallback] if fallback is not None else {'id': norm_id, 'name': norm_id}
+
+        return {
+            "norm_id": norm_id,
+            "norm_name": norm['name'],
+            "applies": bool(applies),
+            "confidence": confidence,
+            "reasoning": reasoning,
+            "url": norm.get("url", "")
+        }
+
+
+class SessionStore:
+    """
+    TTL-bound session store with per-field reads and writes.
+
+    Uses a Redis hash per session when a client is available, otherwise a
+    size-bounded in-process LRU holding the same encoded fields.
+    """
+
+    def __init__(self, redis_client=None, ttl: int = DEVELOPE_SESSION_TTL,
+                 max_local: int = DEVELOPE_SESSION_LOCAL_MAX, key_prefix: str = "develope_session"):
+        self.redis = redis_client
+        self.ttl = ttl
+        self.max_local = max_local
+        self.prefix = key_prefix
+
+        # In-process fallback store: session_id -> (expires_at, {hash field: encoded value})
+        self._local: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = Lock()
+
+    def _key(self, session_id: str) -> str:
+        return f"{self.prefix}:{session_id}"
+
+    # ------------------------------------------------------------------------
+    # RAW HASH ACCESS
+    # ------------------------------------------------------------------------
+
+    def _read(self, session_id: str, hash_fields: List[str]) -> Optional[Dict[str, str]]:
+        """Read encoded fields (all when hash_fields is empty); None if the session doesn't exist"""
+        if self.redis:
+            key = self._key(session_id)
+            pipeline = self.redis.pipeline()
+            if hash_fields:
+                pipeline.hmget(key, hash_fields)
+            else:
+                pipeline.hgetall(key)
+            pipeline.expire(key, self.ttl)
+            values, exists = pipeline.execute()
+            if not exists:
+                return None
+            if hash_fields:
+                return {field: value for field, value in zip(hash_fields, values) if value is not None}
+            return values
+
+        with self._lock:
+            entry = self._local.get(session_id)
+            if entry is None or entry[0] < time.time():
+                self._local.pop(session_id, None)
+                return None
+            self._local[session_id] = (time.time() + self.ttl, entry[1])
+            self._local.move_to_end(session_id)
+            stored = entry[1]
+            if hash_fields:
+                return {field: stored[field] for field in hash_fields if field in stored}
+            return dict(stored)
+
+    def _write(self, session_id: str, encoded: Dict[str, str]):
+        if self.redis:
+            key = self._key(session_id)
+            pipeline = self.redis.pipeline()
+            pipeline.hset(key, mapping=encoded)
+            pipeline.expire(key, self.ttl)
+            pipeline.execute()
+            return
+
+        with self._lock:
+            entry = self._local.get(session_id)
+            stored = dict(entry[1]) if entry and entry[0] >= time.time() else {}
+            stored.update(encoded)
+            self._local[session_id] = (time.time() + self.ttl, stored)
+            self._local.move_to_end(session_id)
+            while len(self._local) > self.max_local:
+                self._local.popitem(last=False)
+
+    # ------------------------------------------------------------------------
+    # PUBLIC API
+    # ------------------------------------------------------------------------
+
+    def create(self, session_id: str, values: Dict):
+        """Store a new session"""
+        self.update(session_id, values)
+
+    def exists(self, session_id: str) -> bool:
+        return bool(session_id) and self._read(session_id, ['started']) is not None
+
+    def get(self, session_id: str, *fields: str) -> Optional[Dict]:
+        """
+        Read session fields.
+
+        Args:
+            session_id: Session id
+            *fields: Names from SESSION_FIELDS to load (all fields if omitted)
+
+        Returns:
+            Dict of the requested fields that are set, or None if the session doesn't exist
+        """
+        hash_fields = [SESSION_FIELDS[field] for field in fields]
+        if hash_fields and any(field in VERDICT_FIELDS for field in fields):
+            # Verdicts can only be decoded against the session's catalog (and
+            # matched norms point into the verdict list)
+            hash_fields += [SESSION_FIELDS['databases'], SESSION_FIELDS['all_norm_results']]
+
+        raw = self._read(session_id, list(dict.fromkeys(hash_fields)))
+        if raw is None:
+            return None
+
+        wanted = fields or tuple(SESSION_FIELDS)
+        reverse = {stored: name for name, stored in SESSION_FIELDS.items()}
+        decoded = {reverse[field]: json.loads(value) for field, value in raw.items() if field in reverse}
+
+        if any(field in decoded for field in VERDICT_FIELDS):
+            catalog = NormCatalog(decoded.get('databases'))
+            results = [catalog.decode_verdict(v) for v in decoded.get('all_norm_results', [])]
+            if 'all_norm_results' in decoded:
+                decoded['all_norm_results'] = results
+            if 'matched_norms' in decoded:
+                decoded['matched_norms'] = [
+                    results[entry] if isinstance(entry, int) else catalog.decode_verdict(entry)
+                    for entry in decoded['matched_norms']
+                ]
+
+        return {field: value for field, value in decoded.items() if field in wanted}
+
+    def update(self, session_id: str, values: Dict):
+        """
+        Write session fields (others are left untouched) and refresh the TTL.
+
+        Verdict fields are encoded against values['databases'] (or the
+        databases already stored with the session).
+        """
+        values = dict(values)
+        if any(field in values for field in VERDICT_FIELDS):
+            databases = values.get('databases')
+            if databases is None:
+                databases = (self.get(session_id, 'databases') or {}).get('databases')
+                values['databases'] = databases
+            catalog = NormCatalog(databases)
+
+            positions = {}
+            if 'all_norm_results' in values:
+                results = values['all_norm_results'] or []
+                positions = {(r['norm_id'], r.get('norm_name')): i for i, r in enumerate(results)}
+                values['all_norm_results'] = [catalog.encode_verdict(r) for r in results]
+            if 'matched_norms' in values:
+                values['matched_norms'] = [
+                    positions.get((r['norm_id'], r.get('norm_name')), catalog.encode_verdict(r))
+                    for r in values['matched_norms'] or []
+                ]
+
+        encoded = {SESSION_FIELDS[field]: _dumps(value) for field, value in values.items()}
+        self._write(session_id, encoded)
+
+    def get_stats(self) -> Dict:
+        return {
+            'backend': 'redis' if self.redis else 'local',
+            'ttl': self.ttl,
+            'local_sessions': len(self._local),
+        }
+
+
+_session_store = None
+_session_store_lock = Lock()
+
+
+def get_session_store() -> SessionStore:
+    """Get the shared session store (Redis-backed when REDIS_URL is set)"""
+    global _session_store
+    if _session_store is None:
+        with _session_store_lock:
+            if _session_store is None:
+                redis_client = None
+                redis_url = os.getenv('REDIS_URL')
+                if redis_url:
+                    try:
+                        import redis
+                        redis_client = redis.from_url(redis_url, decode_responses=True)
+                    except Exception as e:
+                        logger.warning(f"Session store falling back to process memory: {e}")
+                _session_store = SessionStore(redis_client)
+    return _session_store
@@ -0,0 +1,370 @@
+"""
+Singleflight coalescing for norm analyses
+Identical analyses that run at the same time (same normalized product summary,
+same databases, same options) share one computation. Later callers attach to
+the running computation's event stream instead of starting their own sweep
+
+Data Structure (Redis):
+- singleflight:{key} - Flight id of the process currently computing key (lock with TTL)
+- singleflight:{key}:{flight_id} - Stream of encoded events of that flight
+- singleflight:{key}:{flight_id}:followers - Number of followers in other processes
+"""
+import os
+import copy
+import json
+import uuid
+import asyncio
+import hashlib
+import logging
+from threading import Lock
+from typing import Dict, Optional
+
+from .verdict_cache import normalize_description
+
+logger = logging.getLogger(__name__)
+
+SINGLEFLIGHT_ENABLED = os.getenv('SINGLEFLIGHT_ENABLED', 'true').lower() == 'true'
+# Leader lock TTL - refreshed on every event, so it only expires if the leader dies
+SINGLEFLIGHT_LOCK_TTL = int(os.getenv('SINGLEFLIGHT_LOCK_TTL', '60'))
+# How long a finished flight's events stay readable for followers still catching up
+SINGLEFLIGHT_STREAM_TTL = int(os.getenv('SINGLEFLIGHT_STREAM_TTL', '120'))
+# Blocking read timeout for remote followers (ms)
+SINGLEFLIGHT_FOLLOW_BLOCK_MS = 1000
+
+
+def analysis_key(product_description: str, allowed_databases=None, options: Optional[dict] = None) -> str:
+    """
+    Key identifying an analysis: normalized summary + sorted databases + result-affecting options.
+
+    Args:
+        product_description: Product summary
+        allowed_databases: Database filenames (order doesn't matter)
+        options: Matcher options that change the result
+    """
+    databases = ",".join(sorted(allowed_databases or ['norms.json']))
+    options_json = json.dumps(options or {}, sort_keys=True, default=str)
+    raw = f"{normalize_description(product_description)}|{databases}|{options_json}"
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()[:32]
+
+
+def _encode_event(event: tuple) -> str:
+    return json.dumps(list(event))
+
+
+def _decode_event(data: str) -> tuple:
+    return tuple(json.loads(data))
+
+
+class _LeaderLost(Exception):
+    """The remote computation stopped without finishing"""
+
+
+class _Relayed:
+    """
+    What one subscriber has passed on. When a remote leader dies and the analysis
+    restarts locally, events the consumer already saw are not relayed again
+    (verdicts by norm, progress/triage counts until the rerun catches up).
+    """
+
+    def __init__(self):
+        self.verdicts = set()
+        self.counts = {}
+
+    def is_new(self, event: tuple) -> bool:
+        kind = event[0]
+        if kind == 'verdict':
+            key = (event[1].get('norm_id'), event[1].get('norm_name'))
+            if key in self.verdicts:
+                return False
+            self.verdicts.add(key)
+        elif kind in ('progress', 'triage'):
+            if event[1] <= self.counts.get(kind, 0):
+                return False
+            self.counts[kind] = event[1]
+        return True
+
+
+class _Flight:
+    """One running computation and the events it has produced so far (local)"""
+
+    def __init__(self, key: str, flight_id: str):
+        self.key = key
+        self.flight_id = flight_id
+        self.events = []
+        self.done = False
+        self.error = None
+        self.subscribers = 0
+        self.task = None
+        self._signal = asyncio.Event()
+
+    def publish(self, event=None):
+        """Record an event (or just a state change) and wake every subscriber"""
+        if event is not None:
+            self.events.append(event)
+        self._signal.set()
+        self._signal = asyncio.Event()
+
+    async def wait(self):
+        await self._signal.wait()
+
+
+class SingleFlight:
+    """
+    In-flight registry for async event streams.
+
+    Within a process, subscribers to the same key share one pump task running on
+    the engine event loop. With Redis, the process that takes the key's lock
+    mirrors events into a Redis stream that other workers/machines follow.
+    A computation is cancelled once nobody (local or remote) is listening.
+    """
+
+    def __init__(self, redis_client=None, key_prefix: str = "singleflight"):
+        self.redis = redis_client
+        self.prefix = key_prefix
+        self._flights: Dict[str, _Flight] = {}
+        self.started = 0
+        self.coalesced = 0
+        self.remote_coalesced = 0
+
+    def _lock_key(self, key: str) -> str:
+        return f"{self.prefix}:{key}"
+
+    def _stream_key(self, key: str, flight_id: str) -> str:
+        return f"{self.prefix}:{key}:{flight_id}"
+
+    async def subscribe(self, key: str, factory):
+        """
+        Iterate the events of the computation for key, starting it if needed.
+
+        Args:
+            key: Coalescing key (see analysis_key)
+            factory: Callable returning a new async iterator of events
+
+        Yields:
+            Every event of the computation, from the first one (each at most once,
+            even if the computation has to be restarted)
+        """
+        relayed = _Relayed()
+        while True:
+            flight = self._flights.get(key)
+            if flight is not None:
+                self.coalesced += 1
+                logger.info(f"Attaching to running analysis {key[:12]} ({len(flight.events)} events so far)")
+                async for event in self._follow_local(flight):
+                    if relayed.is_new(event):
+                        yield event
+                return
+
+            is_leader, flight_id = await self._claim(key)
+            if is_leader:
+                flight = self._start(key, flight_id, factory)
+                async for event in self._follow_local(flight):
+                    if relayed.is_new(event):
+                        yield event
+                return
+
+            flight = self._flights.get(key)
+            if flight is not None and flight.flight_id == flight_id:
+                # Claimed by another subscriber in this process while we were asking Redis
+                continue
+
+            self.remote_coalesced += 1
+            logger.info(f"Attaching to analysis {key[:12]} running in another process")
+            try:
+                async for event in self._follow_remote(key, flight_id):
+                    if relayed.is_new(event):
+                        yield event
+                return
+            except _LeaderLost:
+                # The other process died or gave up - run it ourselves. The rerun starts
+                # from the first event; what was already relayed is skipped
+                logger.warning(f"Analysis {key[:12]} in another process stopped, running it locally")
+
+    async def _claim(self, key: str) -> tuple:
+        """
+        Try to become the leader for key.
+
+        Returns:
+            Tuple of (is_leader, flight_id). The leader's flight id is None when
+            Redis isn't available; a follower gets the flight id of the process
+            already computing key.
+        """
+        if not self.redis:
+            return True, None
+
+        flight_id = uuid.uuid4().hex
+        try:
+            while True:
+                claimed = await asyncio.to_thread(
+                    self.redis.set, self._lock_key(key), flight_id, nx=True, ex=SINGLEFLIGHT_LOCK_TTL
+                )
+                if claimed:
+                    return True, flight_id
+                owner = await asyncio.to_thread(self.redis.get, self._lock_key(key))
+                if owner is not None:
+                    return False, owner
+        except Exception as e:
+            logger.warning(f"Singleflight lock unavailable ({e}), coalescing locally only")
+            return True, None
+
+    def _start(self, key: str, flight_id: Optional[str], factory) -> _Flight:
+        flight = _Flight(key, flight_id)
+        self._flights[key] = flight
+        flight.task = asyncio.ensure_future(self._pump(flight, factory))
+        self.started += 1
+        return flight
+
+    async def _pump(self, flight: _Flight, factory):
+        """Run the computation, fanning its events out locally and into Redis"""
+        stream = factory()
+        status = "ok"
+        try:
+            async for event in stream:
+                flight.publish(event)
+                if flight.flight_id:
+                    await asyncio.to_thread(self._mirror, flight, _encode_event(event))
+                if flight.subscribers == 0 and not await self._has_remote_followers(flight):
+                    status = "abandoned"
+                    break
+        except asyncio.CancelledError:
+            status = "cancelled"
+            raise
+        except Exception as e:
+            status = "error"
+            flight.error = e
+        finally:
+            await stream.aclose()
+            flight.done = True
+            flight.publish()
+            if self._flights.get(flight.key) is flight:
+                del self._flights[flight.key]
+            if flight.flight_id:
+                await asyncio.to_thread(self._finish, flight, status)
+
+    def _mirror(self, flight: _Flight, data: str):
+        try:
+            stream_key = self._stream_key(flight.key, flight.flight_id)
+            pipeline = self.redis.pipeline()
+            pipeline.xadd(stream_key, {'t': 'event', 'e': data})
+            pipeline.expire(stream_key, SINGLEFLIGHT_STREAM_TTL)
+            pipeline.expire(self._lock_key(flight.key), SINGLEFLIGHT_LOCK_TTL)
+            pipeline.execute()
+        except Exception as e:
+            logger.warning(f"Failed to mirror analysis event: {e}")
+
+    def _finish(self, flight: _Flight, status: str):
+        try:
+            stream_key = self._stream_key(flight.key, flight.flight_id)
+            pipeline = self.redis.pipeline()
+            pipeline.xadd(stream_key, {'t': 'end', 'status': status})
+            pipeline.expire(stream_key, SINGLEFLIGHT_STREAM_TTL)
+            pipeline.execute()
+            # Release the lock only if it is still ours
+            if self.redis.get(self._lock_key(flight.key)) == flight.flight_id:
+                self.redis.delete(self._lock_key(flight.key))
+        except Exception as e:
+            logger.warning(f"Failed to finish singleflight {flight.key[:12]}: {e}")
+
+    async def _has_remote_followers(self, flight: _Flight) -> bool:
+        if not flight.flight_id:
+            return False
+        try:
+            followers = await asyncio.to_thread(
+                self.redis.get, f"{self._stream_key(flight.key, flight.flight_id)}:followers"
+            )
+            return int(followers or 0) > 0
+        except Exception:
+            return False
+
+    async def _follow_local(self, flight: _Flight):
+        flight.subscribers += 1
+        try:
+            position = 0
+            while True:
+                while position < len(flight.events):
+                    # Each subscriber gets its own copy - results end up in separate sessions
+                    yield copy.deepcopy(flight.events[position])
+                    position += 1
+                if flight.done:
+                    if flight.error is not None:
+                        raise flight.error
+                    return
+                await flight.wait()
+        finally:
+            flight.subscribers -= 1
+            if flight.subscribers == 0 and not flight.done and not await self._has_remote_followers(flight):
+                logger.info(f"Last listener of analysis {flight.key[:12]} left, cancelling it")
+                flight.task.cancel()
+
+    async def _follow_remote(self, key: str, flight_id: str):
+        stream_key = self._stream_key(key, flight_id)
+        followers_key = f"{stream_key}:followers"
+        last_id = '0'
+
+        await asyncio.to_thread(self._change_followers, followers_key, 1)
+        try:
+            while True:
+                entries = await asyncio.to_thread(
+                    self.redis.xread, {stream_key: last_id}, count=100, block=SINGLEFLIGHT_FOLLOW_BLOCK_MS
+                )
+                if not entries:
+                    owner = await asyncio.to_thread(self.redis.get, self._lock_key(key))
+                    if owner != flight_id:
+                        raise _LeaderLost()
+                    continue
+
+                for _, messages in entries:
+                    for message_id, fields in messages:
+                        last_id = message_id
+                        if fields.get('t') == 'end':
+                            if fields.get('status') != 'ok':
+                                raise _LeaderLost()
+                            return
+                        yield _decode_event(fields['e'])
+        finally:
+            await asyncio.to_thread(self._change_followers, followers_key, -1)
+
+    def _change_followers(self, followers_key: str, delta: int):
+        try:
+            pipeline = self.redis.pipeline()
+            pipeline.incrby(followers_key, delta)
+            pipeline.expire(followers_key, SINGLEFLIGHT_STREAM_TTL)
+            pipeline.execute()
+        except Exception as e:
+            logger.warning(f"Failed to update singleflight followers: {e}")
+
+    def get_stats(self) -> Dict:
+        return {
+            'backend': 'redis' if self.redis else 'local',
+            'in_flight': len(self._flights),
+            'started': self.started,
+            'coalesced': self.coalesced,
+            'remote_coalesced': self.remote_coalesced,
+        }
+
+
+_singleflight = None
+_singleflight_lock = Lock()
+
+
+def get_singleflight() -> SingleFlight:
+    """Get the shared singleflight registry (Redis-backed when REDIS_URL is set)"""
+    global _singleflight
+    if _singleflight is None:
+        with _singleflight_lock:
+            if _singleflight is None:
+                redis_client = None
+                redis_url = os.getenv('REDIS_URL')
+                if redis_url:
+                    try:
+                        import redis
+                        redis_client = redis.from_url(redis_url, decode_responses=True)
+                    except Exception as e:
+                        logger.warning(f"Singleflight falling back to in-process registry: {e}")
+                _singleflight = SingleFlight(redis_client)
+    return _singleflight
+
+
+def get_singleflight_stats() -> Dict:
+    """Get statistics about coalesced analyses"""
+    return get_singleflight().get_stats()
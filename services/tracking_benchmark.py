@@ -0,0 +1,136 @@
+"""
+Tracking ingestion benchmark
+Replays synthetic /api/tracking/event beacons against a Redis server, once through
+the pipelined path (store_events pipeline + session update + counter increment,
+three round trips) and once through the server-side ingest script (one round trip),
+and reports client latency, commands processed and Redis CPU time for each.
+
+Usage:
+    python -m services.tracking_benchmark [--redis-url URL] [--beacons N] [--events N]
+
+Uses a throwaway key prefix and deletes its keys afterwards. Run it against a
+local or staging Redis - the CPU numbers include whatever else the server is doing.
+"""
+import os
+import sys
+import time
+import random
+import argparse
+from datetime import datetime
+
+from .tracking_storage import TrackingStorage
+
+EVENT_TYPES = ["page_view", "click", "scroll_depth", "time_on_page", "heartbeat"]
+PAGES = ["/", "/develope", "/packages", "/workspace", "/analytics", "/about", "/pricing"]
+
+
+def make_beacons(count: int, events_per_beacon: int, sessions: int = 500, seed: int = 7) -> list:
+    """Synthetic beacon batches shaped like static/tracking.js payloads"""
+    rng = random.Random(seed)
+    beacons = []
+    for _ in range(count):
+        session_id = f"bench-{rng.randrange(sessions)}"
+        beacons.append([
+            {
+                "session_id": session_id,
+                "timestamp": datetime.utcnow().isoformat(),
+                "event_type": rng.choice(EVENT_TYPES),
+                "page": rng.choice(PAGES),
+                "depth_percent": rng.choice([25, 50, 75, 90, 100]),
+                "time_on_page": rng.randrange(1, 120),
+                "user_agent": "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0",
+                "language": "de-DE",
+                "viewport_width": 1440,
+                "viewport_height": 900,
+                "referrer": "https://www.google.com/",
+            }
+            for _ in range(events_per_beacon)
+        ])
+    return beacons
+
+
+def _server_counters(redis_client) -> dict:
+    cpu = redis_client.info("cpu")
+    stats = redis_client.info("stats")
+    return {
+        "cpu": float(cpu.get("used_cpu_sys", 0)) + float(cpu.get("used_cpu_user", 0)),
+        "commands": int(stats.get("total_commands_processed", 0)),
+    }
+
+
+def _percentile(values: list, fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def run(redis_client, beacons: list, use_script: bool, prefix: str) -> dict:
+    """Ingest every beacon the way the tracking route does and measure it"""
+    storage = TrackingStorage(redis_client, key_prefix=prefix, use_script=use_script)
+    latencies = []
+
+    before = _server_counters(redis_client)
+    started = time.perf_counter()
+    for events in beacons:
+        first = events[0]
+        session_data = {
+            "user_agent": first["user_agent"],
+            "language": first["language"],
+            "viewport": f"{first['viewport_width']}x{first['viewport_height']}",
+            "event_count": len(events),
+        }
+        t0 = time.perf_counter()
+        storage.ingest_events([dict(event) for event in events], session_data)
+        latencies.append((time.perf_counter() - t0) * 1000)
+    elapsed = time.perf_counter() - started
+    after = _server_counters(redis_client)
+
+    return {
+        "mode": "script" if use_script else "pipeline",
+        "beacons_per_s": round(len(beacons) / elapsed, 1),
+        "p50_ms": round(_percentile(latencies, 0.5), 3),
+        "p95_ms": round(_percentile(latencies, 0.95), 3),
+        "p99_ms": round(_percentile(latencies, 0.99), 3),
+        "commands_per_beacon": round((after["commands"] - before["commands"]) / len(beacons), 1),
+        "redis_cpu_us_per_beacon": round((after["cpu"] - before["cpu"]) * 1e6 / len(beacons), 1),
+    }
+
+
+def cleanup(redis_client, prefix: str):
+    batch = []
+    for key in redis_client.scan_iter(match=f"{prefix}:*", count=1000):
+        batch.append(key)
+        if len(batch) >= 1000:
+            redis_client.delete(*batch)
+            batch = []
+    if batch:
+        redis_client.delete(*batch)
+
+
+def main(argv: list) -> int:
+    parser = argparse.ArgumentParser(prog="python -m services.tracking_benchmark")
+    parser.add_argument("--redis-url", default=os.getenv("REDIS_URL", "redis://localhost:6379/0"))
+    parser.add_argument("--beacons", type=int, default=5000)
+    parser.add_argument("--events", type=int, default=5, help="events per beacon")
+    args = parser.parse_args(argv)
+
+    import redis
+    redis_client = redis.from_url(args.redis_url, decode_responses=True)
+    beacons = make_beacons(args.beacons, args.events)
+
+    results = []
+    for use_script in (False, True):
+        prefix = f"bench_tracking_{int(time.time())}"
+        try:
+            results.append(run(redis_client, beacons, use_script, prefix))
+        finally:
+            cleanup(redis_client, prefix)
+
+    columns = list(results[0])
+    print(" | ".join(f"{column:>24}" for column in columns))
+    for result in results:
+        print(" | ".join(f"{result[column]!s:>24}" for column in columns))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
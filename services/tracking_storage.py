@@ -4,19 +4,413 @@ Tracking Storage Service
 Handles storage and retrieval of user tracking data in Redis.
 Designed to be portable and easy to use across multiple sites.
 
+Counters (page metrics, page registry, hourly events) can optionally be
+aggregated in a per-process write-behind buffer (see CounterBuffer).
+
 Data Structure:
 - session:{session_id} - Hash containing session metadata
-- events:{session_id} - List of event JSONs
-- daily_sessions:{date} - Set of unique session IDs
+- events:{session_id} - List of compactly encoded events (see encode_event)
+- daily_sessions:{date} - Set of unique session IDs (exact visitor counting only)
+- unique_visitors:{date} - HyperLogLog of session IDs (~12 KB per day, 0.81% standard error)
 - page_metrics:{page_path} - Hash containing aggregated metrics
+- page_registry - Sorted set of tracked page paths, scored by views
+- page_registry:backfilled - Marker set once older page_metrics hashes were registered
 - hourly_events:{date}:{hour} - Counter for events per hour
 """
 
 import json
 import time
+import atexit
+import logging
+from collections import Counter, defaultdict
 from datetime import datetime, timedelta
+from threading import Event, Lock, Thread
 from typing import List, Dict, Any, Optional
 
+logger = logging.getLogger(__name__)
+
+
+# Stores a whole beacon batch in one round trip: event lists, session hashes,
+# visitor/hourly counters, page metrics and the page registry.
+# Keys are built inside the script, so it needs a single Redis instance (not Redis Cluster).
+# ARGV[1] = key prefix, ARGV[2] = JSON batch prepared by TrackingStorage.ingest_events
+# (batch.buffered = counters are left to the CounterBuffer)
+INGEST_SCRIPT = """
+local prefix = ARGV[1]
+local batch = cjson.decode(ARGV[2])
+
+local function key(kind, name)
+    return prefix .. ':' .. kind .. ':' .. name
+end
+
+local registry = prefix .. ':page_registry'
+local visitors = key('unique_visitors', batch.today)
+local daily = key('daily_sessions', batch.today)
+local hourly = key('hourly_events', batch.hour)
+local pages = false
+
+for _, event in ipairs(batch.events) do
+    local session_id, encoded, page, increments = event[1], event[2], event[3], event[4]
+
+    local events_key = key('events', session_id)
+    redis.call('RPUSH', events_key, encoded)
+    redis.call('EXPIRE', events_key, batch.event_ttl)
+
+    local session_key = key('session', session_id)
+    redis.call('HSET', session_key, 'last_seen', batch.now)
+    redis.call('EXPIRE', session_key, batch.session_ttl)
+
+    redis.call('PFADD', visitors, session_id)
+    if batch.exact_visitors then
+        redis.call('SADD', daily, session_id)
+    end
+
+    if page ~= '' and not batch.buffered then
+        local metrics_key = key('page_metrics', page)
+        local viewed = false
+        for i = 1, #increments, 2 do
+            redis.call('HINCRBY', metrics_key, increments[i], increments[i + 1])
+            if increments[i] == 'views' then
+                redis.call('ZINCRBY', registry, increments[i + 1], page)
+                viewed = true
+            end
+        end
+        if not viewed then
+            redis.call('ZADD', registry, 'NX', 0, page)
+        end
+        redis.call('EXPIRE', metrics_key, batch.metrics_ttl)
+        pages = true
+    end
+end
+
+if not batch.buffered then
+    redis.call('INCRBY', hourly, #batch.events)
+    redis.call('EXPIRE', hourly, batch.metrics_ttl)
+end
+redis.call('EXPIRE', visitors, batch.metrics_ttl)
+if batch.exact_visitors then
+    redis.call('EXPIRE', daily, batch.metrics_ttl)
+end
+if pages then
+    redis.call('EXPIRE', registry, batch.metrics_ttl)
+end
+
+for session_id, profile in pairs(batch.profiles) do
+    local fields = {}
+    for field, value in pairs(profile) do
+        table.insert(fields, field)
+        table.insert(fields, value)
+    end
+    redis.call('HSET', key('session', session_id), unpack(fields))
+end
+
+local session = batch.session
+if session then
+    local session_key = key('session', session.session_id)
+    local fields = {'last_seen', batch.now}
+    for field, value in pairs(session.fields) do
+        table.insert(fields, field)
+        table.insert(fields, value)
+    end
+    redis.call('HSET', session_key, unpack(fields))
+    redis.call('HSETNX', session_key, 'first_seen', batch.now)
+    redis.call('HINCRBY', session_key, 'total_events', session.total_events)
+    redis.call('EXPIRE', session_key, batch.session_ttl)
+end
+
+return #batch.events
+"""
+
+
+# ============================================================================
+# COMPACT EVENT ENCODING
+# ============================================================================
+# Events are stored as JSON arrays instead of the verbose client payload:
+#     [timestamp, event_type, page, field, value, field, value, ...]
+# Client timestamps become epoch milliseconds; event types and field names known
+# to static/tracking.js become their index in the lists below (append-only -
+# never reorder them), unknown ones are kept by name. Non-string timestamps and
+# event types are wrapped in a one-element list so they can't be mistaken for a
+# code. session_id is implied by the list key, and session-invariant fields are
+# stored once in the session hash (field 0 holds a bitmask of the ones the event
+# carried; missing or null ones are left out and decode as absent).
+
+EVENT_TYPES = [
+    "page_view", "visibility_change", "scroll_depth", "click", "link_click", "button_click",
+    "form_submit", "section_visible", "custom", "time_on_page", "heartbeat",
+]
+EVENT_FIELDS = [
+    None, "page_title", "referrer", "viewport_width", "viewport_height", "depth_percent", "text",
+    "href", "external", "track_label", "element_type", "button_id", "button_class", "form_id",
+    "form_action", "form_method", "section", "is_visible", "active_time", "event_name", "time_on_page",
+]
+# Field -> type it is restored as (the session hash holds strings)
+SESSION_INVARIANT_FIELDS = {"user_agent": str, "language": str, "screen_width": int, "screen_height": int}
+
+_EVENT_TYPE_CODES = {name: code for code, name in enumerate(EVENT_TYPES)}
+_EVENT_FIELD_CODES = {name: code for code, name in enumerate(EVENT_FIELDS) if name}
+_INVARIANT_BITS = {name: 1 << bit for bit, name in enumerate(SESSION_INVARIANT_FIELDS)}
+_EPOCH = datetime(1970, 1, 1)
+_RESERVED_FIELDS = ("session_id", "timestamp", "event_type", "page")
+
+
+def _encode_timestamp(value):
+    if value is None:
+        return None
+    if not isinstance(value, str):
+        return [value]  # Wrapped so it isn't mistaken for epoch milliseconds
+    try:
+        parsed = datetime.strptime(value, "%Y-%m-%dT%H:%M:%S.%fZ")
+    except ValueError:
+        return value
+    millis = round((parsed - _EPOCH).total_seconds() * 1000)
+    # Only compact timestamps that come back byte-identical
+    return millis if _decode_timestamp(millis) == value else value
+
+
+def _decode_timestamp(value):
+    if isinstance(value, list):
+        return value[0]
+    if isinstance(value, int):
+        return (_EPOCH + timedelta(milliseconds=value)).isoformat(timespec="milliseconds") + "Z"
+    return value
+
+
+def _encode_event_type(value):
+    if isinstance(value, str):
+        return _EVENT_TYPE_CODES.get(value, value)
+    if value is None:
+        return None
+    return [value]  # A client-sent number must not decode as a known type
+
+
+def _decode_event_type(value):
+    if isinstance(value, list):
+        return value[0]
+    if isinstance(value, int):
+        return EVENT_TYPES[value]
+    return value
+
+
+def encode_event(event: Dict[str, Any]) -> tuple:
+    """
+    Encode an event for the events:{session_id} list.
+
+    Returns:
+        Tuple of (encoded event, session-invariant fields taken out of it)
+    """
+    invariants = {}
+    record = [
+        _encode_timestamp(event.get("timestamp")),
+        _encode_event_type(event.get("event_type")),
+        event.get("page"),
+    ]
+    mask = 0
+    for field, value in event.items():
+        if field in _RESERVED_FIELDS:
+            continue
+        if field in _INVARIANT_BITS:
+            if value is not None and value != "":
+                invariants[field] = value
+                mask |= _INVARIANT_BITS[field]
+            continue
+        record.extend((_EVENT_FIELD_CODES.get(field, field), value))
+    if mask:
+        record.extend((0, mask))
+    return json.dumps(record, separators=(",", ":"), ensure_ascii=False), invariants
+
+
+def decode_event(raw: str, session_id: str, session: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+    """
+    Decode a stored event back into the client payload.
+
+    Args:
+        raw: Stored event (compact array, or a legacy JSON object)
+        session_id: Session the event list belongs to
+        session: Session-invariant fields from the session hash
+
+    Returns:
+        Event dictionary
+    """
+    data = json.loads(raw)
+    if isinstance(data, dict):
+        return data
+
+    timestamp, event_type, page, *pairs = data
+    event = {"session_id": session_id}
+    if timestamp is not None:
+        event["timestamp"] = _decode_timestamp(timestamp)
+    if event_type is not None:
+        event["event_type"] = _decode_event_type(event_type)
+    if page is not None:
+        event["page"] = page
+
+    for field, value in zip(pairs[::2], pairs[1::2]):
+        if field == 0:
+            for name, bit in _INVARIANT_BITS.items():
+                stored = (session or {}).get(name)
+                # "None" was stored for null fields before they were left out
+                if value & bit and stored not in (None, "", "None"):
+                    try:
+                        event[name] = SESSION_INVARIANT_FIELDS[name](stored)
+                    except ValueError:
+                        event[name] = stored
+        else:
+            event[EVENT_FIELDS[field] if isinstance(field, int) else field] = value
+    return event
+
+
+# ============================================================================
+# WRITE-BEHIND COUNTER BUFFER
+# ============================================================================
+
+class CounterBuffer:
+    """
+    Per-process write-behind buffer for tracking counters.
+
+    Page metrics, page registry scores and hourly event counts are summed in
+    memory and written as merged HINCRBY/ZINCRBY/INCRBY commands in one pipeline,
+    every flush_interval_ms or as soon as max_events events are pending,
+    whichever comes first, and when the process shuts down.
+
+    Loss bounds: counters are only lost if the process dies without running its
+    shutdown hooks (SIGKILL, OOM kill, power loss) - at most the events of one
+    flush interval, and no more than about max_events. If Redis is unreachable the
+    counters are kept for the next flush, up to max_pending_events; beyond that
+    the oldest buffered counts are dropped (and logged). Event lists, sessions
+    and unique visitors are never buffered. Reads lag by up to one flush interval.
+    """
+
+    def __init__(self, storage, flush_interval_ms: int = 1000, max_events: int = 500,
+                 max_pending_events: int = 100000):
+        self.storage = storage
+        self.flush_interval = flush_interval_ms / 1000
+        self.max_events = max_events
+        self.max_pending_events = max_pending_events
+
+        self._lock = Lock()
+        self._flush_lock = Lock()
+        self._pages = defaultdict(Counter)  # page -> field -> amount
+        self._hourly = Counter()            # hour -> events
+        self._events = 0
+
+        self._wake = Event()
+        self._stopped = Event()
+        self._thread = None
+
+        # Stats
+        self.flushes = 0
+        self.flushed_events = 0
+        self.dropped_events = 0
+
+    def add(self, hour: str, event_count: int, pages: List[tuple]):
+        """
+        Buffer the counters of one ingested batch.
+
+        Args:
+            hour: Hour bucket (YYYY-MM-DD:HH) the events were received in
+            event_count: Number of events in the batch
+            pages: (page, {field: amount}) for each event that has a page
+        """
+        with self._lock:
+            self._hourly[hour] += event_count
+            for page, increments in pages:
+                self._pages[page].update(increments)
+            self._events += event_count
+            full = self._events >= self.max_events
+            if self._thread is None:
+                self._start()
+        if full:
+            self._wake.set()
+
+    def _start(self):
+        self._thread = Thread(target=self._run, name="tracking-counter-flush", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
+
+    def flush(self) -> int:
+        """
+        Write all buffered counters to Redis.
+
+        Returns:
+            Number of events whose counters were written
+        """
+        with self._flush_lock:
+            with self._lock:
+                pages, hourly, events = self._pages, self._hourly, self._events
+                self._pages, self._hourly, self._events = defaultdict(Counter), Counter(), 0
+            if not events and not pages:
+                return 0
+
+            storage = self.storage
+            registry_key = storage._key("page_registry")
+            pipeline = storage.redis.pipeline(transaction=False)
+            for hour, count in hourly.items():
+                hourly_key = storage._key("hourly_events", hour)
+                pipeline.incrby(hourly_key, count)
+                pipeline.expire(hourly_key, storage.METRICS_TTL)
+            for page, fields in pages.items():
+                metrics_key = storage._key("page_metrics", page)
+                for field, amount in fields.items():
+                    if amount:
+                        pipeline.hincrby(metrics_key, field, amount)
+                if fields.get("views"):
+                    pipeline.zincrby(registry_key, fields["views"], page)
+                else:
+                    pipeline.zadd(registry_key, {page: 0}, nx=True)
+                pipeline.expire(metrics_key, storage.METRICS_TTL)
+            if pages:
+                pipeline.expire(registry_key, storage.METRICS_TTL)
+
+            try:
+                pipeline.execute()
+            except Exception as e:
+                self._restore(pages, hourly, events)
+                logger.warning(f"Tracking counter flush failed, keeping {events} events for the next one: {e}")
+                return 0
+
+            self.flushes += 1
+            self.flushed_events += events
+            return events
+
+    def _restore(self, pages, hourly, events: int):
+        """Put counters of a failed flush back, within max_pending_events"""
+        with self._lock:
+            if self._events + events > self.max_pending_events:
+                self.dropped_events += events
+                logger.error(f"Tracking counter buffer full, dropped counters of {events} events")
+                return
+            for page, fields in pages.items():
+                self._pages[page].update(fields)
+            self._hourly.update(hourly)
+            self._events += events
+
+    def close(self):
+        """Stop the flush thread and write whatever is left"""
+        self._stopped.set()
+        self._wake.set()
+        if self._thread is not None and self._thread.is_alive():
+            self._thread.join(timeout=5)
+        self.flush()
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            pending = self._events
+        return {
+            "pending_events": pending,
+            "flushes": self.flushes,
+            "flushed_events": self.flushed_events,
+            "dropped_events": self.dropped_events,
+            "flush_interval_ms": int(self.flush_interval * 1000),
+            "max_events": self.max_events,
+        }
+
 
 class TrackingStorage:
     """
@@ -25,16 +419,34 @@ class TrackingStorage:
     Can be easily configured for different sites by changing key prefixes.
     """
 
-    def __init__(self, redis_client, key_prefix="tracking"):
+    VISITOR_MODES = ("exact", "approximate")
+
+    def __init__(self, redis_client, key_prefix="tracking", unique_visitors="approximate", use_script=True,
+                 buffer_counters=False, flush_interval_ms=1000, flush_max_events=500):
         """
         Initialize tracking storage.
 
         Args:
             redis_client: Redis client instance
             key_prefix: Prefix for all Redis keys (useful for multi-site deployments)
+            unique_visitors: "approximate" counts visitors with one HyperLogLog per day
+                             (constant memory, ~1% error); "exact" also keeps a set of
+                             session IDs per day and counts from those
+            use_script: Ingest event batches with a server-side Lua script (one round
+                        trip); False uses plain pipelines, for servers without scripting
+            buffer_counters: Aggregate page metrics and hourly counts in a per-process
+                             CounterBuffer instead of writing them on every request
+            flush_interval_ms: Longest time counters stay buffered
+            flush_max_events: Number of buffered events that triggers an early flush
         """
+        if unique_visitors not in self.VISITOR_MODES:
+            raise ValueError(f"unique_visitors must be one of {self.VISITOR_MODES}, got {unique_visitors!r}")
+
         self.redis = redis_client
         self.prefix = key_prefix
+        self.unique_visitors = unique_visitors
+        self._ingest_script = redis_client.register_script(INGEST_SCRIPT) if use_script else None
+        self.counter_buffer = CounterBuffer(self, flush_interval_ms, flush_max_events) if buffer_counters else None
 
         # Default retention periods (in seconds)
         self.SESSION_TTL = 30 * 24 * 60 * 60  # 30 days
@@ -61,16 +473,14 @@ class TrackingStorage:
             True if successful
         """
         key = self._key("session", session_id)
+        now = datetime.utcnow().isoformat()
+        session_data["last_seen"] = now
 
-        # Add timestamp if not present
-        if "first_seen" not in session_data:
-            session_data["first_seen"] = datetime.utcnow().isoformat()
-
-        session_data["last_seen"] = datetime.utcnow().isoformat()
-
-        # Store in Redis
+        # Store in Redis (first_seen is only set once, unless given explicitly)
         pipeline = self.redis.pipeline()
         pipeline.hset(key, mapping=session_data)
+        if "first_seen" not in session_data:
+            pipeline.hsetnx(key, "first_seen", now)
         pipeline.expire(key, self.SESSION_TTL)
         pipeline.execute()
 
@@ -96,6 +506,96 @@ class TrackingStorage:
     # EVENT STORAGE
     # ========================================================================
 
+    def ingest_events(self, events: List[Dict[str, Any]], session_data: Dict[str, Any] = None) -> int:
+        """
+        Store a validated batch of events together with its session metadata.
+
+        Everything (event lists, visitor/hourly counters, page metrics, session
+        hash) is written atomically by INGEST_SCRIPT in a single round trip.
+
+        Args:
+            events: List of event dictionaries
+            session_data: Metadata for the session of the first event (user agent,
+                          language, ...); its total_events grows by the stored count
+
+        Returns:
+            Number of events stored
+        """
+        events = [event for event in events if event.get("session_id")]
+        if not events:
+            return 0
+
+        if self._ingest_script is None:
+            stored = self._store_events_pipeline(events)
+            if session_data is not None:
+                session_id = events[0]["session_id"]
+                self.create_or_update_session(session_id, dict(session_data))
+                self.increment_session_counter(session_id, "total_events", stored)
+            self._buffer_counters(events)
+            return stored
+
+        encoded = []
+        profiles = {}
+        for event in events:
+            record, invariants = encode_event(event)
+            encoded.append(record)
+            if invariants:
+                profiles.setdefault(event["session_id"], {}).update(
+                    {field: str(value) for field, value in invariants.items()}
+                )
+
+        now = datetime.utcnow()
+        batch = {
+            "now": now.isoformat(),
+            "today": now.strftime("%Y-%m-%d"),
+            "hour": now.strftime("%Y-%m-%d:%H"),
+            "session_ttl": self.SESSION_TTL,
+            "event_ttl": self.EVENT_TTL,
+            "metrics_ttl": self.METRICS_TTL,
+            "exact_visitors": self.unique_visitors == "exact",
+            "buffered": self.counter_buffer is not None,
+            "events": [
+                [
+                    event["session_id"],
+                    record,
+                    event.get("page") or "",
+                    [item for field, amount in self._page_metric_increments(event).items()
+                     for item in (field, amount)]
+                ]
+                for event, record in zip(events, encoded)
+            ],
+            "profiles": profiles
+        }
+        if session_data is not None:
+            batch["session"] = {
+                "session_id": events[0]["session_id"],
+                "fields": {field: str(value) for field, value in session_data.items()},
+                "total_events": len(events)
+            }
+
+        stored = int(self._ingest_script(args=[self.prefix, json.dumps(batch)]))
+        self._buffer_counters(events)
+        return stored
+
+    def _buffer_counters(self, events: List[Dict[str, Any]]):
+        """Hand the counters of stored events to the write-behind buffer (if enabled)."""
+        if self.counter_buffer is None:
+            return
+        self.counter_buffer.add(
+            datetime.utcnow().strftime("%Y-%m-%d:%H"),
+            len(events),
+            [(event["page"], self._page_metric_increments(event)) for event in events if event.get("page")]
+        )
+
+    def flush_counters(self) -> int:
+        """Write buffered counters now (no-op without buffering)."""
+        return self.counter_buffer.flush() if self.counter_buffer else 0
+
+    def close(self):
+        """Flush buffered counters and stop the flush thread (call on shutdown)."""
+        if self.counter_buffer:
+            self.counter_buffer.close()
+
     def store_events(self, events: List[Dict[str, Any]]) -> int:
         """
         Store multiple events.
@@ -106,6 +606,10 @@ class TrackingStorage:
         Returns:
             Number of events stored
         """
+        return self.ingest_events(events)
+
+    def _store_events_pipeline(self, events: List[Dict[str, Any]]) -> int:
+        """Store events with a client-side pipeline (used when scripting is disabled)."""
         if not events:
             return 0
 
@@ -118,19 +622,31 @@ class TrackingStorage:
 
             # Store event in session's event list
             event_key = self._key("events", session_id)
-            pipeline.rpush(event_key, json.dumps(event))
+            record, invariants = encode_event(event)
+            pipeline.rpush(event_key, record)
             pipeline.expire(event_key, self.EVENT_TTL)
 
-            # Update session metadata
+            # Update session metadata (session-invariant fields live here, not in every event)
             session_key = self._key("session", session_id)
-            pipeline.hset(session_key, "last_seen", datetime.utcnow().isoformat())
+            pipeline.hset(session_key, mapping={
+                "last_seen": datetime.utcnow().isoformat(),
+                **{field: str(value) for field, value in invariants.items()}
+            })
             pipeline.expire(session_key, self.SESSION_TTL)
 
-            # Add to daily sessions set
+            # Count the daily visitor (HyperLogLog always, set only for exact counting)
             today = datetime.utcnow().strftime("%Y-%m-%d")
-            daily_key = self._key("daily_sessions", today)
-            pipeline.sadd(daily_key, session_id)
-            pipeline.expire(daily_key, self.METRICS_TTL)
+            visitors_key = self._key("unique_visitors", today)
+            pipeline.pfadd(visitors_key, session_id)
+            pipeline.expire(visitors_key, self.METRICS_TTL)
+            if self.unique_visitors == "exact":
+                daily_key = self._key("daily_sessions", today)
+                pipeline.sadd(daily_key, session_id)
+                pipeline.expire(daily_key, self.METRICS_TTL)
+
+            # Counters go through the write-behind buffer when it is enabled
+            if self.counter_buffer is not None:
+                continue
 
             # Increment hourly event counter
             hour = datetime.utcnow().strftime("%Y-%m-%d:%H")
@@ -143,7 +659,7 @@ class TrackingStorage:
                 self._update_page_metrics_pipeline(pipeline, event)
 
         pipeline.execute()
-        return len(events)
+        return sum(1 for event in events if event.get("session_id"))
 
     def get_session_events(self, session_id: str, limit: int = None) -> List[Dict[str, Any]]:
         """
@@ -158,18 +674,23 @@ class TrackingStorage:
         """
         key = self._key("events", session_id)
 
+        pipeline = self.redis.pipeline()
         if limit:
             # Get last N events
-            events_raw = self.redis.lrange(key, -limit, -1)
+            pipeline.lrange(key, -limit, -1)
         else:
             # Get all events
-            events_raw = self.redis.lrange(key, 0, -1)
+            pipeline.lrange(key, 0, -1)
+        # Session-invariant fields the compact events refer to
+        pipeline.hmget(self._key("session", session_id), list(SESSION_INVARIANT_FIELDS))
+        events_raw, invariant_values = pipeline.execute()
+        session = dict(zip(SESSION_INVARIANT_FIELDS, invariant_values))
 
         events = []
         for event_json in events_raw:
             try:
-                events.append(json.loads(event_json))
-            except json.JSONDecodeError:
+                events.append(decode_event(event_json, session_id, session))
+            except (json.JSONDecodeError, ValueError, IndexError):
                 continue
 
         return events
@@ -178,40 +699,60 @@ class TrackingStorage:
     # PAGE METRICS
     # ========================================================================
 
-    def _update_page_metrics_pipeline(self, pipeline, event: Dict[str, Any]):
-        """Update page-level metrics (used within a pipeline)."""
-        page = event.get("page")
-        if not page:
-            return
-
-        metrics_key = self._key("page_metrics", page)
+    def _page_metric_increments(self, event: Dict[str, Any]) -> Dict[str, int]:
+        """Page metric counters an event increments (field -> amount)."""
+        increments = {}
 
-        # Increment view count
+        # View count
         if event.get("event_type") == "page_view":
-            pipeline.hincrby(metrics_key, "views", 1)
+            increments["views"] = 1
 
-        # Update time spent (if available)
+        # Time spent (if available)
         time_on_page = event.get("time_on_page")
         if time_on_page:
-            pipeline.hincrby(metrics_key, "total_time", int(time_on_page))
-            pipeline.hincrby(metrics_key, "time_samples", 1)
+            increments["total_time"] = int(time_on_page)
+            increments["time_samples"] = 1
 
-        # Track scroll depth
+        # Scroll depth
         if event.get("event_type") == "scroll_depth":
-            depth = event.get("depth_percent", 0)
+            depth = event.get("depth_percent") or 0
             if depth >= 75:
-                pipeline.hincrby(metrics_key, "scroll_75", 1)
+                increments["scroll_75"] = 1
             if depth >= 90:
-                pipeline.hincrby(metrics_key, "scroll_90", 1)
+                increments["scroll_90"] = 1
+
+        return increments
+
+    def _update_page_metrics_pipeline(self, pipeline, event: Dict[str, Any]):
+        """Update page-level metrics (used within a pipeline)."""
+        page = event.get("page")
+        if not page:
+            return
+
+        metrics_key = self._key("page_metrics", page)
+        registry_key = self._key("page_registry")
+        increments = self._page_metric_increments(event)
+
+        for field, amount in increments.items():
+            pipeline.hincrby(metrics_key, field, amount)
+
+        # The registry score mirrors the view count, so top pages need no hash reads
+        if "views" in increments:
+            pipeline.zincrby(registry_key, increments["views"], page)
+        else:
+            pipeline.zadd(registry_key, {page: 0}, nx=True)
 
         # Set expiry
         pipeline.expire(metrics_key, self.METRICS_TTL)
+        pipeline.expire(registry_key, self.METRICS_TTL)
 
     def get_page_metrics(self, page: str) -> Dict[str, Any]:
         """Get aggregated metrics for a specific page."""
         key = self._key("page_metrics", page)
-        data = self.redis.hgetall(key)
+        return self._page_metrics_from_hash(page, self.redis.hgetall(key))
 
+    def _page_metrics_from_hash(self, page: str, data: Dict[str, str]) -> Dict[str, Any]:
+        """Turn a page_metrics hash into the metrics dict returned by the API."""
         if not data:
             return {
                 "page": page,
@@ -237,21 +778,82 @@ class TrackingStorage:
             "deep_engagement": metrics.get("scroll_90", 0)
         }
 
-    def get_all_page_metrics(self) -> List[Dict[str, Any]]:
-        """Get metrics for all tracked pages."""
-        # Find all page metric keys
-        pattern = self._key("page_metrics", "*")
-        keys = self.redis.keys(pattern)
+    def get_all_page_metrics(self, offset: int = 0, limit: int = None) -> List[Dict[str, Any]]:
+        """
+        Get metrics for tracked pages, most viewed first.
+
+        Args:
+            offset: Number of pages to skip
+            limit: Maximum number of pages to return (None = all)
+
+        Returns:
+            List of page metric dictionaries
+        """
+        registry_key = self._key("page_registry")
+        # Backfill once (per key prefix), not on every call while the registry is empty
+        backfilled_key = self._key("page_registry", "backfilled")
+        if self.redis.set(backfilled_key, 1, nx=True):
+            try:
+                self._backfill_page_registry()
+            except Exception:
+                self.redis.delete(backfilled_key)
+                raise
 
-        metrics = []
-        for key in keys:
-            # Extract page path from key (data is already decoded)
-            page = key.split(":", 2)[-1]
-            metrics.append(self.get_page_metrics(page))
+        end = offset + limit - 1 if limit else -1
+        pages = self.redis.zrevrange(registry_key, offset, end)
+        if not pages:
+            return []
 
-        # Sort by views descending
-        metrics.sort(key=lambda x: x["views"], reverse=True)
-        return metrics
+        # One round trip for all pages
+        pipeline = self.redis.pipeline()
+        for page in pages:
+            pipeline.hgetall(self._key("page_metrics", page))
+        hashes = pipeline.execute()
+
+        # Pages whose metrics expired leave the registry
+        expired = [page for page, data in zip(pages, hashes) if not data]
+        if expired:
+            self.redis.zrem(registry_key, *expired)
+
+        return [self._page_metrics_from_hash(page, data) for page, data in zip(pages, hashes) if data]
+
+    def count_tracked_pages(self) -> int:
+        """Number of pages in the page registry."""
+        return self.redis.zcard(self._key("page_registry"))
+
+    def get_total_page_views(self) -> int:
+        """Total views across all tracked pages (from the registry scores)."""
+        scores = self.redis.zrange(self._key("page_registry"), 0, -1, withscores=True)
+        return int(sum(score for _, score in scores))
+
+    def _backfill_page_registry(self):
+        """
+        Register pages tracked before the registry existed.
+        Uses SCAN (not KEYS), so Redis keeps serving other clients meanwhile.
+        """
+        prefix = self._key("page_metrics", "")
+        registry_key = self._key("page_registry")
+
+        for keys in self._scan_batches(f"{prefix}*"):
+            pipeline = self.redis.pipeline()
+            for key in keys:
+                pipeline.hget(key, "views")
+            views = pipeline.execute()
+
+            pipeline = self.redis.pipeline()
+            pipeline.zadd(registry_key, {key[len(prefix):]: int(v or 0) for key, v in zip(keys, views)})
+            pipeline.expire(registry_key, self.METRICS_TTL)
+            pipeline.execute()
+
+    def _scan_batches(self, pattern: str, batch_size: int = 500):
+        batch = []
+        for key in self.redis.scan_iter(match=pattern, count=batch_size):
+            batch.append(key)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
 
     # ========================================================================
     # ANALYTICS & REPORTING
@@ -270,8 +872,11 @@ class TrackingStorage:
         if not date:
             date = datetime.utcnow().strftime("%Y-%m-%d")
 
-        key = self._key("daily_sessions", date)
-        return self.redis.scard(key)
+        if self.unique_visitors == "exact":
+            return self.redis.scard(self._key("daily_sessions", date))
+
+        self._backfill_visitor_logs([date])
+        return self.redis.pfcount(self._key("unique_visitors", date))
 
     def get_unique_visitors_range(self, start_date: str, end_date: str) -> int:
         """
@@ -288,18 +893,58 @@ class TrackingStorage:
         start = datetime.strptime(start_date, "%Y-%m-%d")
         end = datetime.strptime(end_date, "%Y-%m-%d")
 
-        all_sessions = set()
+        dates = []
         current = start
-
         while current <= end:
-            date_str = current.strftime("%Y-%m-%d")
-            key = self._key("daily_sessions", date_str)
-            sessions = self.redis.smembers(key)
-            # Data is already decoded (decode_responses=True)
-            all_sessions.update(sessions)
+            dates.append(current.strftime("%Y-%m-%d"))
             current += timedelta(days=1)
 
-        return len(all_sessions)
+        if not dates:
+            return 0
+
+        if self.unique_visitors == "exact":
+            # Union server-side; only the count comes back
+            union_key = self._key("daily_sessions_union", f"{start_date}:{end_date}:{time.time()}")
+            pipeline = self.redis.pipeline()
+            pipeline.sunionstore(union_key, [self._key("daily_sessions", date) for date in dates])
+            pipeline.delete(union_key)
+            count, _ = pipeline.execute()
+            return count
+
+        # PFCOUNT over several keys counts their union (merged server-side, nothing stored)
+        self._backfill_visitor_logs(dates)
+        return self.redis.pfcount(*[self._key("unique_visitors", date) for date in dates])
+
+    def _backfill_visitor_logs(self, dates: List[str]):
+        """
+        Build missing daily HyperLogLogs from the exact sets of those days.
+        Needed once for days recorded before HyperLogLog counting was introduced.
+        """
+        pipeline = self.redis.pipeline()
+        for date in dates:
+            pipeline.exists(self._key("unique_visitors", date))
+            pipeline.exists(self._key("daily_sessions", date))
+        flags = pipeline.execute()
+
+        for i, date in enumerate(dates):
+            has_log, has_set = flags[2 * i], flags[2 * i + 1]
+            if has_log or not has_set:
+                continue
+
+            set_key = self._key("daily_sessions", date)
+            visitors_key = self._key("unique_visitors", date)
+            batch = []
+            for session_id in self.redis.sscan_iter(set_key, count=1000):
+                batch.append(session_id)
+                if len(batch) >= 1000:
+                    self.redis.pfadd(visitors_key, *batch)
+                    batch = []
+            if batch:
+                self.redis.pfadd(visitors_key, *batch)
+
+            # Expire together with the set it was built from
+            ttl = self.redis.ttl(set_key)
+            self.redis.expire(visitors_key, ttl if ttl and ttl > 0 else self.METRICS_TTL)
 
     def get_hourly_events(self, date: str = None, hour: int = None) -> int:
         """
@@ -343,14 +988,11 @@ class TrackingStorage:
         # Get today's visitors
         today_visitors = self.get_daily_unique_visitors()
 
-        # Get page metrics
-        page_metrics = self.get_all_page_metrics()
+        # Get top pages (straight from the registry, most viewed first)
+        top_pages = self.get_all_page_metrics(limit=10)
 
         # Calculate total page views
-        total_views = sum(p["views"] for p in page_metrics)
-
-        # Get top pages
-        top_pages = page_metrics[:10] if page_metrics else []
+        total_views = self.get_total_page_views()
 
         return {
             "period": {
@@ -368,7 +1010,7 @@ class TrackingStorage:
                 "avg_per_visitor": round(total_views / unique_visitors, 1) if unique_visitors > 0 else 0
             },
             "top_pages": top_pages,
-            "all_pages": page_metrics
+            "pages_tracked": self.count_tracked_pages()
         }
 
     def get_user_journey(self, session_id: str) -> Dict[str, Any]:
@@ -446,7 +1088,8 @@ class TrackingStorage:
         # Delete events list
         pipeline.delete(self._key("events", session_id))
 
-        # Remove from daily session sets (approximate - we check last 90 days)
+        # Remove from daily session sets (approximate - we check last 90 days).
+        # HyperLogLogs don't store session IDs, so there is nothing to remove there
         for i in range(90):
             date = (datetime.utcnow() - timedelta(days=i)).strftime("%Y-%m-%d")
             pipeline.srem(self._key("daily_sessions", date), session_id)
@@ -0,0 +1,203 @@
+"""
+Verdict cache for norm applicability checks
+Stores LLM verdicts keyed by product fingerprint, norm content and model so
+re-running an analysis of the same product doesn't repeat any LLM calls
+
+Data Structure (Redis):
+- verdict:{product_hash}:{norm_id}:{norm_hash}:{model}:{prompt_version} - JSON verdict (with TTL)
+- verdict_index - Sorted set of cached keys scored by insertion time (size bound)
+- verdict_stats - Hash with cluster-wide hit/miss counters
+"""
+import os
+import re
+import json
+import time
+import hashlib
+import logging
+from collections import OrderedDict
+from threading import Lock
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+VERDICT_CACHE_ENABLED = os.getenv('VERDICT_CACHE_ENABLED', 'true').lower() == 'true'
+VERDICT_CACHE_TTL = int(os.getenv('VERDICT_CACHE_TTL', str(7 * 24 * 60 * 60)))  # 7 days
+VERDICT_CACHE_MAX_ENTRIES = int(os.getenv('VERDICT_CACHE_MAX_ENTRIES', '200000'))
+
+
+def normalize_description(product_description: str) -> str:
+    """Normalize case and whitespace so trivial edits map to the same fingerprint"""
+    return re.sub(r"\s+", " ", product_description or "").strip().lower()
+
+
+def product_fingerprint(product_description: str) -> str:
+    """Stable hash of the normalized product description"""
+    return hashlib.sha256(normalize_description(product_description).encode('utf-8')).hexdigest()[:24]
+
+
+def norm_fingerprint(norm: dict) -> str:
+    """Hash of the norm fields the verdict depends on"""
+    content = f"{norm.get('applies_to', '')}\n{norm.get('description', '')}"
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()[:12]
+
+
+class VerdictCache:
+    """
+    TTL + size-bounded verdict cache.
+
+    Uses Redis when a client is available (shared across workers/machines),
+    otherwise an in-process LRU.
+    """
+
+    def __init__(self, redis_client=None, ttl: int = VERDICT_CACHE_TTL,
+                 max_entries: int = VERDICT_CACHE_MAX_ENTRIES, key_prefix: str = "verdict"):
+        self.redis = redis_client
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.prefix = key_prefix
+
+        # In-process fallback store: key -> (expires_at, verdict)
+        self._local: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def make_key(self, product_description: str, norm: dict, model: str, prompt_version: int) -> str:
+        """Build the cache key for one (product, norm, model, prompt) combination"""
+        return (f"{self.prefix}:{product_fingerprint(product_description)}:{norm['id']}:"
+                f"{norm_fingerprint(norm)}:{model}:v{prompt_version}")
+
+    def get_many(self, keys: List[str]) -> List[Optional[dict]]:
+        """
+        Look up several verdicts at once (single MGET against Redis).
+
+        Returns:
+            List aligned with keys, None for misses
+        """
+        if not keys:
+            return []
+
+        if self.redis:
+            try:
+                raw = self.redis.mget(keys)
+                values = [json.loads(v) if v else None for v in raw]
+            except Exception as e:
+                logger.warning(f"Verdict cache lookup failed: {e}, proceeding without cache")
+                values = [None] * len(keys)
+        else:
+            values = [self._local_get(key) for key in keys]
+
+        hits = sum(1 for v in values if v is not None)
+        self._count(hits, len(keys) - hits)
+        return values
+
+    def set_many(self, items: Dict[str, dict]):
+        """Store several verdicts and enforce the size bound"""
+        if not items:
+            return
+
+        if self.redis:
+            try:
+                index_key = f"{self.prefix}_index"
+                now = time.time()
+                pipeline = self.redis.pipeline()
+                for key, verdict in items.items():
+                    pipeline.setex(key, self.ttl, json.dumps(verdict))
+                pipeline.zadd(index_key, {key: now for key in items})
+                # Forget index entries whose keys have already expired
+                pipeline.zremrangebyscore(index_key, 0, now - self.ttl)
+                pipeline.zcard(index_key)
+                size = pipeline.execute()[-1]
+
+                if size > self.max_entries:
+                    evicted = [key for key, _ in self.redis.zpopmin(index_key, size - self.max_entries)]
+                    if evicted:
+                        self.redis.delete(*evicted)
+                        logger.info(f"Evicted {len(evicted)} verdicts from cache")
+            except Exception as e:
+                logger.warning(f"Failed to cache verdicts: {e}")
+            return
+
+        with self._lock:
+            expires_at = time.time() + self.ttl
+            for key, verdict in items.items():
+                self._local[key] = (expires_at, verdict)
+                self._local.move_to_end(key)
+            while len(self._local) > self.max_entries:
+                self._local.popitem(last=False)
+
+    def _local_get(self, key: str) -> Optional[dict]:
+        with self._lock:
+            entry = self._local.get(key)
+            if entry is None:
+                return None
+            expires_at, verdict = entry
+            if expires_at < time.time():
+                del self._local[key]
+                return None
+            self._local.move_to_end(key)
+            return verdict
+
+    def _count(self, hits: int, misses: int):
+        with self._lock:
+            self.hits += hits
+            self.misses += misses
+
+        if self.redis and (hits or misses):
+            try:
+                pipeline = self.redis.pipeline()
+                pipeline.hincrby(f"{self.prefix}_stats", "hits", hits)
+                pipeline.hincrby(f"{self.prefix}_stats", "misses", misses)
+                pipeline.execute()
+            except Exception as e:
+                logger.warning(f"Failed to update verdict cache stats: {e}")
+
+    def get_stats(self) -> Dict:
+        """Hit/miss counters for this process (and cluster-wide when on Redis)"""
+        lookups = self.hits + self.misses
+        stats = {
+            'backend': 'redis' if self.redis else 'local',
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 3) if lookups else 0,
+        }
+
+        if self.redis:
+            try:
+                cluster = self.redis.hgetall(f"{self.prefix}_stats")
+                stats['cluster_hits'] = int(cluster.get('hits', 0))
+                stats['cluster_misses'] = int(cluster.get('misses', 0))
+                stats['entries'] = self.redis.zcard(f"{self.prefix}_index")
+            except Exception as e:
+                logger.warning(f"Failed to read verdict cache stats: {e}")
+        else:
+            stats['entries'] = len(self._local)
+
+        return stats
+
+
+_verdict_cache = None
+_verdict_cache_lock = Lock()
+
+
+def get_verdict_cache() -> VerdictCache:
+    """Get the shared verdict cache (Redis-backed when REDIS_URL is set)"""
+    global _verdict_cache
+    if _verdict_cache is None:
+        with _verdict_cache_lock:
+            if _verdict_cache is None:
+                redis_client = None
+                redis_url = os.getenv('REDIS_URL')
+                if redis_url:
+                    try:
+                        import redis
+                        redis_client = redis.from_url(redis_url, decode_responses=True)
+                    except Exception as e:
+                        logger.warning(f"Verdict cache falling back to in-process store: {e}")
+                _verdict_cache = VerdictCache(redis_client)
+    return _verdict_cache
+
+
+def get_verdict_cache_stats() -> Dict:
+    """Get statistics about the verdict cache"""
+    return get_verdict_cache().get_stats()
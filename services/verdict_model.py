@@ -0,0 +1,492 @@
+"""
+Learned applicability model - answers clear-cut norm checks without the LLM
+With VERDICT_DATASET_LOGGING enabled, LLM verdicts are logged to a local JSONL
+dataset; an offline training command fits a logistic regression over hashed
+(norm x product feature) crosses with NumPy. At runtime the model only answers
+when its probability is outside the uncertainty band and the norm has enough
+training examples
+
+Dataset (JSONL, one object per line):
+- {"type": "product", "product": fingerprint, "description", "attributes", "ts"}
+  written once per product (per file)
+- {"product": fingerprint, "norm": "database:id", "applies", "confidence", "model", "ts"}
+  one per LLM verdict
+
+Retention: once the file reaches VERDICT_DATASET_MAX_MB it is rotated to
+"<path>.1" (replacing the previous rotation), so at most twice that size is kept
+and the oldest verdicts are dropped first. Product descriptions are customer
+data - delete both files to forget them.
+
+Training:
+    python -m services.verdict_model train [--dataset PATH] [--out PATH] [--epochs N]
+"""
+import os
+import sys
+import json
+import math
+import time
+import zlib
+import random
+import logging
+from threading import Lock
+from typing import Dict, List, Optional
+
+# NumPy is optional - the model is disabled without it
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    np = None
+    NUMPY_AVAILABLE = False
+
+from .norm_index import tokenize
+from .product_attributes import product_quantities
+from .verdict_cache import product_fingerprint
+
+logger = logging.getLogger(__name__)
+
+_DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data")
+
+VERDICT_MODEL_ENABLED = os.getenv('VERDICT_MODEL_ENABLED', 'true').lower() == 'true'
+VERDICT_DATASET_PATH = os.getenv('VERDICT_DATASET_PATH', os.path.join(_DATA_DIR, 'verdict_dataset.jsonl'))
+VERDICT_MODEL_PATH = os.getenv('VERDICT_MODEL_PATH', os.path.join(_DATA_DIR, 'verdict_model.npz'))
+# Opt-in: the dataset stores product descriptions
+VERDICT_DATASET_LOGGING = os.getenv('VERDICT_DATASET_LOGGING', 'false').lower() == 'true'
+# Size at which the dataset is rotated (see Retention above)
+VERDICT_DATASET_MAX_MB = float(os.getenv('VERDICT_DATASET_MAX_MB', '100'))
+
+# Uncertainty band - the model answers only when p <= LOW or p >= HIGH
+VERDICT_MODEL_LOW = float(os.getenv('VERDICT_MODEL_LOW', '0.05'))
+VERDICT_MODEL_HIGH = float(os.getenv('VERDICT_MODEL_HIGH', '0.95'))
+# Minimum training examples of a norm before the model may answer for it
+VERDICT_MODEL_MIN_EXAMPLES = int(os.getenv('VERDICT_MODEL_MIN_EXAMPLES', '30'))
+# Holdout accuracy of confident predictions required before the model is used at all
+VERDICT_MODEL_MIN_ACCURACY = float(os.getenv('VERDICT_MODEL_MIN_ACCURACY', '0.97'))
+# Share of confident predictions still sent to the LLM, so the dataset keeps up with the model
+VERDICT_MODEL_AUDIT_RATE = float(os.getenv('VERDICT_MODEL_AUDIT_RATE', '0.05'))
+
+# Hashed feature space (changing these requires retraining)
+FEATURE_DIM = 1 << 18
+FEATURE_VERSION = 1
+
+
+def norm_key(norm: dict) -> str:
+    """Stable key of a norm (ids repeat across databases)"""
+    return f"{norm.get('source_database', 'norms.json')}:{norm['id']}"
+
+
+def _quantity_bucket(value: float) -> str:
+    """Quarter-decade bucket of a quantity, so 230V and 240V share a feature"""
+    if value <= 0 or value == float('inf'):
+        return 'inf' if value == float('inf') else '0'
+    return str(round(math.log10(value) * 4))
+
+
+def product_features(product_description: str, attributes: Optional[Dict] = None) -> List[str]:
+    """
+    Product features: attribute values and their words, bucketed quantities and
+    the words of the summary.
+    """
+    features = set()
+    for field, value in (attributes or {}).items():
+        for item in (value if isinstance(value, list) else [value]):
+            text = str(item).lower()
+            features.add(f"{field}={text}")
+            features.update(f"{field}~{token}" for token in tokenize(text))
+
+    for dimension, intervals in product_quantities(product_description, attributes).items():
+        for _, low, high, qualifier in intervals:
+            features.add(f"{dimension}:{qualifier}:{_quantity_bucket(low)}-{_quantity_bucket(high)}")
+
+    features.update(f"w={token}" for token in tokenize(product_description))
+    return sorted(features)
+
+
+def feature_indices(key: str, features: List[str]):
+    """Hash the norm x feature crosses (plus the norm's bias) into FEATURE_DIM"""
+    crosses = [f"{key}|bias"] + [f"{key}|{feature}" for feature in features]
+    return np.array([zlib.crc32(cross.encode('utf-8')) % FEATURE_DIM for cross in crosses], dtype=np.int64)
+
+
+def _feature_values(count: int):
+    # Bias at 1, product features scaled so long descriptions don't dominate
+    values = np.full(count, 1.0 / math.sqrt(max(count - 1, 1)), dtype=np.float32)
+    values[0] = 1.0
+    return values
+
+
+def _sigmoid(z: float) -> float:
+    return 1.0 / (1.0 + math.exp(-max(-30.0, min(30.0, z))))
+
+
+# ============================================================================
+# DATASET
+# ============================================================================
+
+class VerdictDataset:
+    """Append-only JSONL log of LLM verdicts, with each product described once"""
+
+    def __init__(self, path: str = VERDICT_DATASET_PATH, max_bytes: int = int(VERDICT_DATASET_MAX_MB * 1024 * 1024)):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = Lock()
+        self._products = None  # Fingerprints already described in the current file
+        self.logged = 0
+        self.failed = 0
+        self.rotations = 0
+
+    def _described_products(self) -> set:
+        """Fingerprints with a product record in the current file (scanned once per process)"""
+        if self._products is None:
+            self._products = set()
+            if os.path.exists(self.path):
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    for line in f:
+                        if '"type": "product"' in line:
+                            try:
+                                self._products.add(json.loads(line)['product'])
+                            except (ValueError, KeyError):
+                                continue
+        return self._products
+
+    def _rotate_if_full(self):
+        if self.max_bytes and os.path.exists(self.path) and os.path.getsize(self.path) >= self.max_bytes:
+            os.replace(self.path, f"{self.path}.1")
+            self._products = set()
+            self.rotations += 1
+            logger.info(f"Rotated verdict dataset {self.path}")
+
+    def log_many(self, product_description: str, attributes: Optional[Dict], entries: list, model: str):
+        """
+        Append verdicts.
+
+        Args:
+            product_description: Product summary the verdicts were made for
+            attributes: Structured attribute record (may be None)
+            entries: List of (norm, result) tuples
+            model: Model (or cascade) that produced the verdicts
+        """
+        if not entries:
+            return
+        product = product_fingerprint(product_description)
+        now = time.time()
+        lines = [
+            json.dumps({
+                'ts': now,
+                'product': product,
+                'norm': norm_key(norm),
+                'applies': bool(result['applies']),
+                'confidence': result.get('confidence', 0),
+                'model': model,
+            }, ensure_ascii=False)
+            for norm, result in entries
+        ]
+        try:
+            with self._lock:
+                os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+                self._rotate_if_full()
+                products = self._described_products()
+                if product not in products:
+                    lines.insert(0, json.dumps({
+                        'type': 'product',
+                        'ts': now,
+                        'product': product,
+                        'description': product_description,
+                        'attributes': attributes or {},
+                    }, ensure_ascii=False))
+                with open(self.path, 'a', encoding='utf-8') as f:
+                    f.write("\n".join(lines) + "\n")
+                products.add(product)
+            self.logged += len(entries)
+        except OSError as e:
+            self.failed += len(entries)
+            logger.warning(f"Could not log verdicts to {self.path}: {e}")
+
+    def read(self) -> List[dict]:
+        """
+        Load the dataset (rotated file first), keeping the latest verdict per
+        (product, norm) with its product's description and attributes attached.
+        """
+        products = {}
+        latest = {}
+        for path in (f"{self.path}.1", self.path):
+            if not os.path.exists(path):
+                continue
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        row = json.loads(line)
+                    except ValueError:
+                        continue
+                    if row.get('type') == 'product':
+                        products[row['product']] = row
+                    else:
+                        latest[(row['product'], row['norm'])] = row
+
+        rows = []
+        for (product, _), row in latest.items():
+            if product in products:
+                row['description'] = products[product]['description']
+                row['attributes'] = products[product]['attributes']
+            rows.append(row)
+        return rows
+
+
+_dataset = None
+_dataset_lock = Lock()
+
+
+def get_verdict_dataset() -> Optional[VerdictDataset]:
+    """Get the shared dataset logger, or None when logging is disabled"""
+    global _dataset
+    if not VERDICT_DATASET_LOGGING:
+        return None
+    if _dataset is None:
+        with _dataset_lock:
+            if _dataset is None:
+                _dataset = VerdictDataset()
+    return _dataset
+
+
+# ============================================================================
+# MODEL
+# ============================================================================
+
+class VerdictModel:
+    """
+    Logistic regression over hashed norm x product feature crosses.
+    Effectively one small model per norm sharing a single weight vector.
+    """
+
+    def __init__(self, weights, support: Dict[str, int], metrics: Dict):
+        self.weights = weights
+        self.support = support
+        self.metrics = metrics
+        self.answered = 0
+        self.deferred = 0
+        self.audited = 0
+
+    def probability(self, key: str, features: List[str]) -> float:
+        indices = feature_indices(key, features)
+        return _sigmoid(float(np.dot(self.weights[indices], _feature_values(len(indices)))))
+
+    def predict(self, norm: dict, features: List[str]) -> Optional[dict]:
+        """
+        Answer for a norm when the model is confident.
+
+        Args:
+            norm: Norm dict
+            features: product_features() of the product
+
+        Returns:
+            Result dict (same shape as check_norm_applies) or None if the LLM must decide
+        """
+        key = norm_key(norm)
+        if self.support.get(key, 0) < VERDICT_MODEL_MIN_EXAMPLES:
+            return None
+
+        p = self.probability(key, features)
+        if VERDICT_MODEL_LOW < p < VERDICT_MODEL_HIGH:
+            self.deferred += 1
+            return None
+        if VERDICT_MODEL_AUDIT_RATE and random.random() < VERDICT_MODEL_AUDIT_RATE:
+            self.audited += 1
+            return None
+
+        self.answered += 1
+        applies = p >= VERDICT_MODEL_HIGH
+        return {
+            "norm_id": norm["id"],
+            "norm_name": norm["name"],
+            "applies": applies,
+            "confidence": round(100 * (p if applies else 1 - p)),
+            "reasoning": (f"Predicted from {self.support[key]} previous assessments of this norm "
+                          f"(probability {p:.2f})."),
+            "url": norm.get("url", "")
+        }
+
+    def save(self, path: str):
+        np.savez_compressed(
+            path,
+            weights=self.weights,
+            meta=np.array(json.dumps({
+                'feature_dim': FEATURE_DIM,
+                'feature_version': FEATURE_VERSION,
+                'support': self.support,
+                'metrics': self.metrics,
+            }))
+        )
+
+    @classmethod
+    def load(cls, path: str) -> Optional['VerdictModel']:
+        with np.load(path) as data:
+            meta = json.loads(str(data['meta']))
+            if meta.get('feature_dim') != FEATURE_DIM or meta.get('feature_version') != FEATURE_VERSION:
+                logger.warning(f"Verdict model {path} was trained with other feature settings, ignoring it")
+                return None
+            return cls(data['weights'].astype(np.float32), meta['support'], meta['metrics'])
+
+    def stats(self) -> Dict:
+        return {
+            'norms': sum(1 for count in self.support.values() if count >= VERDICT_MODEL_MIN_EXAMPLES),
+            'answered': self.answered,
+            'deferred': self.deferred,
+            'audited': self.audited,
+            **self.metrics,
+        }
+
+
+def train(rows: List[dict], epochs: int = 5, learning_rate: float = 0.5, l2: float = 1e-6,
+          holdout: float = 0.1, seed: int = 13) -> VerdictModel:
+    """
+    Fit the model with AdaGrad SGD on logged verdicts.
+
+    Labels are the LLM's applies verdicts, weighted by its confidence. A holdout
+    split (by product, so products aren't seen twice) measures accuracy and
+    coverage of the confident predictions.
+
+    Args:
+        rows: Dataset rows (VerdictDataset.read)
+        epochs: Passes over the training split
+        learning_rate: AdaGrad base learning rate
+        l2: L2 regularization strength
+        holdout: Fraction of products held out for evaluation
+        seed: Shuffle seed
+    """
+    rng = random.Random(seed)
+    products = sorted({row['product'] for row in rows})
+    rng.shuffle(products)
+    held_out = set(products[:int(len(products) * holdout)])
+
+    feature_cache = {}
+    examples = []
+    for row in rows:
+        if row['product'] not in feature_cache:
+            feature_cache[row['product']] = product_features(row.get('description', ''), row.get('attributes'))
+        indices = feature_indices(row['norm'], feature_cache[row['product']])
+        weight = max(0.2, min(1.0, row.get('confidence', 50) / 100))
+        examples.append((row['product'] in held_out, row['norm'], indices, 1.0 if row['applies'] else 0.0, weight))
+
+    train_set = [example for example in examples if not example[0]]
+    test_set = [example for example in examples if example[0]]
+
+    weights = np.zeros(FEATURE_DIM, dtype=np.float32)
+    squared_gradients = np.full(FEATURE_DIM, 1e-8, dtype=np.float32)
+
+    for epoch in range(epochs):
+        rng.shuffle(train_set)
+        loss = 0.0
+        for _, _, indices, label, weight in train_set:
+            values = _feature_values(len(indices))
+            p = _sigmoid(float(np.dot(weights[indices], values)))
+            loss -= weight * math.log(max(1e-12, p if label else 1 - p))
+            gradient = weight * (p - label) * values + l2 * weights[indices]
+            np.add.at(squared_gradients, indices, gradient * gradient)
+            np.subtract.at(weights, indices, learning_rate * gradient / np.sqrt(squared_gradients[indices]))
+        logger.info(f"Epoch {epoch + 1}/{epochs}: loss {loss / max(len(train_set), 1):.4f}")
+
+    support = {}
+    for _, key, _, _, _ in train_set:
+        support[key] = support.get(key, 0) + 1
+
+    confident = correct = 0
+    for _, key, indices, label, _ in test_set:
+        if support.get(key, 0) < VERDICT_MODEL_MIN_EXAMPLES:
+            continue
+        p = _sigmoid(float(np.dot(weights[indices], _feature_values(len(indices)))))
+        if VERDICT_MODEL_LOW < p < VERDICT_MODEL_HIGH:
+            continue
+        confident += 1
+        correct += int((p >= VERDICT_MODEL_HIGH) == bool(label))
+
+    metrics = {
+        'trained_at': time.time(),
+        'examples': len(train_set),
+        'holdout_examples': len(test_set),
+        'holdout_coverage': round(confident / len(test_set), 4) if test_set else 0.0,
+        'holdout_accuracy': round(correct / confident, 4) if confident else 0.0,
+    }
+    return VerdictModel(weights, support, metrics)
+
+
+_model = None
+_model_mtime = None
+_model_lock = Lock()
+
+
+def get_verdict_model() -> Optional[VerdictModel]:
+    """
+    Get the trained model (reloaded when the file changes), or None when it is
+    disabled, missing, or not accurate enough on its holdout.
+    """
+    global _model, _model_mtime
+    if not VERDICT_MODEL_ENABLED or not NUMPY_AVAILABLE:
+        return None
+    try:
+        mtime = os.path.getmtime(VERDICT_MODEL_PATH)
+    except OSError:
+        return None
+
+    if mtime != _model_mtime:
+        with _model_lock:
+            if mtime != _model_mtime:
+                try:
+                    model = VerdictModel.load(VERDICT_MODEL_PATH)
+                except Exception as e:
+                    logger.warning(f"Could not load verdict model: {e}")
+                    model = None
+                if model and model.metrics.get('holdout_accuracy', 0) < VERDICT_MODEL_MIN_ACCURACY:
+                    logger.warning(f"Verdict model holdout accuracy {model.metrics.get('holdout_accuracy')} "
+                                   f"is below {VERDICT_MODEL_MIN_ACCURACY}, not using it")
+                    model = None
+                elif model:
+                    logger.info(f"Loaded verdict model: {model.stats()}")
+                _model = model
+                _model_mtime = mtime
+    return _model
+
+
+def get_verdict_model_stats() -> Dict:
+    """Get statistics about the learned model and the dataset logger"""
+    model = get_verdict_model()
+    dataset = get_verdict_dataset()
+    return {
+        'enabled': model is not None,
+        **(model.stats() if model else {}),
+        'dataset_logged': dataset.logged if dataset else 0,
+    }
+
+
+def main(argv: List[str]) -> int:
+    import argparse
+
+    parser = argparse.ArgumentParser(prog='python -m services.verdict_model')
+    subcommands = parser.add_subparsers(dest='command', required=True)
+    train_parser = subcommands.add_parser('train', help='Fit the model on the logged verdicts')
+    train_parser.add_argument('--dataset', default=VERDICT_DATASET_PATH)
+    train_parser.add_argument('--out', default=VERDICT_MODEL_PATH)
+    train_parser.add_argument('--epochs', type=int, default=5)
+    args = parser.parse_args(argv)
+
+    if not NUMPY_AVAILABLE:
+        print("NumPy is required to train the verdict model")
+        return 1
+
+    rows = VerdictDataset(args.dataset).read()
+    if not rows:
+        print(f"No verdicts in {args.dataset}")
+        return 1
+
+    model = train(rows, epochs=args.epochs)
+    model.save(args.out)
+    print(f"Trained on {model.metrics['examples']} verdicts, "
+          f"{model.stats()['norms']} norms with enough examples")
+    print(f"Holdout: {model.metrics['holdout_coverage']:.1%} answered confidently, "
+          f"{model.metrics['holdout_accuracy']:.1%} of those correct")
+    print(f"Saved to {args.out}")
+    return 0
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    sys.exit(main(sys.argv[1:]))
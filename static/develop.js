@@ -200,16 +200,30 @@ async function createWorkspaceFromDevelop() {
 
         let analysisComplete = false;
         let analysisResults = null;
+        let normsFound = 0;
+        let reconnectAttempts = 0;
 
         await new Promise((resolve, reject) => {
             eventSource.onmessage = function(event) {
                 const data = JSON.parse(event.data);
+                reconnectAttempts = 0;
 
-                if (data.phase === 'analyzing') {
+                if (data.phase === 'summary') {
+                    // (Re)started from the beginning - don't double count verdicts
+                    normsFound = 0;
+                }
+                else if (data.phase === 'analyzing') {
                     // Update progress bar
                     const progressPercent = Math.round((data.progress / data.total) * 100);
                     if (progressBar) progressBar.style.width = `${progressPercent}%`;
-                    if (progressText) progressText.textContent = `Analyzing compliance norms... ${progressPercent}%`;
+                    if (progressText) progressText.textContent = `Analyzing compliance norms... ${progressPercent}%${normsFound ? ` · ${normsFound} found` : ''}`;
+                }
+                else if (data.phase === 'verdict') {
+                    // An applicable norm was confirmed - show the running count
+                    normsFound += 1;
+                }
+                else if (data.phase === 'triage') {
+                    if (progressText) progressText.textContent = data.status;
                 }
                 else if (data.phase === 'complete') {
                     // Analysis done!
@@ -227,8 +241,15 @@ async function createWorkspaceFromDevelop() {
             };
 
             eventSource.onerror = function(error) {
-                eventSource.close();
-                reject(new Error('Connection to analysis service failed'));
+                // The analysis keeps running server-side; the browser reconnects
+                // with Last-Event-ID and the stream resumes where it left off
+                reconnectAttempts += 1;
+                if (eventSource.readyState === EventSource.CLOSED || reconnectAttempts > 5) {
+                    eventSource.close();
+                    reject(new Error('Connection to analysis service failed'));
+                    return;
+                }
+                if (progressText) progressText.textContent = 'Connection lost, reconnecting...';
             };
         });
 
@@ -262,7 +283,8 @@ async function createWorkspaceFromDevelop() {
                 name: workspaceName,
                 product_description: sessionData.product_description || sessionData.history?.[0]?.content || workspaceName,
                 matched_norms: sessionData.matched_norms || [],
-                all_results: sessionData.all_norm_results || {}
+                all_results: sessionData.all_norm_results || {},
+                product_attributes: sessionData.product_attributes || {}
             })
         });
 
@@ -0,0 +1,96 @@
+import json
+
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+
+import services.analysis_jobs as analysis_jobs
+from services.analysis_jobs import AnalysisJobQueue, JOBS_STREAM
+
+
+def fake_payloads(history, allowed_databases, priority=None):
+    yield {'phase': 'summary', 'status': 'Building product summary...'}
+    yield {'phase': 'result', 'product_description': 'Kettle', 'product_attributes': {},
+           'matched_norms': [], 'all_norm_results': []}
+    yield {'phase': 'complete', 'product_description': 'Kettle', 'norms': [], 'total_norms': 0}
+
+
+@pytest.fixture
+def queue(monkeypatch):
+    saved = []
+    monkeypatch.setattr(analysis_jobs, 'analysis_payloads', fake_payloads)
+    monkeypatch.setattr(analysis_jobs, 'save_analysis_result', lambda *args: saved.append(args))
+    queue = AnalysisJobQueue(fakeredis.FakeRedis(decode_responses=True), workers=0)
+    queue.saved = saved
+    return queue
+
+
+def run_queued(queue):
+    message_id, fields = queue.redis.xrange(JOBS_STREAM)[-1]
+    queue._run(message_id, fields)
+    return fields
+
+
+def test_worker_saves_result_once_per_job(queue):
+    job_id = queue.submit([], ['norms.json'], 'free', session_id='s1', user_id='u1')
+    fields = run_queued(queue)
+
+    assert len(queue.saved) == 1
+    assert queue.saved[0][:3] == ('s1', 'u1', ['norms.json'])
+
+    phases = [payload['phase'] for _, payload in queue.tail(job_id)]
+    assert phases == ['queued', 'summary', 'finalizing', 'complete']
+    assert queue.last_phase(job_id) == 'complete'
+
+    # A reclaimed job (worker died after saving) doesn't store or track usage again
+    queue.redis.xadd(JOBS_STREAM, fields)
+    run_queued(queue)
+    assert len(queue.saved) == 1
+
+
+def test_tailing_does_not_save(queue):
+    job_id = queue.submit([], ['norms.json'], session_id='s1')
+    run_queued(queue)
+    for _ in range(2):
+        assert all(payload['phase'] != 'result' for _, payload in queue.tail(job_id))
+    assert len(queue.saved) == 1
+
+
+def test_last_phase_of_expired_job(queue):
+    assert queue.last_phase('missing') is None
+    assert queue.is_finished('missing')
+
+
+def test_save_analysis_result_stores_the_session(monkeypatch):
+    from services.session_store import SessionStore
+
+    store = SessionStore(fakeredis.FakeRedis(decode_responses=True))
+    monkeypatch.setattr(analysis_jobs, 'get_session_store', lambda: store)
+    verdict = {'norm_id': 'EN 60335-1', 'norm_name': 'EN 60335-1', 'applies': True,
+               'confidence': 90, 'reasoning': 'Household appliance'}
+    payload = {'phase': 'result', 'product_description': 'Kettle', 'product_attributes': {'voltage': '230V'},
+               'matched_norms': [verdict], 'all_norm_results': [verdict],
+               'stats': {'llm_requests_planned': 1}}
+
+    analysis_jobs.save_analysis_result('s1', None, ['norms.json'], payload)
+
+    session = store.get('s1', 'product_description', 'analysis_stats', 'matched_norms', 'qa_history')
+    assert session['product_description'] == 'Kettle'
+    assert session['analysis_stats'] == {'llm_requests_planned': 1}
+    assert [norm['norm_id'] for norm in session['matched_norms']] == ['EN 60335-1']
+    assert session['qa_history'] == []
+
+
+def test_failed_save_is_retried_by_a_rerun(queue, monkeypatch):
+    def failing_save(*args):
+        raise KeyError('analysis_stats')
+
+    monkeypatch.setattr(analysis_jobs, 'save_analysis_result', failing_save)
+    job_id = queue.submit([], ['norms.json'], session_id='s1')
+    fields = run_queued(queue)
+    assert queue.last_phase(job_id) == 'error'
+
+    monkeypatch.setattr(analysis_jobs, 'save_analysis_result', lambda *args: queue.saved.append(args))
+    queue.redis.xadd(JOBS_STREAM, fields)
+    run_queued(queue)
+    assert len(queue.saved) == 1
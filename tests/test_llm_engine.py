@@ -0,0 +1,59 @@
+import asyncio
+
+import services.llm_engine as llm_engine
+from services.llm_engine import LLMEngine
+
+
+class SlowRateLimiter:
+    """Grants every token after a fixed queueing delay"""
+
+    def __init__(self, delay):
+        self.delay = delay
+        self.acquired = 0
+
+    async def acquire_async(self, flow, weight=None):
+        await asyncio.sleep(self.delay)
+        self.acquired += 1
+        return True
+
+
+def test_rate_limiter_wait_is_not_provider_latency(monkeypatch):
+    rate_limiter = SlowRateLimiter(0.2)
+    sent = []
+
+    async def call(messages, rate_limited=False, **kwargs):
+        sent.append(rate_limited)
+        return {'success': True, 'content': 'ok'}
+
+    monkeypatch.setattr(llm_engine, 'get_rate_limiter', lambda: rate_limiter)
+    monkeypatch.setattr(llm_engine, 'call_openrouter_async', call)
+    monkeypatch.setattr(llm_engine, 'hedge_delay', lambda model: 0.1)
+
+    async def run(engine):
+        return await engine.call([{'role': 'user', 'content': 'hi'}], model='m')
+
+    for hedging in (False, True):
+        engine = LLMEngine(hedging=hedging)
+        assert asyncio.run(run(engine))['success']
+        assert engine.limiter.stats()['latency_ewma_ms'] < 100
+        assert engine.hedges == 0
+
+    # Each call took its token once, in the engine, not again in the client
+    assert rate_limiter.acquired == 2
+    assert sent == [True, True]
+
+
+def test_call_cancelled_while_rate_limited_frees_its_slot(monkeypatch):
+    monkeypatch.setattr(llm_engine, 'get_rate_limiter', lambda: SlowRateLimiter(10))
+
+    async def run():
+        engine = LLMEngine(hedging=False)
+        task = asyncio.ensure_future(engine.call([], model='m'))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        return engine.limiter
+
+    limiter = asyncio.run(run())
+    assert limiter.in_flight == 0
+    assert limiter.stats()['calls_saved'] == 1 and limiter.stats()['calls'] == 0
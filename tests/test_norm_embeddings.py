@@ -0,0 +1,32 @@
+import json
+import os
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from services.norm_embeddings import EMBEDDING_DIM, load_norm_matrix
+
+
+def test_matrix_is_stored_atomically_and_reused(tmp_path):
+    norms = [{'id': 'EN 1', 'name': 'Fans', 'applies_to': 'Electric fans'},
+             {'id': 'EN 2', 'name': 'Kettles', 'applies_to': 'Kettles'}]
+    db_path = tmp_path / 'norms.json'
+    db_path.write_text(json.dumps(norms))
+
+    matrix = load_norm_matrix(str(db_path), norms)
+    assert matrix.shape == (2, EMBEDDING_DIM)
+    assert sorted(os.listdir(tmp_path)) == ['norms.json', os.path.basename(matrix.filename)]
+
+    again = load_norm_matrix(str(db_path), norms)
+    assert again.filename == matrix.filename
+    assert np.array_equal(again, matrix)
+
+
+def test_matrix_stays_in_memory_when_it_cannot_be_stored(tmp_path):
+    norms = [{'id': 'EN 1', 'name': 'Fans'}]
+    db_path = tmp_path / 'missing' / 'norms.json'
+
+    matrix = load_norm_matrix(str(db_path), norms)
+    assert matrix.shape == (1, EMBEDDING_DIM)
+    assert not (tmp_path / 'missing').exists()
@@ -0,0 +1,81 @@
+import copy
+
+from services.norm_graph import NormGraph, get_norm_graph, prerequisite_refs
+
+
+def norm(norm_id, database='norms.json', **fields):
+    return {'id': norm_id, 'name': norm_id, 'source_database': database, **fields}
+
+
+def rejected(confidence=95):
+    return {'applies': False, 'confidence': confidence}
+
+
+def test_prerequisite_refs():
+    assert prerequisite_refs(norm('A')) == []
+    assert prerequisite_refs(norm('A', parent='P', requires='P')) == ['P']
+    assert prerequisite_refs(norm('A', parent='P', requires=['Q', 'P'])) == ['P', 'Q']
+
+
+def test_resolves_within_database_first_and_pinned_references():
+    norms = [
+        norm('DIR'), norm('DIR', 'norms_iec.json'),
+        norm('A', 'norms_iec.json', parent='DIR'),
+        norm('B', 'norms_iec.json', parent='norms.json:DIR'),
+        norm('C', parent='MISSING'),
+    ]
+    graph = NormGraph(norms)
+    assert graph.parents(norms[2]) == [norms[1]]
+    assert graph.parents(norms[3]) == [norms[0]]
+    assert graph.parents(norms[4]) == []
+    assert graph.edges == 2
+
+
+def test_cycles_are_broken():
+    norms = [norm('A', parent='C'), norm('B', parent='A'), norm('C', parent='B'), norm('D', parent='D')]
+    graph = NormGraph(norms)
+    assert graph.edges == 2
+    assert graph.parents(norms[3]) == []
+
+    # Whatever edge was dropped, every norm can still be scheduled eventually
+    unresolved = {'norms.json:' + n['id'] for n in norms}
+    waiting = norms
+    for _ in norms:
+        ready, _, waiting = graph.partition(waiting, {}, unresolved, 85)
+        unresolved -= {'norms.json:' + n['id'] for n in ready}
+    assert waiting == []
+
+
+def test_partition_prunes_under_confidently_rejected_parents():
+    parent, child, grandchild, other = norm('P'), norm('C', parent='P'), norm('G', parent='C'), norm('O')
+    graph = NormGraph([parent, child, grandchild, other])
+
+    ready, pruned, waiting = graph.partition([child, grandchild, other], {}, {'norms.json:P', 'norms.json:C'}, 85)
+    assert ready == [other] and pruned == [] and waiting == [child, grandchild]
+
+    # An unsure rejection doesn't prune
+    decided = {'norms.json:P': rejected(confidence=60)}
+    ready, pruned, _ = graph.partition([child], decided, set(), 85)
+    assert ready == [child] and pruned == []
+
+    decided = {'norms.json:P': rejected()}
+    ready, pruned, waiting = graph.partition([child], decided, set(), 85)
+    assert pruned == [(child, parent)]
+
+
+def test_norms_from_another_index_share_nodes():
+    # The dense index loads its own copies of the norm dicts
+    catalog = [norm('P'), norm('C', parent='P')]
+    graph = NormGraph(catalog)
+    dense_copies = copy.deepcopy(catalog)
+
+    decided = {'norms.json:P': rejected()}
+    ready, pruned, waiting = graph.partition([dense_copies[1]], decided, set(), 85)
+    assert [n['id'] for n, _ in pruned] == ['C']
+
+
+def test_graph_cached_per_index():
+    norms = [norm('P'), norm('C', parent='P')]
+    graph = get_norm_graph(['norms.json'], norms)
+    assert get_norm_graph(['norms.json'], norms) is graph
+    assert get_norm_graph(['norms.json'], list(norms)) is not graph
@@ -0,0 +1,139 @@
+import re
+import asyncio
+
+import pytest
+
+import services.llm_engine as llm_engine
+import services.analysis_jobs as analysis_jobs
+from services import norm_matcher
+from services.norm_matcher import _parse_batch_verdicts, plan_batches, shortlist_norms
+
+
+def fake_llm(rejected_pattern=None, calls=None):
+    """OpenRouter stand-in answering batch prompts: rejects norms whose name matches the pattern"""
+    async def call(messages, model='x', temperature=0.3, max_tokens=200, **kwargs):
+        await asyncio.sleep(0)
+        text = messages[-1]['content']
+        blocks = re.findall(r'^\[(\d+)\] NORM: ([^\n]*)', text, re.M)
+        if calls is not None:
+            calls.append(len(blocks))
+        answers = []
+        for position, name in blocks:
+            rejected = bool(rejected_pattern and re.search(rejected_pattern, name))
+            answers.append(f"[{position}]\nAPPLIES: {'no' if rejected else 'yes'}\n"
+                           f"CONFIDENCE: {95 if rejected else 80}\nREASONING: r")
+        return {"success": True, "content": "\n\n".join(answers)}
+    return call
+
+
+@pytest.fixture
+def offline(monkeypatch):
+    """Only the fake LLM answers: no cache, rules, model or triage"""
+    def install(**fake_options):
+        monkeypatch.setattr(llm_engine, 'call_openrouter_async', fake_llm(**fake_options))
+    return install
+
+
+def run(description, **options):
+    options = {'use_cache': False, 'use_rules': False, 'use_model': False, 'category_triage': False,
+               'cascade': False, 'coalesce': False, **options}
+    return list(norm_matcher.match_norms_streaming(description, **options))
+
+
+def test_graph_pruned_norms_still_complete_the_progress(offline):
+    calls = []
+    offline(rejected_pattern='Radio Equipment|Ecodesign', calls=calls)
+    events = run("Mains powered desk fan 230V AC, no wireless")
+
+    progress = [event for event in events if event[0] == 'progress']
+    stats = next(event[1] for event in events if event[0] == 'stats')
+    _, matched, all_results = events[-1]
+
+    assert stats['graph_pruned'] > 0
+    assert sum(calls) <= len(all_results) - stats['graph_pruned']
+    # Every norm is reported, pruned ones included, and the total never changes
+    assert len(progress) == len(all_results)
+    assert {event[2] for event in progress} == {len(all_results)}
+    assert progress[-1][1] == progress[-1][2]
+
+
+def catalog_norm(i, applies_to="Electrical equipment"):
+    return {'id': f'N{i}', 'name': f'Norm {i}', 'applies_to': applies_to, 'description': 'x' * 40}
+
+
+def test_plan_batches_respects_budget_and_size():
+    norms = [catalog_norm(i) for i in range(10)]
+    assert plan_batches(norms, token_budget=0) == [[norm] for norm in norms]
+
+    batches = plan_batches(norms, token_budget=10_000, max_batch_size=4)
+    assert [len(batch) for batch in batches] == [4, 4, 2]
+    assert [norm for batch in batches for norm in batch] == norms
+
+    # A norm bigger than the budget still gets a batch of its own
+    assert [len(batch) for batch in plan_batches(norms[:3], token_budget=1)] == [1, 1, 1]
+
+
+def test_parse_batch_verdicts():
+    norms = [catalog_norm(i) for i in range(3)]
+    response = ("[1]\nAPPLIES: yes\nCONFIDENCE: 90\nREASONING: mains powered\nand sold in the EU\n\n"
+                "[2]\nThe model rambled here\n\n"
+                "[3]\nAPPLIES: no\nCONFIDENCE: 85\nREASONING: no radio\n\n"
+                "[3]\nAPPLIES: yes\nCONFIDENCE: 10\nREASONING: duplicate")
+    verdicts = _parse_batch_verdicts(norms, response)
+
+    assert sorted(verdicts) == [1, 3]
+    assert verdicts[1]['applies'] and verdicts[1]['confidence'] == 90
+    assert verdicts[1]['reasoning'] == "mains powered and sold in the EU"
+    assert verdicts[3]['norm_id'] == 'N2' and not verdicts[3]['applies']
+
+
+@pytest.mark.parametrize('retrieval', ['lexical', 'dense'])
+def test_shortlist_ranks_relevant_norms_first(retrieval):
+    if retrieval == 'dense':
+        pytest.importorskip('numpy')
+    candidates, audit, stats = shortlist_norms(
+        "Bluetooth speaker with rechargeable lithium battery", top_k=10, recall_sample=3, retrieval=retrieval
+    )
+    assert stats['retrieval'] == retrieval
+    assert stats['shortlisted'] <= 10
+    assert stats['shortlisted'] + stats['always_checked'] == len(candidates)
+    assert len(audit) == stats['audited'] == 3
+    assert not {id(norm) for norm in audit} & {id(norm) for norm in candidates}
+    assert stats['total_norms'] == len(candidates) + stats['skipped']
+
+    text = " ".join(f"{norm['name']} {norm['applies_to']}" for norm in candidates[:10]).lower()
+    assert 'radio' in text or 'batter' in text
+
+
+def test_shortlist_without_retrieval_keeps_everything():
+    candidates, audit, stats = shortlist_norms("Anything", retrieval='none')
+    assert audit == [] and stats['skipped'] == 0
+    assert len(candidates) == stats['total_norms']
+
+
+def test_recall_sample_is_on_by_default():
+    assert norm_matcher.SHORTLIST_RECALL_SAMPLE > 0
+
+
+def test_stats_reach_the_analysis_payloads(offline, monkeypatch):
+    offline()
+    monkeypatch.setattr(analysis_jobs, 'build_product_profile',
+                        lambda history: {"description": "Bluetooth speaker 5V DC", "attributes": {}})
+    monkeypatch.setattr(norm_matcher, 'SINGLEFLIGHT_ENABLED', False)
+
+    payloads = list(analysis_jobs.analysis_payloads([], ['norms.json']))
+    result = next(payload for payload in payloads if payload['phase'] == 'result')
+    complete = payloads[-1]
+
+    assert complete['phase'] == 'complete'
+    assert complete['stats'] is result['stats']
+    assert result['stats']['total_norms'] > 0
+    assert 'estimated_recall' in result['stats']
+
+
+def test_match_norms_reports_stats(offline):
+    offline()
+    stats = {}
+    norm_matcher.match_norms("Bluetooth speaker 5V DC", stats_callback=stats.update, coalesce=False,
+                             use_cache=False, use_model=False)
+    assert stats['total_norms'] > 0 and 'tiers' in stats
@@ -0,0 +1,65 @@
+from services.norm_thresholds import INF, evaluate_norm, extract_product_quantities, parse_norm_thresholds
+
+
+def norm(applies_to):
+    return {'id': 'N', 'name': 'n', 'applies_to': applies_to}
+
+
+def test_product_quantities():
+    quantities = extract_product_quantities("Desk lamp 100-240V AC input, 12V DC, 36W, 450 g")
+    assert quantities['voltage'] == [('voltage', 100.0, 240.0, 'AC'), ('voltage', 12.0, 12.0, 'DC')]
+    assert quantities['power'] == [('power', 36.0, 36.0, None)]
+    assert quantities['weight'] == [('weight', 0.45, 0.45, None)]
+
+
+def test_slash_between_quantities_is_not_a_rate():
+    quantities = extract_product_quantities("USB charger 5V/3A output")
+    assert quantities['voltage'] == [('voltage', 5.0, 5.0, None)]
+    assert quantities['current'] == [('current', 3.0, 3.0, None)]
+
+
+def test_rates_are_ignored():
+    assert extract_product_quantities("Heater using up to 2 kW/h, 500 W per hour") == {}
+    assert extract_product_quantities("Feeds 200 g/day") == {}
+    assert parse_norm_thresholds("Substances over 10 kg/year") == ((), False)
+
+
+def test_radio_frequency_needs_radio_context():
+    assert 'frequency' not in extract_product_quantities("Tablet with a 1.2GHz CPU")
+    assert extract_product_quantities("Wi-Fi at 2.4GHz")['frequency'] == [('frequency', 2.4e9, 2.4e9, None)]
+
+
+def test_ages():
+    assert extract_product_quantities("Puzzle for ages 3+")['age'] == [('age', 3.0, INF, None)]
+    intervals, _ = parse_norm_thresholds("Toys for children under 36 months")
+    assert intervals == (('age', 0.0, 3.0, None),)
+
+
+def test_norm_thresholds():
+    intervals, generic = parse_norm_thresholds("Electrical equipment 50-1000V AC or 75-1500V DC")
+    assert intervals == (('voltage', 50.0, 1000.0, 'AC'), ('voltage', 75.0, 1500.0, 'DC'))
+    assert generic
+
+    _, generic = parse_norm_thresholds("Household appliances up to 250V")
+    assert not generic
+
+
+def test_evaluate_rejects_outside_range():
+    result = evaluate_norm(extract_product_quantities("Battery toy 3V DC"), norm("Electrical equipment 50-1000V AC"))
+    assert result['applies'] is False
+    assert result['reasoning'].startswith("Rule-based check")
+
+
+def test_evaluate_accepts_generic_scope_within_range():
+    result = evaluate_norm(extract_product_quantities("Kettle 230V AC"), norm("Electrical equipment 50-1000V AC"))
+    assert result['applies'] is True
+
+
+def test_evaluate_defers_to_llm():
+    # Specific scope: the voltage fits, but only the LLM can tell if it's a household appliance
+    assert evaluate_norm(extract_product_quantities("Kettle 230V AC"), norm("Household appliances up to 250V")) is None
+    # No comparable quantity
+    assert evaluate_norm(extract_product_quantities("Wooden chair"), norm("Electrical equipment 50-1000V AC")) is None
+    # Both quantities of "5V/3A" are kept, and 5V is below the range
+    result = evaluate_norm(extract_product_quantities("USB charger 5V/3A output"), norm("Equipment 75-1500V DC"))
+    assert result['applies'] is False
@@ -0,0 +1,47 @@
+from services.package_manager import ALL_DATABASE_FILES, FREE_DATABASES, PACKAGES, PackageManager
+
+
+class FakeSupabase:
+    """Answers user_packages queries from a fixed list and counts them"""
+
+    def __init__(self, packages):
+        self.packages = packages
+        self.queries = 0
+        self.filters = {}
+
+    def table(self, name):
+        self.filters = {}
+        return self
+
+    def select(self, columns):
+        return self
+
+    def eq(self, column, value):
+        self.filters[column] = value
+        return self
+
+    def execute(self):
+        self.queries += 1
+        rows = [pkg for pkg in self.packages if pkg['status'] == self.filters.get('status', pkg['status'])]
+        return type('Result', (), {'data': rows})()
+
+
+TRIAL = {'package_type': 'iso_box', 'status': 'trial', 'is_trial': True, 'trial_end': '2999-01-01T00:00:00Z'}
+
+
+def test_analysis_access_loads_packages_once():
+    supabase = FakeSupabase([TRIAL])
+    databases, tier = PackageManager(supabase).get_analysis_access('u1')
+
+    assert (databases, tier) == (sorted(FREE_DATABASES + PACKAGES['iso_box']['databases']), 'trial')
+    assert supabase.queries == 2
+
+    supabase = FakeSupabase([TRIAL, {'package_type': 'mega_bundle', 'status': 'active', 'expires_at': None}])
+    assert PackageManager(supabase).get_analysis_access('u1') == (ALL_DATABASE_FILES, 'bundle')
+
+
+def test_free_user_access():
+    manager = PackageManager(FakeSupabase([]))
+    assert manager.get_analysis_access('u1') == (sorted(FREE_DATABASES), 'free')
+    assert manager.get_allowed_databases('u1') == sorted(FREE_DATABASES)
+    assert manager.get_priority_tier('u1') == 'free'
@@ -0,0 +1,16 @@
+from services.product_attributes import product_context
+
+SUMMARY = 'Mains powered desk fan, 230V AC, with a USB-C charging port for phones'
+
+
+def test_product_context_keeps_the_summary():
+    norm = {'name': 'EN 60335-2-80', 'applies_to': 'Electric fans', 'description': 'Safety of fans'}
+    context = product_context(SUMMARY, {'product_type': 'desk fan', 'voltages': ['230V AC']}, [norm])
+
+    assert context.startswith(SUMMARY)
+    assert '- product type: desk fan' in context
+
+
+def test_product_context_without_attributes_is_the_summary():
+    assert product_context(SUMMARY, None, []) == SUMMARY
+    assert product_context(SUMMARY, {}, []) == SUMMARY
@@ -0,0 +1,33 @@
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+
+from services.rate_limiter import FairRateLimiter, get_rate_limiter_stats
+
+
+@pytest.fixture
+def redis_client():
+    return fakeredis.FakeRedis(decode_responses=True)
+
+
+def test_grants_within_burst(redis_client):
+    limiter = FairRateLimiter(redis_client, rate=100, burst=5, max_wait=2)
+    assert all(limiter.acquire("analysis:a", 1.0) for _ in range(5))
+    assert limiter.get_stats()['queue_depth'] == 0
+
+
+def test_flow_state_expires_with_the_flow(redis_client):
+    limiter = FairRateLimiter(redis_client, rate=100, burst=50, max_wait=2)
+    for i in range(10):
+        limiter.acquire(f"analysis:{i}", 1.0)
+
+    flow_keys = redis_client.keys("llm_rate:flow:*")
+    assert len(flow_keys) == 10
+    assert all(0 < redis_client.ttl(key) <= 60 for key in flow_keys)
+    # No shared per-flow hash that would keep every analysis forever
+    assert not redis_client.exists("llm_rate:flows")
+
+
+def test_disabled_by_default(monkeypatch):
+    monkeypatch.setenv("REDIS_URL", "redis://localhost:6379/0")
+    assert get_rate_limiter_stats() == {'enabled': False}
@@ -0,0 +1,96 @@
+import re
+import asyncio
+
+import pytest
+
+import services.llm_engine as llm_engine
+from services.norm_index import get_norm_index
+from services.norm_matcher import load_norms
+from services.reanalysis import plan_reanalysis, reanalyze, changed_dimensions, changed_attributes
+from services.verdict_model import norm_key
+
+# Both databases have a norm with the id "Chemical Registration"
+DATABASES = ['norms.json', 'norms_mexico.json', 'norms_taiwan.json']
+OLD = "Smart WiFi thermostat powered by 230V AC mains, 5W, with a lithium battery backup. Used in homes."
+NEW = "Smart WiFi thermostat powered by 24V DC, 5W, with a lithium battery backup. Used in homes."
+
+
+@pytest.fixture
+def checked(monkeypatch):
+    """Fake OpenRouter that answers every norm (yes for every third) and records the norms it saw"""
+    names = []
+
+    async def call(messages, **kwargs):
+        await asyncio.sleep(0)
+        text = messages[-1]['content']
+        blocks = re.findall(r'^\[(\d+)\] NORM: ([^\n]*)', text, re.M)
+        if not blocks:
+            names.append(re.search(r'^NORM: ([^\n]*)', text, re.M).group(1))
+            return {"success": True, "content": "APPLIES: no\nCONFIDENCE: 80\nREASONING: r"}
+        names.extend(name for _, name in blocks)
+        return {"success": True, "content": "\n\n".join(
+            f"[{i}]\nAPPLIES: {'yes' if int(i) % 3 == 0 else 'no'}\nCONFIDENCE: 80\nREASONING: r" for i, _ in blocks
+        )}
+
+    monkeypatch.setattr(llm_engine, 'call_openrouter_async', call)
+    return names
+
+
+OPTIONS = {'coalesce': False, 'use_cache': False, 'use_model': False, 'use_rules': False, 'use_graph': False,
+           'category_triage': False, 'cascade': False}
+
+
+def full_results():
+    _, all_results, stats = reanalyze(None, OLD, [], DATABASES, **OPTIONS)
+    assert stats['mode'] == 'full'
+    return all_results
+
+
+def test_changed_dimensions_and_attributes():
+    assert changed_dimensions({'voltage': [('voltage', 230.0, 230.0, 'AC')]},
+                              {'voltage': [('voltage', 24.0, 24.0, 'DC')], 'power': []}) == {'voltage'}
+    assert changed_attributes({'material': 'steel'}, {'material': 'wood'}) == {'material'}
+    assert changed_attributes(None, {'material': 'wood'}) == set()
+
+
+def test_unchanged_description_rechecks_nothing():
+    recheck, reasons, dimensions = plan_reanalysis(OLD, OLD + "  ", [], DATABASES)
+    assert recheck == [] and not reasons and not dimensions
+
+
+def test_recheck_keys_name_the_database(checked):
+    recheck, reasons, dimensions = plan_reanalysis(OLD, NEW, full_results(), DATABASES)
+    assert 'voltage' in dimensions
+    assert reasons['quantity'] > 0
+    assert len(recheck) == len(set(recheck))
+    catalog_keys = {norm_key(norm) for norm in get_norm_index(DATABASES, load_norms).norms}
+    assert set(recheck) <= catalog_keys
+
+
+def test_incremental_run_checks_only_planned_norms(checked):
+    previous = full_results()
+    recheck, _, _ = plan_reanalysis(OLD, NEW, previous, DATABASES)
+    planned = [norm for norm in get_norm_index(DATABASES, load_norms).norms if norm_key(norm) in set(recheck)]
+    del checked[:]
+
+    matched, all_results, stats = reanalyze(OLD, NEW, previous, DATABASES, **OPTIONS)
+    assert stats['mode'] == 'incremental'
+    assert stats['rechecked'] == len(planned)
+    assert sorted(checked) == sorted(f"{norm['name']} ({norm['id']})" for norm in planned)
+    assert len(all_results) == len(previous)
+    assert all(result['applies'] for result in matched)
+
+
+def test_no_previous_verdicts_runs_full_analysis(checked):
+    _, all_results, stats = reanalyze(OLD, NEW, [], DATABASES, **OPTIONS)
+    assert stats['mode'] == 'full'
+    assert stats['rechecked'] == len(all_results) > 0
+
+
+def test_norm_keys_select_one_database(checked):
+    from services.norm_matcher import match_norms_streaming
+
+    events = list(match_norms_streaming(NEW, allowed_databases=DATABASES,
+                                        norm_keys=['norms_mexico.json:Chemical Registration'], **OPTIONS))
+    assert len(events[-1][2]) == 1
+    assert len(checked) == 1
@@ -0,0 +1,72 @@
+import asyncio
+
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+
+from services import singleflight
+from services.singleflight import SingleFlight, _encode_event, analysis_key
+
+
+def test_analysis_key_ignores_database_order_and_whitespace():
+    assert analysis_key("Kettle  230V", ['b.json', 'a.json']) == analysis_key("kettle 230V", ['a.json', 'b.json'])
+    assert analysis_key("Kettle", options={'top_k': 1}) != analysis_key("Kettle", options={'top_k': 2})
+
+
+def events():
+    return [
+        ('progress', 1, 3, 'A'),
+        ('verdict', {'norm_id': 'B', 'norm_name': 'b', 'applies': True}),
+        ('progress', 2, 3, 'B'),
+        ('progress', 3, 3, 'C'),
+        ('complete', [], []),
+    ]
+
+
+async def computation():
+    for event in events():
+        await asyncio.sleep(0)
+        yield event
+
+
+def test_local_subscribers_share_one_computation():
+    flights = SingleFlight()
+    started = []
+
+    def factory():
+        started.append(1)
+        return computation()
+
+    async def collect():
+        return [event async for event in flights.subscribe('k', factory)]
+
+    async def main():
+        return await asyncio.gather(collect(), collect())
+
+    first, second = asyncio.run(main())
+    assert first == second == events()
+    assert len(started) == 1
+
+
+def test_rerun_after_lost_leader_does_not_repeat_events(monkeypatch):
+    monkeypatch.setattr(singleflight, 'SINGLEFLIGHT_FOLLOW_BLOCK_MS', 10)
+    redis_client = fakeredis.FakeRedis(decode_responses=True)
+    flights = SingleFlight(redis_client)
+
+    # Another process claimed the analysis and got as far as the verdict
+    redis_client.set('singleflight:k', 'other')
+    for event in events()[:3]:
+        redis_client.xadd('singleflight:k:other', {'t': 'event', 'e': _encode_event(event)})
+
+    async def collect():
+        received = []
+        async for event in flights.subscribe('k', computation):
+            received.append(event)
+            if len(received) == 3:
+                # ... and then died, letting its lock lapse
+                redis_client.delete('singleflight:k')
+        return received
+
+    received = asyncio.run(collect())
+    assert received == events()
+    assert flights.remote_coalesced == 1 and flights.started == 1
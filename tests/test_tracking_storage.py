@@ -0,0 +1,170 @@
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+
+from services.tracking_storage import TrackingStorage, encode_event, decode_event
+
+
+@pytest.fixture
+def redis_client():
+    return fakeredis.FakeRedis(decode_responses=True)
+
+
+def page_views(session_id, pages):
+    return [{'session_id': session_id, 'event_type': 'page_view', 'page': page,
+             'timestamp': '2026-10-16T12:00:00.000Z'} for page in pages]
+
+
+def test_page_registry_backfills_older_pages_once(redis_client, monkeypatch):
+    redis_client.hset('t:page_metrics:/old', mapping={'views': 7, 'scroll_75': 1})
+    redis_client.hset('t:page_metrics:/a:b', mapping={'views': 3})
+    storage = TrackingStorage(redis_client, 't')
+
+    pages = storage.get_all_page_metrics()
+    assert [(page['page'], page['views']) for page in pages] == [('/old', 7), ('/a:b', 3)]
+
+    scans = []
+    monkeypatch.setattr(storage, '_backfill_page_registry', lambda: scans.append(1))
+    redis_client.delete('t:page_registry')
+    assert storage.get_all_page_metrics() == []
+    assert storage.get_all_page_metrics() == []
+    assert scans == []
+
+
+def test_page_registry_pagination_and_expiry(redis_client):
+    storage = TrackingStorage(redis_client, 't', use_script=False)
+    storage.ingest_events(page_views('s1', ['/a'] * 3 + ['/b'] * 2 + ['/c']), {})
+
+    assert [page['page'] for page in storage.get_all_page_metrics(offset=1, limit=2)] == ['/b', '/c']
+    assert storage.count_tracked_pages() == 3
+    assert storage.get_total_page_views() == 6
+
+    # Pages whose metrics expired drop out of the registry
+    redis_client.delete('t:page_metrics:/b')
+    assert [page['page'] for page in storage.get_all_page_metrics()] == ['/a', '/c']
+    assert storage.count_tracked_pages() == 2
+
+
+def test_event_codec_round_trips_unknown_types_and_fields(redis_client):
+    storage = TrackingStorage(redis_client, 't', use_script=False)
+    events = [
+        {'session_id': 's1', 'timestamp': '2026-10-16T12:00:00.123Z', 'event_type': 'page_view',
+         'page': '/', 'screen_width': 1920, 'language': 'de-DE', 'custom': {'a': 1}},
+        {'session_id': 's1', 'timestamp': 12345, 'event_type': 3, 'page': '/b'},
+        {'session_id': 's1', 'timestamp': '2026-10-16T12:00:01Z', 'event_type': 'made_up',
+         'page': '/c', 'screen_width': None},
+    ]
+    storage.ingest_events([dict(event) for event in events], {})
+
+    decoded = storage.get_session_events('s1')
+    assert decoded[0] == events[0]
+    assert decoded[1]['event_type'] == 3 and decoded[1]['timestamp'] == 12345
+    assert decoded[2] == {key: value for key, value in events[2].items() if key != 'screen_width'}
+
+
+def test_event_codec_treats_null_invariants_as_absent():
+    record, invariants = encode_event({'event_type': 'click', 'screen_width': None, 'language': ''})
+    assert invariants == {}
+
+    # Sessions written before null fields were left out stored the string "None"
+    record, _ = encode_event({'event_type': 'click', 'screen_width': 1920})
+    event = decode_event(record, 's1', {'screen_width': 'None'})
+    assert 'screen_width' not in event
+
+
+def redis_state(redis_client):
+    state = {}
+    for key in sorted(redis_client.keys('*')):
+        kind = redis_client.type(key)
+        if kind == 'hash':
+            value = {field: v for field, v in redis_client.hgetall(key).items()
+                     if field not in ('first_seen', 'last_seen')}
+        elif kind == 'list':
+            value = redis_client.lrange(key, 0, -1)
+        elif kind == 'zset':
+            value = redis_client.zrange(key, 0, -1, withscores=True)
+        elif kind == 'set':
+            value = sorted(redis_client.smembers(key))
+        else:
+            value = redis_client.pfcount(key) if 'unique_visitors' in key else redis_client.get(key)
+        state[key] = (kind, value, redis_client.ttl(key) > 0)
+    return state
+
+
+@pytest.mark.parametrize('unique_visitors', ['exact', 'approximate'])
+def test_script_and_pipeline_ingest_write_the_same_state(unique_visitors):
+    batches = [
+        page_views('s1', ['/', '/a']),
+        [{'session_id': 's2', 'event_type': 'scroll_depth', 'page': '/b:c', 'depth_percent': 95,
+          'timestamp': 't', 'user_agent': 'UA', 'language': 'de'}],
+        [{'session_id': 's1', 'event_type': 'click', 'page': None, 'time_on_page': 12, 'timestamp': 't'},
+         {'session_id': 's1', 'event_type': 'time_on_page', 'page': '/a', 'time_on_page': 30, 'timestamp': 't'}],
+    ]
+    states = []
+    for use_script in (True, False):
+        redis_client = fakeredis.FakeRedis(decode_responses=True)
+        storage = TrackingStorage(redis_client, 't', unique_visitors=unique_visitors, use_script=use_script)
+        stored = sum(storage.ingest_events([dict(event) for event in batch], {'event_count': len(batch)})
+                     for batch in batches)
+        assert stored == 5
+        states.append(redis_state(redis_client))
+
+    assert states[0] == states[1]
+
+
+def counter_state(redis_client):
+    return {key: value for key, value in redis_state(redis_client).items()
+            if key.split(':')[1] in ('page_metrics', 'page_registry', 'hourly_events')}
+
+
+def unreachable(self, *args, **kwargs):
+    raise ConnectionError('down')
+
+
+def test_buffered_counters_match_direct_writes_after_close():
+    batches = [page_views('s1', ['/', '/a']), page_views('s2', ['/a'] * 3), page_views('s1', ['/b:c'])]
+    states = []
+    for buffered in (False, True):
+        redis_client = fakeredis.FakeRedis(decode_responses=True)
+        storage = TrackingStorage(redis_client, 't', buffer_counters=buffered, flush_interval_ms=60000)
+        for batch in batches:
+            storage.ingest_events(batch, {})
+        if buffered:
+            assert counter_state(redis_client) == {}
+        storage.close()
+        states.append(counter_state(redis_client))
+
+    assert states[0] == states[1] != {}
+
+
+def test_failed_flush_keeps_counters_for_the_next_one(redis_client, monkeypatch):
+    from redis.client import Pipeline
+
+    storage = TrackingStorage(redis_client, 't', buffer_counters=True, flush_interval_ms=60000)
+    storage.ingest_events(page_views('s1', ['/'] * 3), {})
+    buffer = storage.counter_buffer
+
+    execute = Pipeline.execute
+    monkeypatch.setattr(Pipeline, 'execute', unreachable)
+    assert buffer.flush() == 0
+    assert buffer.get_stats()['pending_events'] == 3
+
+    monkeypatch.setattr(Pipeline, 'execute', execute)
+    assert buffer.flush() == 3
+    assert redis_client.hget('t:page_metrics:/', 'views') == '3'
+    storage.close()
+
+
+def test_failed_flush_drops_counters_beyond_the_pending_limit(redis_client, monkeypatch):
+    from redis.client import Pipeline
+
+    storage = TrackingStorage(redis_client, 't', buffer_counters=True, flush_interval_ms=60000)
+    buffer = storage.counter_buffer
+    buffer.max_pending_events = 2
+    storage.ingest_events(page_views('s1', ['/'] * 3), {})
+
+    monkeypatch.setattr(Pipeline, 'execute', unreachable)
+    assert buffer.flush() == 0
+    assert buffer.dropped_events == 3
+    assert buffer.get_stats()['pending_events'] == 0
+    storage.close()
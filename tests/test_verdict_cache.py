@@ -0,0 +1,26 @@
+from services.verdict_cache import VerdictCache, product_fingerprint
+
+NORM = {'id': 'EN 60335-1', 'applies_to': 'Household appliances', 'description': 'Safety'}
+
+
+def test_fingerprint_ignores_case_and_whitespace():
+    assert product_fingerprint('Desk fan  230V\n') == product_fingerprint('desk FAN 230v')
+    assert product_fingerprint('Desk fan 230V') != product_fingerprint('Desk fan 120V')
+
+
+def test_key_changes_with_norm_content_model_and_prompt_version():
+    cache = VerdictCache()
+    key = cache.make_key('Desk fan', NORM, 'model-a', 1)
+
+    assert cache.make_key(' desk fan ', dict(NORM), 'model-a', 1) == key
+    assert cache.make_key('Desk fan', dict(NORM, description='Safety, amended'), 'model-a', 1) != key
+    assert cache.make_key('Desk fan', NORM, 'model-b', 1) != key
+    assert cache.make_key('Desk fan', NORM, 'model-a', 2) != key
+
+
+def test_local_store_round_trip_and_size_bound():
+    cache = VerdictCache(max_entries=2)
+    keys = [cache.make_key(f'product {i}', NORM, 'model-a', 1) for i in range(3)]
+    cache.set_many({key: {'applies': True, 'confidence': i} for i, key in enumerate(keys)})
+
+    assert cache.get_many(keys) == [None, {'applies': True, 'confidence': 1}, {'applies': True, 'confidence': 2}]
@@ -0,0 +1,54 @@
+import json
+
+from services.verdict_model import VerdictDataset, norm_key, product_features
+
+NORMS = [{'id': f'N{i}', 'name': f'n{i}', 'source_database': 'norms.json'} for i in range(3)]
+
+
+def verdicts(applies=True):
+    return [(norm, {'applies': applies, 'confidence': 90}) for norm in NORMS]
+
+
+def test_product_described_once(tmp_path):
+    dataset = VerdictDataset(str(tmp_path / 'dataset.jsonl'))
+    dataset.log_many("Kettle 230V", {'voltages': ['230V AC']}, verdicts(), 'm')
+    dataset.log_many("Kettle 230V", {'voltages': ['230V AC']}, verdicts(False), 'm')
+
+    lines = [json.loads(line) for line in (tmp_path / 'dataset.jsonl').read_text().splitlines()]
+    assert sum(1 for line in lines if line.get('type') == 'product') == 1
+    assert all('description' not in line for line in lines if line.get('type') != 'product')
+
+    rows = dataset.read()
+    assert len(rows) == 3
+    assert {row['norm'] for row in rows} == {norm_key(norm) for norm in NORMS}
+    assert all(row['description'] == "Kettle 230V" and not row['applies'] for row in rows)
+
+
+def test_product_record_survives_restart(tmp_path):
+    path = str(tmp_path / 'dataset.jsonl')
+    VerdictDataset(path).log_many("Kettle", None, verdicts(), 'm')
+    VerdictDataset(path).log_many("Kettle", None, verdicts(), 'm')
+    text = (tmp_path / 'dataset.jsonl').read_text()
+    assert text.count('"type": "product"') == 1
+
+
+def test_rotation_keeps_one_previous_file(tmp_path):
+    path = tmp_path / 'dataset.jsonl'
+    dataset = VerdictDataset(str(path), max_bytes=200)
+    for i in range(6):
+        dataset.log_many(f"Product {i}", None, verdicts(), 'm')
+
+    assert dataset.rotations >= 2
+    assert path.stat().st_size < 1000
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['dataset.jsonl', 'dataset.jsonl.1']
+
+    # Every verdict still readable has its product's description attached
+    rows = dataset.read()
+    assert rows and all(row['description'].startswith("Product ") for row in rows)
+
+
+def test_product_features():
+    features = product_features("WiFi kettle", {'voltages': ['230V AC']})
+    assert 'w=wifi' in features
+    assert 'voltages=230v ac' in features
+    assert any(feature.startswith('voltage:') for feature in features)